@@ -1,28 +1,113 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from botocore.config import Config
 import cfnresponse
 
 print("Loading function")
 
+FILTER_NAME = 'lambda-cloudwatch-trigger'
+# PutSubscriptionFilter is limited to 5 requests per second per account and region
+MAX_WORKERS = 5
+# the whole custom resource response is limited to 4096 bytes
+MAX_FAILED_GROUPS_LENGTH = 2048
+
+# the adaptive retry mode backs off and slows the client down when the requests are throttled
+cloudwatch_logs = boto3.client('logs', config=Config(retries={'max_attempts': 10, 'mode': 'adaptive'}))
+
+
+def parse_log_groups(value):
+    return list(dict.fromkeys(log_group.strip() for log_group in value.split(',') if log_group.strip()))
+
+
+def subscribe(log_group, destination_arn):
+    try:
+        cloudwatch_logs.put_subscription_filter(
+            destinationArn=destination_arn,
+            filterName=FILTER_NAME,
+            filterPattern='',
+            logGroupName=log_group
+        )
+        return True
+    except Exception as e:
+        print("Failed to subscribe", log_group, ":", e)
+        return False
+
+
+def unsubscribe(log_group):
+    try:
+        cloudwatch_logs.delete_subscription_filter(
+            filterName=FILTER_NAME,
+            logGroupName=log_group
+        )
+        return True
+    except cloudwatch_logs.exceptions.ResourceNotFoundException:
+        # the log group or its subscription filter is already gone
+        return True
+    except Exception as e:
+        print("Failed to unsubscribe", log_group, ":", e)
+        return False
+
+
+def reconcile(to_subscribe, to_unsubscribe, destination_arn):
+    # subscribe and unsubscribe the log groups in one pool of workers,
+    # returns the log groups that could not be subscribed and the ones that could not be unsubscribed
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        subscribed = executor.map(lambda log_group: subscribe(log_group, destination_arn), to_subscribe)
+        unsubscribed = executor.map(unsubscribe, to_unsubscribe)
+        return (
+            [log_group for log_group, done in zip(to_subscribe, subscribed) if not done],
+            [log_group for log_group, done in zip(to_unsubscribe, unsubscribed) if not done],
+        )
+
+
+def join_limited(log_groups, limit):
+    text = ','.join(log_groups)
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(',', 1)[0] + ',...'
+
+
 def lambda_handler(event, context):
     print("Received event:", json.dumps(event, indent=2))
-    try:        
+    responseData = {}
+    try:
         lambda_arn = event['ResourceProperties']['LambdaArn']
-        lambda_client = boto3.client('lambda')
-
-        if event['RequestType'] in ['Create', 'Update']:
-            StringlogGroupName = event['ResourceProperties']['CloudwatchGroup']
-            logGroupName = StringlogGroupName.split(',')
-            cloudwatch_logs = boto3.client('logs')
-            for log_group in logGroupName:
-                cloudwatch_logs.put_subscription_filter(
-                    destinationArn=event['ResourceProperties']['LambdaArn'],
-                    filterName='lambda-cloudwatch-trigger',
-                    filterPattern='',
-                    logGroupName=log_group
-                )
+        log_groups = parse_log_groups(event['ResourceProperties']['CloudwatchGroup'])
+        if event['RequestType'] == 'Delete':
+            to_subscribe, to_unsubscribe = [], log_groups
+        elif event['RequestType'] == 'Update':
+            # only the difference with the previous properties is applied. a request fails when a log group
+            # cannot be changed, so the previous properties were fully applied and a failed update is rolled
+            # back or sent again with the same previous properties, retrying the failed log groups
+            old_properties = event.get('OldResourceProperties', {})
+            old_log_groups = parse_log_groups(old_properties.get('CloudwatchGroup', ''))
+            old_log_group_set, log_group_set = set(old_log_groups), set(log_groups)
+            to_subscribe = log_groups
+            if old_properties.get('LambdaArn') == lambda_arn:
+                # the log groups of the previous properties are already subscribed to the same lambda
+                to_subscribe = [log_group for log_group in log_groups if log_group not in old_log_group_set]
+            to_unsubscribe = [log_group for log_group in old_log_groups if log_group not in log_group_set]
+        else:
+            to_subscribe, to_unsubscribe = log_groups, []
+        failed_subscribe, failed_unsubscribe = reconcile(to_subscribe, to_unsubscribe, lambda_arn)
+        responseData = {
+            'LogGroups': len(log_groups),
+            'Subscribed': len(to_subscribe) - len(failed_subscribe),
+            'Unsubscribed': len(to_unsubscribe) - len(failed_unsubscribe),
+            'Unchanged': len(log_groups) - len(to_subscribe) if event['RequestType'] != 'Delete' else 0,
+            'Failed': len(failed_subscribe) + len(failed_unsubscribe),
+            'FailedLogGroups': join_limited(failed_subscribe + failed_unsubscribe, MAX_FAILED_GROUPS_LENGTH),
+        }
+        # a delete that cannot remove some subscription filters still succeeds, so the stack is not stuck
+        if failed_subscribe:
+            raise Exception("%d of the %d log groups could not be subscribed: %s" % (
+                len(failed_subscribe), len(to_subscribe), responseData['FailedLogGroups']))
+        if failed_unsubscribe and event['RequestType'] == 'Update':
+            raise Exception("%d of the %d dropped log groups could not be unsubscribed: %s" % (
+                len(failed_unsubscribe), len(to_unsubscribe), responseData['FailedLogGroups']))
         responseStatus = cfnresponse.SUCCESS
-        print(event['RequestType'], "request completed....")
+        print(event['RequestType'], "request completed....", responseData)
     except Exception as e:
         print("Failed to process:", e)
         responseStatus = cfnresponse.FAILED
@@ -32,6 +117,6 @@ def lambda_handler(event, context):
             event,
             context,
             responseStatus,
-            {},
+            responseData,
             event.get('PhysicalResourceId', context.aws_request_id)
         )
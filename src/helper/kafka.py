@@ -10,6 +10,19 @@ import cfnresponse
 
 client = boto3.client("lambda")
 
+# the mapping state is polled quickly at first and then less often, up to POLL_MAX_DELAY seconds
+POLL_INITIAL_DELAY = 0.5
+POLL_MAX_DELAY = 10
+# the waits stop when less than this is left before the lambda timeout, to still send the response
+RESPONSE_MARGIN_MILLIS = 10000
+# limits of the optional throughput properties, checked before any mapping is changed
+PROPERTY_LIMITS = {
+    "BatchSize": (1, 10000),
+    "BatchingWindow": (0, 300),
+    "MinimumPollers": (1, 200),
+    "MaximumPollers": (1, 2000),
+}
+
 
 def is_event_source_mapping_uuid(value):
     try:
@@ -19,74 +32,206 @@ def is_event_source_mapping_uuid(value):
         return False
 
 
+def wait_until(condition, context, description):
+    # returns the seconds it took for condition() to be true
+    start = time.monotonic()
+    delay = POLL_INITIAL_DELAY
+    while not condition():
+        remaining = (context.get_remaining_time_in_millis() - RESPONSE_MARGIN_MILLIS) / 1000
+        if remaining <= 0:
+            raise TimeoutError("Timed out waiting for " + description)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, POLL_MAX_DELAY)
+    return round(time.monotonic() - start, 1)
+
+
+def is_deleted(mapping_uuid):
+    try:
+        client.get_event_source_mapping(UUID=mapping_uuid)
+        return False
+    except client.exceptions.ResourceNotFoundException:
+        return True
+
+
+def is_ready(mapping_uuid):
+    state = client.get_event_source_mapping(UUID=mapping_uuid)["State"]
+    if state == "Deleting":
+        raise Exception("EventSourceMapping %s is being deleted" % mapping_uuid)
+    return state in ["Enabled", "Disabled"]
+
+
+def validate_properties(properties):
+    for key, (minimum, maximum) in PROPERTY_LIMITS.items():
+        if properties.get(key, "") == "":
+            continue
+        try:
+            value = int(properties[key])
+        except (TypeError, ValueError):
+            raise ValueError("%s must be a number, got %s" % (key, properties[key]))
+        if not minimum <= value <= maximum:
+            raise ValueError("%s must be between %d and %d, got %d" % (key, minimum, maximum, value))
+    if properties.get("MinimumPollers", "") != "" and properties.get("MaximumPollers", "") != "":
+        if int(properties["MinimumPollers"]) > int(properties["MaximumPollers"]):
+            raise ValueError("MinimumPollers must not be greater than MaximumPollers")
+    if len(properties.get("ConsumerGroupId", "")) > 200:
+        raise ValueError("ConsumerGroupId must be at most 200 characters")
+
+
+def tuning_arguments(properties, old_properties=None):
+    # the batching window and the provisioned pollers can be set on create and on update.
+    # lambda keeps the previous values of a mapping when they are not passed on update, so a
+    # batching window removed since old_properties is set to 0 seconds, not to the 500 ms
+    # that lambda uses for a new kafka mapping, and removed pollers send an empty poller config
+    old_properties = old_properties or {}
+    arguments = {}
+    if properties.get("BatchingWindow", "") != "":
+        arguments["MaximumBatchingWindowInSeconds"] = int(properties["BatchingWindow"])
+    elif old_properties.get("BatchingWindow", "") != "":
+        arguments["MaximumBatchingWindowInSeconds"] = 0
+    pollers = {}
+    for key in ["MinimumPollers", "MaximumPollers"]:
+        if properties.get(key, "") != "":
+            pollers[key] = int(properties[key])
+    if pollers or any(old_properties.get(key, "") != "" for key in ["MinimumPollers", "MaximumPollers"]):
+        arguments["ProvisionedPollerConfig"] = pollers
+    return arguments
+
+
+def source_access_configurations(properties):
+    return list([
+        {
+            "Type": "VPC_SUBNET",
+            "URI": "subnet:" + subnetId
+        } for subnetId in properties["SubnetIds"]
+    ]) + list([
+        {
+            "Type": "VPC_SECURITY_GROUP",
+            "URI": "security_group:" + securityGroupId
+        } for securityGroupId in properties["SecurityGroupIds"]
+    ])
+
+
+def create_mapping(properties, context, timings):
+    arguments = tuning_arguments(properties)
+    if properties.get("ConsumerGroupId", "") != "":
+        arguments["SelfManagedKafkaEventSourceConfig"] = {"ConsumerGroupId": properties["ConsumerGroupId"]}
+    response = client.create_event_source_mapping(
+        FunctionName=properties["Function"],
+        BatchSize=int(properties["BatchSize"]),
+        StartingPosition=properties["StartingPosition"],
+        Topics=[
+            properties["Topic"]
+        ],
+        SelfManagedEventSource={
+            "Endpoints": {
+                "KAFKA_BOOTSTRAP_SERVERS": properties["Brokers"]
+            }
+        },
+        SourceAccessConfigurations=source_access_configurations(properties),
+        **arguments
+    )
+    mapping_uuid = response["UUID"]
+    try:
+        timings["CreateSeconds"] = wait_until(
+            lambda: is_ready(mapping_uuid), context, "the creation of " + mapping_uuid
+        )
+    except Exception:
+        # a mapping that is not ready is not returned to cloudformation, remove it
+        # so it does not consume next to the mapping it should have replaced
+        client.delete_event_source_mapping(UUID=mapping_uuid)
+        raise
+    print("EventSourceMapping successfully created:", mapping_uuid)
+    return mapping_uuid
+
+
+def update_mapping(mapping_uuid, old_properties, properties, context, timings):
+    client.update_event_source_mapping(
+        UUID=mapping_uuid,
+        FunctionName=properties["Function"],
+        BatchSize=int(properties["BatchSize"]),
+        SourceAccessConfigurations=source_access_configurations(properties),
+        **tuning_arguments(properties, old_properties)
+    )
+    timings["UpdateSeconds"] = wait_until(
+        lambda: is_ready(mapping_uuid), context, "the update of " + mapping_uuid
+    )
+    print("EventSourceMapping successfully updated:", mapping_uuid)
+
+
+def delete_mapping(mapping_uuid, context, timings, wait):
+    try:
+        client.delete_event_source_mapping(UUID=mapping_uuid)
+    except client.exceptions.ResourceNotFoundException:
+        return
+    if wait:
+        timings["DeleteSeconds"] = wait_until(
+            lambda: is_deleted(mapping_uuid), context, "the deletion of " + mapping_uuid
+        )
+    print("EventSourceMapping successfully deleted:", mapping_uuid)
+
+
+def update_strategy(old_properties, properties):
+    # the function, batch size, batching window, pollers and network settings of a mapping can be updated in place.
+    # a new topic or brokers can be consumed by a new mapping while the old one is still running,
+    # but lambda rejects a second mapping of the same function, topic and brokers
+    if all(old_properties.get(key) == properties.get(key) for key in ["Topic", "Brokers", "StartingPosition", "ConsumerGroupId"]):
+        return "InPlace"
+    if all(old_properties.get(key) == properties.get(key) for key in ["Function", "Topic", "Brokers"]):
+        return "DeleteBeforeCreate"
+    return "CreateBeforeDelete"
+
+
 def lambda_handler(event, context):
     print("Received event:", json.dumps(event, indent=2))
 
     responseStatus = "SUCCESS"
     physicalResourceId = event.get("PhysicalResourceId")
+    # the update strategy and the seconds spent waiting for the mappings
+    responseData = {}
+    start = time.monotonic()
 
     try:
         print("Request Type:", event["RequestType"])
+        properties = event["ResourceProperties"]
         if event["RequestType"] in ["Create", "Update"]:
-            if event["RequestType"] == "Update":
+            validate_properties(properties)
+        if event["RequestType"] == "Create":
+            physicalResourceId = create_mapping(properties, context, responseData)
+        elif event["RequestType"] == "Update":
+            old_properties = event.get("OldResourceProperties", {})
+            if is_event_source_mapping_uuid(physicalResourceId):
+                strategy = update_strategy(old_properties, properties)
+            else:
+                print("Skipping delete for non-mapping PhysicalResourceId:", physicalResourceId)
+                strategy = "Create"
+            responseData["UpdateStrategy"] = strategy
+            print("EventSourceMapping update strategy:", strategy)
+            if strategy == "InPlace":
+                update_mapping(physicalResourceId, old_properties, properties, context, responseData)
+            elif strategy == "CreateBeforeDelete":
+                # the old mapping keeps consuming until the new one is ready. the new id is returned
+                # even if the old mapping cannot be deleted now, cloudformation then sends a delete
+                # request for the old id during the cleanup of the stack update
+                oldPhysicalResourceId = physicalResourceId
+                physicalResourceId = create_mapping(properties, context, responseData)
                 try:
-                    print("EventSourceMapping recreation")
-                    if is_event_source_mapping_uuid(physicalResourceId):
-                        client.delete_event_source_mapping(UUID=physicalResourceId)
-                        while True:
-                            client.get_event_source_mapping(UUID=physicalResourceId)
-                            time.sleep(10)
-                    else:
-                        print("Skipping delete for non-mapping PhysicalResourceId:", physicalResourceId)
-                except client.exceptions.ResourceNotFoundException:
-                    pass
-
-            response = client.create_event_source_mapping(
-                FunctionName=event["ResourceProperties"]["Function"],
-                BatchSize=int(event["ResourceProperties"]["BatchSize"]),
-                StartingPosition=event["ResourceProperties"]["StartingPosition"],
-                Topics=[
-                    event["ResourceProperties"]["Topic"]
-                ],
-                SelfManagedEventSource={
-                    "Endpoints": {
-                        "KAFKA_BOOTSTRAP_SERVERS": event["ResourceProperties"]["Brokers"]
-                    }
-                },
-                SourceAccessConfigurations=list([
-                    {
-                        "Type": "VPC_SUBNET",
-                        "URI": "subnet:" + subnetId
-                    } for subnetId in event["ResourceProperties"]["SubnetIds"]
-                ]) + list([
-                    {
-                        "Type": "VPC_SECURITY_GROUP",
-                        "URI": "security_group:" + securityGroupId
-                    } for securityGroupId in event["ResourceProperties"]["SecurityGroupIds"]
-                ])
-            )
-
-            physicalResourceId = response["UUID"]
-
-            while True:
-                response = client.get_event_source_mapping(UUID=physicalResourceId)
-                if response["State"] in ["Enabled", "Disabled"]:
-                    break
-                time.sleep(10)
-
-            print("EventSourceMapping successfully created")
+                    delete_mapping(oldPhysicalResourceId, context, responseData, wait=False)
+                except Exception as exc:
+                    print("Failed to delete the replaced EventSourceMapping", oldPhysicalResourceId, ":", exc)
+            elif strategy == "DeleteBeforeCreate":
+                delete_mapping(physicalResourceId, context, responseData, wait=True)
+                physicalResourceId = create_mapping(properties, context, responseData)
+            else:
+                physicalResourceId = create_mapping(properties, context, responseData)
         elif event["RequestType"] == "Delete":
-            try:
-                if is_event_source_mapping_uuid(physicalResourceId):
-                    client.delete_event_source_mapping(UUID=physicalResourceId)
-                else:
-                    print("Skipping delete for non-mapping PhysicalResourceId:", physicalResourceId)
-            except client.exceptions.ResourceNotFoundException:
-                pass
-            print("EventSourceMapping successfully deleted")
+            if is_event_source_mapping_uuid(physicalResourceId):
+                delete_mapping(physicalResourceId, context, responseData, wait=False)
+            else:
+                print("Skipping delete for non-mapping PhysicalResourceId:", physicalResourceId)
 
     except Exception as exc:
         print("Failed to process:", exc)
         responseStatus = "FAILED"
     finally:
-        cfnresponse.send(event, context, responseStatus, {}, physicalResourceId)
+        responseData["TotalSeconds"] = round(time.monotonic() - start, 1)
+        cfnresponse.send(event, context, responseStatus, responseData, physicalResourceId)
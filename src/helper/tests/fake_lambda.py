@@ -0,0 +1,77 @@
+"""
+In-process stand-in for the Lambda event source mapping API used by the kafka helper.
+
+Mappings go through the Creating and Deleting states for a configurable number of
+get_event_source_mapping calls before they are Enabled or gone. FakeClock replaces the
+time module of the helper so the waits take no real time.
+"""
+import itertools
+from types import SimpleNamespace
+
+
+class ResourceNotFoundException(Exception):
+    pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeLambdaClient:
+    exceptions = SimpleNamespace(ResourceNotFoundException=ResourceNotFoundException)
+
+    def __init__(self, ready_after=3, deleted_after=3, get_error=None):
+        self.ready_after = ready_after
+        self.deleted_after = deleted_after
+        self.get_error = get_error
+        self.mappings = {}
+        self.calls = []
+        self._ids = itertools.count(1)
+
+    def create_event_source_mapping(self, **kwargs):
+        self.calls.append(("create", kwargs))
+        mapping_uuid = "00000000-0000-0000-0000-%012d" % next(self._ids)
+        self.mappings[mapping_uuid] = dict(kwargs, UUID=mapping_uuid, State="Creating", polls=self.ready_after)
+        return {"UUID": mapping_uuid, "State": "Creating"}
+
+    def update_event_source_mapping(self, UUID, **kwargs):
+        self.calls.append(("update", kwargs))
+        if UUID not in self.mappings:
+            raise ResourceNotFoundException("The resource you requested does not exist.")
+        self.mappings[UUID].update(kwargs, State="Updating", polls=self.ready_after)
+        return {"UUID": UUID, "State": "Updating"}
+
+    def delete_event_source_mapping(self, UUID):
+        self.calls.append(("delete", UUID))
+        if UUID not in self.mappings:
+            raise ResourceNotFoundException("The resource you requested does not exist.")
+        self.mappings[UUID].update(State="Deleting", polls=self.deleted_after)
+        return {"UUID": UUID, "State": "Deleting"}
+
+    def get_event_source_mapping(self, UUID):
+        self.calls.append(("get", UUID))
+        if self.get_error is not None:
+            raise self.get_error
+        if UUID not in self.mappings:
+            raise ResourceNotFoundException("The resource you requested does not exist.")
+        mapping = self.mappings[UUID]
+        if mapping["polls"] > 0:
+            mapping["polls"] -= 1
+        elif mapping["State"] == "Deleting":
+            del self.mappings[UUID]
+            raise ResourceNotFoundException("The resource you requested does not exist.")
+        elif mapping["State"] in ["Creating", "Updating"]:
+            mapping["State"] = "Enabled"
+        return {key: value for key, value in mapping.items() if key != "polls"}
+
+    def operations(self):
+        return [call[0] for call in self.calls if call[0] != "get"]
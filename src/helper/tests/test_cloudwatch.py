@@ -0,0 +1,196 @@
+import importlib.util
+import sys
+import threading
+import time
+import types
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+
+MODULE_PATH = Path(__file__).resolve().parents[1] / "cloudwatch.py"
+
+
+class ResourceNotFoundException(Exception):
+    pass
+
+
+class FakeLogsClient:
+    exceptions = SimpleNamespace(ResourceNotFoundException=ResourceNotFoundException)
+
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.subscriptions = {}
+        self.calls = 0
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def request(self, log_group):
+        with self.lock:
+            self.calls += 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        if log_group in self.missing:
+            raise ResourceNotFoundException("The specified log group does not exist.")
+
+    def put_subscription_filter(self, destinationArn, filterName, filterPattern, logGroupName):
+        self.request(logGroupName)
+        self.subscriptions[logGroupName] = (filterName, destinationArn)
+
+    def delete_subscription_filter(self, filterName, logGroupName):
+        self.request(logGroupName)
+        if logGroupName == "/aws/lambda/denied":
+            raise Exception("User is not authorized to perform: logs:DeleteSubscriptionFilter")
+        if (filterName, LAMBDA_ARN) != self.subscriptions.pop(logGroupName, (filterName, LAMBDA_ARN)):
+            raise AssertionError("deleted the subscription filter of another lambda")
+
+
+def load_cloudwatch_module(logs_client):
+    fake_boto3 = types.ModuleType("boto3")
+    fake_boto3.client = MagicMock(return_value=logs_client)
+
+    fake_botocore = types.ModuleType("botocore")
+    fake_botocore_config = types.ModuleType("botocore.config")
+    fake_botocore_config.Config = MagicMock(name="Config")
+
+    fake_cfnresponse = types.ModuleType("cfnresponse")
+    fake_cfnresponse.SUCCESS = "SUCCESS"
+    fake_cfnresponse.FAILED = "FAILED"
+    fake_cfnresponse.send = MagicMock()
+
+    spec = importlib.util.spec_from_file_location("helper_cloudwatch_test", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+
+    with patch.dict(
+        sys.modules,
+        {
+            "boto3": fake_boto3,
+            "botocore": fake_botocore,
+            "botocore.config": fake_botocore_config,
+            "cfnresponse": fake_cfnresponse,
+        },
+    ), patch("builtins.print"):
+        spec.loader.exec_module(module)
+
+    return module, fake_cfnresponse
+
+
+LAMBDA_ARN = "arn:aws:lambda:us-east-1:123456789012:function:coralogix"
+
+
+def build_event(request_type, log_groups, old_log_groups=None, old_lambda_arn=LAMBDA_ARN):
+    event = {
+        "RequestType": request_type,
+        "ResourceProperties": {"LambdaArn": LAMBDA_ARN, "CloudwatchGroup": ",".join(log_groups)},
+    }
+    if old_log_groups is not None:
+        event["PhysicalResourceId"] = "resource-id"
+        event["OldResourceProperties"] = {"LambdaArn": old_lambda_arn, "CloudwatchGroup": ",".join(old_log_groups)}
+    return event
+
+
+class CloudwatchHelperTests(unittest.TestCase):
+    def setUp(self):
+        self.logs = FakeLogsClient(missing=["/aws/lambda/missing"])
+        self.module, self.cfnresponse = load_cloudwatch_module(self.logs)
+        self.context = SimpleNamespace(aws_request_id="request-id")
+
+    def handle(self, event):
+        with patch("builtins.print"):
+            self.module.lambda_handler(event, self.context)
+        args = self.cfnresponse.send.call_args.args
+        return args[2], args[3]
+
+    def test_log_groups_are_subscribed_concurrently_with_per_group_results(self):
+        log_groups = ["/aws/lambda/service-%03d" % i for i in range(40)]
+
+        status, data = self.handle(build_event("Create", log_groups + ["/aws/lambda/missing", " /aws/lambda/service-000"]))
+
+        # the other log groups are still subscribed, and every result is reported with the failure
+        self.assertEqual("FAILED", status)
+        self.assertEqual(
+            {"LogGroups": 41, "Subscribed": 40, "Unsubscribed": 0, "Unchanged": 0, "Failed": 1, "FailedLogGroups": "/aws/lambda/missing"},
+            data,
+        )
+        self.assertEqual(set(log_groups), set(self.logs.subscriptions))
+        self.assertEqual(("lambda-cloudwatch-trigger", LAMBDA_ARN), self.logs.subscriptions[log_groups[0]])
+        self.assertGreater(self.logs.peak, 1)
+        self.assertLessEqual(self.logs.peak, self.module.MAX_WORKERS)
+
+    def test_update_subscribes_only_the_added_log_groups(self):
+        status, data = self.handle(build_event("Update", ["/aws/lambda/a", "/aws/lambda/b"], old_log_groups=["/aws/lambda/a"]))
+
+        self.assertEqual("SUCCESS", status)
+        self.assertEqual(["/aws/lambda/b"], list(self.logs.subscriptions))
+        self.assertEqual((1, 1), (data["Subscribed"], data["Unchanged"]))
+
+    def test_update_applies_only_the_difference_with_the_old_log_groups(self):
+        old_log_groups = ["/aws/lambda/service-%03d" % i for i in range(100)]
+        self.logs.subscriptions = {log_group: ("lambda-cloudwatch-trigger", LAMBDA_ARN) for log_group in old_log_groups}
+        log_groups = old_log_groups[2:] + ["/aws/lambda/added"]
+
+        status, data = self.handle(build_event("Update", log_groups, old_log_groups=old_log_groups))
+
+        self.assertEqual("SUCCESS", status)
+        self.assertEqual(3, self.logs.calls)
+        self.assertEqual(set(log_groups), set(self.logs.subscriptions))
+        self.assertEqual((1, 2, 98, 0), (data["Subscribed"], data["Unsubscribed"], data["Unchanged"], data["Failed"]))
+
+    def test_failed_update_is_retried_by_the_next_update_of_the_same_properties(self):
+        event = build_event("Update", ["/aws/lambda/a", "/aws/lambda/missing"], old_log_groups=["/aws/lambda/a"])
+
+        status, _ = self.handle(event)
+        self.assertEqual("FAILED", status)
+
+        self.logs.missing.clear()
+        status, data = self.handle(event)
+
+        self.assertEqual("SUCCESS", status)
+        self.assertEqual({"/aws/lambda/missing"}, set(self.logs.subscriptions))
+        self.assertEqual(1, data["Subscribed"])
+
+    def test_update_fails_when_a_dropped_log_group_cannot_be_unsubscribed(self):
+        status, data = self.handle(build_event("Update", ["/aws/lambda/a"], old_log_groups=["/aws/lambda/a", "/aws/lambda/denied"]))
+
+        self.assertEqual("FAILED", status)
+        self.assertEqual("/aws/lambda/denied", data["FailedLogGroups"])
+
+    def test_delete_removes_every_subscription_filter_and_never_fails(self):
+        log_groups = ["/aws/lambda/a", "/aws/lambda/missing", "/aws/lambda/denied"]
+        self.logs.subscriptions = {"/aws/lambda/a": ("lambda-cloudwatch-trigger", LAMBDA_ARN)}
+        event = dict(build_event("Delete", log_groups), PhysicalResourceId="resource-id")
+
+        status, data = self.handle(event)
+
+        self.assertEqual("SUCCESS", status)
+        self.assertEqual({}, self.logs.subscriptions)
+        self.assertEqual((2, 1, "/aws/lambda/denied"), (data["Unsubscribed"], data["Failed"], data["FailedLogGroups"]))
+
+    def test_update_to_another_lambda_subscribes_every_log_group(self):
+        self.handle(build_event("Update", ["/aws/lambda/a", "/aws/lambda/b"], old_log_groups=["/aws/lambda/a"], old_lambda_arn="other"))
+
+        self.assertEqual({"/aws/lambda/a", "/aws/lambda/b"}, set(self.logs.subscriptions))
+
+    def test_fails_when_any_log_group_cannot_be_subscribed(self):
+        status, data = self.handle(build_event("Create", ["/aws/lambda/a", "/aws/lambda/missing"]))
+
+        self.assertEqual("FAILED", status)
+        self.assertEqual((1, 1, "/aws/lambda/missing"), (data["Subscribed"], data["Failed"], data["FailedLogGroups"]))
+
+    def test_failed_log_groups_are_cut_to_fit_the_response(self):
+        log_groups = ["/aws/lambda/%s-%04d" % ("x" * 40, i) for i in range(200)]
+
+        text = self.module.join_limited(log_groups, self.module.MAX_FAILED_GROUPS_LENGTH)
+
+        self.assertLessEqual(len(text), self.module.MAX_FAILED_GROUPS_LENGTH + 4)
+        self.assertTrue(text.endswith(",..."))
+        self.assertTrue(set(text[:-4].split(",")) <= set(log_groups))
+
+
+if __name__ == "__main__":
+    unittest.main()
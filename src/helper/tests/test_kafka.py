@@ -0,0 +1,235 @@
+import importlib.util
+import sys
+import types
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from fake_lambda import FakeClock, FakeLambdaClient
+
+
+MODULE_PATH = Path(__file__).resolve().parents[1] / "kafka.py"
+
+
+def load_kafka_module(lambda_client):
+    fake_boto3 = types.ModuleType("boto3")
+    fake_boto3.client = MagicMock(return_value=lambda_client)
+
+    fake_cfnresponse = types.ModuleType("cfnresponse")
+    fake_cfnresponse.send = MagicMock()
+
+    spec = importlib.util.spec_from_file_location("helper_kafka_test", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+
+    with patch.dict(sys.modules, {"boto3": fake_boto3, "cfnresponse": fake_cfnresponse}):
+        spec.loader.exec_module(module)
+
+    return module, fake_cfnresponse
+
+
+OLD_UUID = "00000000-0000-0000-0000-999999999999"
+
+
+PROPERTIES = {
+    "Function": "coralogix-msk",
+    "BatchSize": "100",
+    "StartingPosition": "LATEST",
+    "Topic": "logs",
+    "Brokers": "broker-1:9092,broker-2:9092",
+    "SubnetIds": ["subnet-1"],
+    "SecurityGroupIds": ["sg-1"],
+}
+
+
+def build_event(request_type, **properties):
+    event = {
+        "RequestType": request_type,
+        "ResourceProperties": dict(PROPERTIES, **properties),
+    }
+    if request_type != "Create":
+        event["PhysicalResourceId"] = OLD_UUID
+    if request_type == "Update":
+        event["OldResourceProperties"] = dict(PROPERTIES)
+    return event
+
+
+class KafkaHelperTests(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeLambdaClient()
+        self.client.mappings[OLD_UUID] = {"UUID": OLD_UUID, "State": "Enabled", "polls": 0, "BatchSize": 100}
+        self.module, self.cfnresponse = load_kafka_module(self.client)
+        self.clock = FakeClock()
+        self.context = SimpleNamespace(get_remaining_time_in_millis=lambda: 900000 - self.clock.now * 1000)
+
+    def handle(self, event):
+        with patch.object(self.module, "time", self.clock), patch("builtins.print"):
+            self.module.lambda_handler(event, self.context)
+        args = self.cfnresponse.send.call_args.args
+        return args[2], args[3], args[4]
+
+    def test_waits_poll_quickly_and_back_off(self):
+        self.client.ready_after = 6
+
+        status, data, physical_id = self.handle(build_event("Create"))
+
+        self.assertEqual("SUCCESS", status)
+        self.assertEqual("Enabled", self.client.mappings[physical_id]["State"])
+        self.assertEqual([0.5, 1, 2, 4, 8, 10], self.clock.sleeps)
+        self.assertEqual(25.5, data["CreateSeconds"])
+        self.assertEqual(25.5, data["TotalSeconds"])
+
+    def test_mapping_ready_at_once_is_not_waited_for(self):
+        self.client.ready_after = 0
+
+        status, data, _ = self.handle(build_event("Create"))
+
+        self.assertEqual("SUCCESS", status)
+        self.assertEqual([], self.clock.sleeps)
+        self.assertEqual(0, data["CreateSeconds"])
+
+    def test_errors_while_waiting_for_the_deletion_fail_instead_of_looping(self):
+        self.client.get_error = Exception("AccessDeniedException")
+
+        status, data, _ = self.handle(build_event("Update", StartingPosition="TRIM_HORIZON"))
+
+        self.assertEqual("FAILED", status)
+        self.assertEqual("DeleteBeforeCreate", data["UpdateStrategy"])
+        self.assertEqual([], self.clock.sleeps)
+        self.assertEqual(["delete"], self.client.operations())
+
+    def test_waits_stop_before_the_lambda_timeout(self):
+        self.client.ready_after = 10 ** 6
+        self.context.get_remaining_time_in_millis = lambda: 60000 - self.clock.now * 1000
+
+        status, _, _ = self.handle(build_event("Create"))
+
+        self.assertEqual("FAILED", status)
+        self.assertEqual(50, sum(self.clock.sleeps))
+
+    def test_mutable_settings_are_updated_in_place(self):
+        status, data, physical_id = self.handle(build_event("Update", BatchSize="500", SubnetIds=["subnet-1", "subnet-2"]))
+
+        self.assertEqual("SUCCESS", status)
+        self.assertEqual(OLD_UUID, physical_id)
+        self.assertEqual(["update"], self.client.operations())
+        self.assertEqual("InPlace", data["UpdateStrategy"])
+        self.assertIn("UpdateSeconds", data)
+        mapping = self.client.mappings[OLD_UUID]
+        self.assertEqual(("Enabled", 500), (mapping["State"], mapping["BatchSize"]))
+        self.assertEqual(3, len(mapping["SourceAccessConfigurations"]))
+
+    def test_new_topic_is_consumed_by_a_new_mapping_before_the_old_one_is_deleted(self):
+        states = []
+        delete = self.client.delete_event_source_mapping
+
+        def delete_event_source_mapping(UUID):
+            states.append([mapping["State"] for mapping in self.client.mappings.values()])
+            return delete(UUID=UUID)
+
+        self.client.delete_event_source_mapping = delete_event_source_mapping
+
+        status, data, physical_id = self.handle(build_event("Update", Topic="logs-v2"))
+
+        self.assertEqual("SUCCESS", status)
+        self.assertEqual(["create", "delete"], self.client.operations())
+        self.assertEqual([["Enabled", "Enabled"]], states)
+        self.assertNotEqual(OLD_UUID, physical_id)
+        self.assertEqual(["logs-v2"], self.client.mappings[physical_id]["Topics"])
+        self.assertEqual("CreateBeforeDelete", data["UpdateStrategy"])
+        self.assertNotIn("DeleteSeconds", data)
+
+    def test_replacement_is_kept_when_the_old_mapping_cannot_be_deleted(self):
+        def delete_event_source_mapping(UUID):
+            self.client.calls.append(("delete", UUID))
+            raise Exception("AccessDeniedException")
+
+        self.client.delete_event_source_mapping = delete_event_source_mapping
+
+        status, _, physical_id = self.handle(build_event("Update", Topic="logs-v2"))
+
+        self.assertEqual("SUCCESS", status)
+        self.assertNotEqual(OLD_UUID, physical_id)
+        self.assertEqual(["create", "delete"], self.client.operations())
+        self.assertEqual("Enabled", self.client.mappings[physical_id]["State"])
+
+    def test_new_starting_position_recreates_the_mapping(self):
+        status, data, physical_id = self.handle(build_event("Update", StartingPosition="TRIM_HORIZON"))
+
+        self.assertEqual("SUCCESS", status)
+        self.assertEqual(["delete", "create"], self.client.operations())
+        self.assertNotIn(OLD_UUID, self.client.mappings)
+        self.assertEqual("TRIM_HORIZON", self.client.mappings[physical_id]["StartingPosition"])
+        self.assertLessEqual({"DeleteSeconds", "CreateSeconds"}, set(data))
+
+    def test_replacement_that_never_gets_ready_is_removed_and_the_old_mapping_kept(self):
+        self.client.ready_after = 10 ** 6
+        self.context.get_remaining_time_in_millis = lambda: 60000 - self.clock.now * 1000
+
+        status, _, physical_id = self.handle(build_event("Update", Topic="logs-v2"))
+
+        self.assertEqual("FAILED", status)
+        self.assertEqual(OLD_UUID, physical_id)
+        self.assertEqual(["create", "delete"], self.client.operations())
+        self.assertEqual({OLD_UUID: "Enabled"}, {
+            mapping_uuid: mapping["State"] for mapping_uuid, mapping in self.client.mappings.items()
+            if mapping["State"] != "Deleting"
+        })
+
+
+    def test_throughput_settings_are_applied_on_create_and_update(self):
+        tuning = {"BatchingWindow": "5", "MinimumPollers": "2", "MaximumPollers": "20", "ConsumerGroupId": "coralogix"}
+
+        status, _, physical_id = self.handle(build_event("Create", BatchSize="1000", **tuning))
+
+        self.assertEqual("SUCCESS", status)
+        mapping = self.client.mappings[physical_id]
+        self.assertEqual(1000, mapping["BatchSize"])
+        self.assertEqual(5, mapping["MaximumBatchingWindowInSeconds"])
+        self.assertEqual({"MinimumPollers": 2, "MaximumPollers": 20}, mapping["ProvisionedPollerConfig"])
+        self.assertEqual({"ConsumerGroupId": "coralogix"}, mapping["SelfManagedKafkaEventSourceConfig"])
+
+        event = build_event("Update", BatchingWindow="1", MaximumPollers="50", ConsumerGroupId="coralogix")
+        event["PhysicalResourceId"] = physical_id
+        event["OldResourceProperties"].update(tuning)
+        status, data, _ = self.handle(event)
+
+        self.assertEqual(("SUCCESS", "InPlace"), (status, data["UpdateStrategy"]))
+        self.assertEqual(1, mapping["MaximumBatchingWindowInSeconds"])
+        self.assertEqual({"MaximumPollers": 50}, mapping["ProvisionedPollerConfig"])
+
+    def test_removed_throughput_settings_are_reset_on_update(self):
+        self.client.mappings[OLD_UUID].update(MaximumBatchingWindowInSeconds=5, ProvisionedPollerConfig={"MinimumPollers": 2})
+        event = build_event("Update")
+        event["OldResourceProperties"].update(BatchingWindow="5", MinimumPollers="2")
+
+        status, _, _ = self.handle(event)
+
+        self.assertEqual("SUCCESS", status)
+        mapping = self.client.mappings[OLD_UUID]
+        self.assertEqual((0, {}), (mapping["MaximumBatchingWindowInSeconds"], mapping["ProvisionedPollerConfig"]))
+
+    def test_new_consumer_group_recreates_the_mapping(self):
+        status, data, _ = self.handle(build_event("Update", ConsumerGroupId="coralogix-v2"))
+
+        self.assertEqual(("SUCCESS", "DeleteBeforeCreate"), (status, data["UpdateStrategy"]))
+        self.assertEqual(["delete", "create"], self.client.operations())
+
+    def test_invalid_settings_fail_before_any_mapping_is_changed(self):
+        for properties in [
+            {"MinimumPollers": "10", "MaximumPollers": "5"},
+            {"BatchingWindow": "301"},
+            {"BatchSize": "0"},
+            {"MaximumPollers": "many"},
+            {"ConsumerGroupId": "x" * 201},
+        ]:
+            with self.subTest(properties=properties):
+                status, _, physical_id = self.handle(build_event("Update", **properties))
+
+                self.assertEqual("FAILED", status)
+                self.assertEqual(OLD_UUID, physical_id)
+                self.assertEqual([], self.client.calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
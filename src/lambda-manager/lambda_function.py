@@ -3,10 +3,19 @@ import os
 import re
 import uuid
 import cfnresponse 
+import fnmatch
 from botocore.config import Config
 import logging
 import sys
-from typing import List, Optional, Dict, Any
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Iterable, Iterator
 
 logger = logging.getLogger('logger')
 formatter = logging.Formatter('%(levelname)s: %(message)s')
@@ -16,9 +25,18 @@ logger.addHandler(handler)
 logger.setLevel(logging.INFO)
 logger.propagate = False
 
+AWS_API_REQUESTS_LIMIT = int(os.environ.get('AWS_API_REUESTS_LIMIT', 10))
+
+# Retries of the CloudWatch Logs and Lambda calls are done by AwsApiScheduler
 config = Config(
    retries = { 
-      'max_attempts': int(os.environ.get('AWS_API_REUESTS_LIMIT', 10)),
+      'max_attempts': 1,
+      'mode': 'standard'
+   }
+)
+retry_config = Config(
+   retries = { 
+      'max_attempts': AWS_API_REQUESTS_LIMIT,
       'mode': 'standard'
    }
 )
@@ -27,21 +45,631 @@ cloudwatch_logs = boto3.client('logs', config=config)
 lambda_client = boto3.client('lambda', config=config)
 
 SUPPORTED_LOG_GROUP_CLASS = "STANDARD"
+THROTTLING_ERROR_CODES = {'ThrottlingException', 'TooManyRequestsException', 'Throttling', 'RequestLimitExceeded'}
+TRANSIENT_ERROR_CODES = {'ServiceUnavailableException', 'ServiceUnavailable', 'InternalFailure', 'ServiceException', 'RequestTimeout'}
+CONNECTION_ERROR_NAMES = {'EndpointConnectionError', 'ConnectionClosedError', 'ConnectTimeoutError', 'ReadTimeoutError'}
+RATE_RECOVERY_STEP = 0.02
+REGEX_METACHARACTERS = set('.^$*+?{}[]|()')
+BACKREFERENCE_PATTERN = re.compile(r'\\[1-9]|\(\?P=')
+MAX_LISTING_PREFIXES = 50
+SCAN_HANDOFF_RESERVED_MILLIS = 60000
+SCAN_CHECKPOINT_ID = 'scan-old-log-groups'
+MAX_SUBSCRIPTION_LIMIT = 2
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Bound the number of log groups processed at the same time during a scan.
+
+    The limit starts at max_concurrency, is halved every time a worker reports a
+    throttling error and grows back by one slot after `limit` consecutive log groups
+    are processed without throttling.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.in_flight = 0
+        self.throttle_events = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttle_events += 1
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+                logger.warning(f"CloudWatch Logs is throttling, reducing scan concurrency to {self.limit}")
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+    def wait_until_idle(self) -> None:
+        with self._condition:
+            while self.in_flight > 0:
+                self._condition.wait()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that limits the request rate of one AWS API.
+
+    The rate is halved on every throttling error, down to min_rate, and recovers by
+    RATE_RECOVERY_STEP of the configured rate on every successful call. A rate of 0
+    disables the limit.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: float = 0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate) if rate > 0 else 0
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.max_rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self) -> None:
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY_STEP)
+
+class AwsApiScheduler:
+    """
+    Rate limit and retry the calls made to one AWS API.
+
+    AWS throttles each API operation separately, so every operation has its own token
+    bucket of the given rate, created on its first call, and a throttled
+    DescribeSubscriptionFilters does not slow down PutSubscriptionFilter. Every call
+    waits for a token of its operation's bucket. Throttling, transient service
+    errors and connection errors are retried up to max_attempts times with jittered
+    exponential backoff; any other error is raised right away. The counters are
+    exposed through stats().
+    """
+
+    def __init__(self, name: str, rate: float, max_attempts: int, base_delay: float = 0.5, max_delay: float = 20.0):
+        self.name = name
+        self.rate = rate
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.throttles = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def call(self, operation, **kwargs) -> Any:
+        bucket = self.bucket(operation)
+        attempt = 1
+        while True:
+            bucket.acquire()
+            self._count('calls')
+            try:
+                result = operation(**kwargs)
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                if throttled:
+                    self._count('throttles')
+                    thread_api_throttles.count = get_thread_api_throttles() + 1
+                    bucket.on_throttle()
+                if attempt >= self.max_attempts or not (throttled or is_transient_error(e)):
+                    raise
+                self._count('retries')
+                self.wait_before_retry(attempt)
+                attempt += 1
+                continue
+            bucket.on_success()
+            return result
+
+    def bucket(self, operation) -> TokenBucket:
+        name = getattr(operation, '__name__', '')
+        with self._lock:
+            if name not in self.buckets:
+                self.buckets[name] = TokenBucket(self.rate)
+            return self.buckets[name]
+
+    def wait_before_retry(self, attempt: int) -> None:
+        time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets = dict(self.buckets)
+        return {
+            'calls': self.calls,
+            'throttles': self.throttles,
+            'retries': self.retries,
+            'rate': {name: round(bucket.rate, 2) for name, bucket in buckets.items()},
+        }
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+# Throttling errors met by the API calls of each thread, including the ones that were
+# retried successfully and the ones that add_subscription and add_permission_to_lambda log
+thread_api_throttles = threading.local()
+
+def get_thread_api_throttles() -> int:
+    return getattr(thread_api_throttles, 'count', 0)
+
+logs_api = AwsApiScheduler('logs', float(os.environ.get('LOGS_API_RATE', 5)), AWS_API_REQUESTS_LIMIT)
+lambda_api = AwsApiScheduler('lambda', float(os.environ.get('LAMBDA_API_RATE', 10)), AWS_API_REQUESTS_LIMIT)
+
+def get_api_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Return the call, throttle and retry counters of the CloudWatch Logs and Lambda APIs.
+    """
+    return {scheduler.name: scheduler.stats() for scheduler in (logs_api, lambda_api)}
+
+class SubscriptionInventory:
+    """
+    Cache of the subscription filters attached to each log group.
+
+    Entries are filled by describe_subscription_filters lookups, both from the scan and
+    from new log group events, and updated after every successful put_subscription_filter,
+    so the duplicate and subscription limit checks can be answered locally. The
+    module-level instance is reused across warm invocations and entries expire after
+    ttl_seconds.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, cloudwatch_logs, log_group_name: str, not_before: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Return the subscription filters of a log group, using the cache when possible.
+
+        Args:
+            cloudwatch_logs: Boto3 CloudWatch Logs client used on a cache miss
+            log_group_name: Name of the log group
+            not_before: Ignore entries recorded before this epoch time, for example
+                entries that may describe a previous log group with the same name
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(log_group_name)
+            if entry and entry[1] > now and (not_before is None or entry[0] >= not_before):
+                self.hits += 1
+                return list(entry[2])
+            self.misses += 1
+
+        response = logs_api.call(cloudwatch_logs.describe_subscription_filters, logGroupName=log_group_name)
+        subscriptions = response.get('subscriptionFilters') or []
+        self._store(log_group_name, subscriptions)
+        return list(subscriptions)
+
+    def record_subscription(self, log_group_name: str, filter_name: str, destination_arn: str) -> None:
+        """
+        Add a subscription filter that was just created to the cached entry of its log group.
+
+        When the log group is not cached, nothing is recorded: the new filter alone would
+        undercount the filters of the log group, so the next lookup describes them.
+        """
+        with self._lock:
+            entry = self._entries.get(log_group_name)
+            if not entry:
+                return
+            subscriptions = [
+                subscription for subscription in entry[2]
+                if subscription.get('filterName') != filter_name
+            ]
+        subscriptions.append({'filterName': filter_name, 'destinationArn': destination_arn})
+        self._store(log_group_name, subscriptions)
+
+    def _store(self, log_group_name: str, subscriptions: List[Dict[str, Any]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._entries.pop(log_group_name, None)
+            self._entries[log_group_name] = (now, now + self.ttl_seconds, subscriptions)
+            if len(self._entries) > self.max_entries:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        for name in [name for name, entry in self._entries.items() if entry[1] <= now]:
+            del self._entries[name]
+        # Entries are kept in insertion order, so the oldest ones go first
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+class LambdaPermissionPlanner:
+    """
+    Keep the resource-based policy of the destination Lambda as small as possible.
+
+    The current policy is read once and every CloudWatch Logs statement is turned into
+    a SourceArn pattern. Log groups already covered by a statement (exact, prefix or
+    wildcard) are skipped without an API call. Uncovered log groups get a single
+    prefix statement when they start with one of the consolidation prefixes, otherwise
+    one statement per log group as before. Statements are added one at a time, since
+    concurrent AddPermission calls on the same function conflict with each other, but
+    the lock of the known statements is never held across an API call, so covered log
+    groups are not held up by GetPolicy or AddPermission.
+    """
+
+    def __init__(
+        self,
+        destination_arn: str,
+        region: str,
+        account_id: str,
+        consolidation_prefixes: Iterable[str] = ()
+    ):
+        self.destination_arn = destination_arn
+        self.region = region
+        self.account_id = account_id
+        # The shortest prefix covers the most log groups with one statement
+        self.consolidation_prefixes = sorted(set(consolidation_prefixes), key=len)
+        self.added_statements = 0
+        self._source_arn_patterns = None
+        # _lock guards the known statements, _load_lock the GetPolicy call and
+        # _add_lock the AddPermission calls
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._add_lock = threading.Lock()
+
+    def source_arn(self, log_group_name: str) -> str:
+        return f'arn:aws:logs:{self.region}:{self.account_id}:log-group:{log_group_name}:*'
+
+    def is_covered(self, log_group_name: str) -> bool:
+        self._load_policy()
+        with self._lock:
+            return self._is_covered(log_group_name)
+
+    def plan(self, log_group_names: Iterable[str]) -> List[str]:
+        """
+        Return the log group names or prefix patterns that need a new statement.
+        """
+        self._load_policy()
+        with self._lock:
+            targets = []
+            for log_group_name in log_group_names:
+                if self._is_covered(log_group_name):
+                    continue
+                target = self._target(log_group_name)
+                if target not in targets and not any(
+                    fnmatch.fnmatchcase(log_group_name, planned) for planned in targets
+                ):
+                    targets.append(target)
+            return targets
+
+    def ensure_permission(self, log_group_name: str, reload_policy: bool = False) -> bool:
+        """
+        Make sure CloudWatch Logs may invoke the destination for the log group.
+
+        With reload_policy, the policy is read again first, so a statement removed since
+        it was cached is added back. Returns True when a statement was added.
+        """
+        if reload_policy:
+            self._reload_policy()
+        if self.is_covered(log_group_name):
+            return False
+        with self._add_lock:
+            # Another thread may have added a statement covering the log group meanwhile
+            if self.is_covered(log_group_name):
+                return False
+            target = self._target(log_group_name)
+            if target != log_group_name:
+                logger.info(f"Adding permission to lambda for log groups matching {target}")
+            if not add_permission_to_lambda(self.destination_arn, target, self.region, self.account_id):
+                return False
+            with self._lock:
+                self._source_arn_patterns.append(self.source_arn(target))
+                self.added_statements += 1
+            return True
+
+    def _target(self, log_group_name: str) -> str:
+        for prefix in self.consolidation_prefixes:
+            if log_group_name.startswith(prefix):
+                return f"{prefix}*"
+        return log_group_name
 
-def lambda_handler(event: Dict[str, Any], context) -> None:
+    def _load_policy(self) -> None:
+        with self._load_lock:
+            if self._source_arn_patterns is None:
+                patterns = self._load_source_arn_patterns()
+                with self._lock:
+                    self._source_arn_patterns = patterns
+
+    def _reload_policy(self) -> None:
+        # AddPermission calls wait, so the statements they add are not lost by the reload
+        with self._add_lock, self._load_lock:
+            patterns = self._load_source_arn_patterns()
+            with self._lock:
+                self._source_arn_patterns = patterns
+
+    def _is_covered(self, log_group_name: str) -> bool:
+        source_arn = self.source_arn(log_group_name)
+        return any(fnmatch.fnmatchcase(source_arn, pattern) for pattern in self._source_arn_patterns)
+
+    def _load_source_arn_patterns(self) -> List[str]:
+        try:
+            policy = json.loads(lambda_api.call(lambda_client.get_policy, FunctionName=self.destination_arn)['Policy'])
+        except Exception as e:
+            # No policy yet (ResourceNotFoundException) or it cannot be read: nothing is covered
+            logger.info(f"Could not read the policy of {self.destination_arn}, assuming no log group is covered: {e}")
+            return []
+
+        patterns = []
+        for statement in policy.get('Statement', []):
+            principal = statement.get('Principal', {})
+            service = principal.get('Service', '') if isinstance(principal, dict) else ''
+            action = statement.get('Action', '')
+            if statement.get('Effect') != 'Allow' or not service.startswith('logs.'):
+                continue
+            if action not in ('lambda:InvokeFunction', 'lambda:*', '*'):
+                continue
+            conditions = statement.get('Condition', {})
+            source_arns = [
+                source_arn
+                for operator in ('ArnLike', 'ArnEquals', 'StringLike', 'StringEquals')
+                for key, source_arn in conditions.get(operator, {}).items()
+                if key.lower() == 'aws:sourcearn'
+            ]
+            patterns.extend(source_arns if source_arns else ['*'])
+        return patterns
+
+@lru_cache(maxsize=8)
+def _cached_permission_planner(
+    destination_arn: str,
+    region: str,
+    account_id: str,
+    consolidation_prefixes: tuple,
+    ttl_bucket: int
+) -> LambdaPermissionPlanner:
+    return LambdaPermissionPlanner(destination_arn, region, account_id, consolidation_prefixes)
+
+def get_permission_planner(
+    destination_arn: str,
+    region: str,
+    account_id: str,
+    log_group_matcher: Optional['LogGroupMatcher'] = None
+) -> LambdaPermissionPlanner:
+    """
+    Return the permission planner of the destination, reused across warm invocations.
+
+    The planner, and therefore the policy it read, is replaced every SUBSCRIPTION_CACHE_TTL
+    seconds. When CONSOLIDATE_PERMISSIONS is 'true', the literal prefixes of the REGEX_PATTERN
+    patterns are used to cover many log groups with one statement.
+    """
+    consolidation_prefixes = ()
+    if log_group_matcher and os.environ.get('CONSOLIDATE_PERMISSIONS', 'false') == 'true':
+        # A prefix such as "/" would grant access to every log group, like a wildcard
+        consolidation_prefixes = tuple(prefix for prefix in log_group_matcher.prefixes if prefix.strip('/'))
+    ttl = max(subscription_inventory.ttl_seconds, 1)
+    return _cached_permission_planner(
+        destination_arn, region, account_id, consolidation_prefixes, int(time.time() // ttl)
+    )
+
+subscription_inventory = SubscriptionInventory(float(os.environ.get('SUBSCRIPTION_CACHE_TTL', 300)))
+
+class ScanCheckpointStore(ABC):
+    """
+    Storage for the progress of the existing log group scan.
+
+    A checkpoint is a JSON-serializable dict holding the listing request index, the
+    nextToken of the page to resume from, the log groups of that page that are already
+    done and the counts so far.
+    """
+
+    @abstractmethod
+    def load(self) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def save(self, checkpoint: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+class FileScanCheckpointStore(ScanCheckpointStore):
+    """
+    Keep the scan checkpoint in a local JSON file. Used for tests and local runs.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path) as checkpoint_file:
+                return json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, checkpoint: Dict[str, Any]) -> None:
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temporary_path, self.path)
+
+    def clear(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class DynamoDBScanCheckpointStore(ScanCheckpointStore):
+    """
+    Keep the scan checkpoint as a single item in a DynamoDB table keyed by 'id'.
+    """
+
+    def __init__(self, table_name: str, dynamodb_client=None):
+        self.table_name = table_name
+        self.dynamodb = dynamodb_client or boto3.client('dynamodb', config=retry_config)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        response = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={'id': {'S': SCAN_CHECKPOINT_ID}},
+            ConsistentRead=True
+        )
+        item = response.get('Item')
+        return json.loads(item['checkpoint']['S']) if item else None
+
+    def save(self, checkpoint: Dict[str, Any]) -> None:
+        self.dynamodb.put_item(
+            TableName=self.table_name,
+            Item={'id': {'S': SCAN_CHECKPOINT_ID}, 'checkpoint': {'S': json.dumps(checkpoint)}}
+        )
+
+    def clear(self) -> None:
+        self.dynamodb.delete_item(TableName=self.table_name, Key={'id': {'S': SCAN_CHECKPOINT_ID}})
+
+def get_scan_checkpoint_store() -> Optional[ScanCheckpointStore]:
+    """
+    Return the checkpoint store configured with SCAN_CHECKPOINT_TABLE or SCAN_CHECKPOINT_FILE.
+
+    Without a store the scan runs in a single invocation, as before.
+    """
+    if os.environ.get('SCAN_CHECKPOINT_TABLE'):
+        return DynamoDBScanCheckpointStore(os.environ['SCAN_CHECKPOINT_TABLE'])
+    if os.environ.get('SCAN_CHECKPOINT_FILE'):
+        return FileScanCheckpointStore(os.environ['SCAN_CHECKPOINT_FILE'])
+    return None
+
+class LogGroupMatcher:
+    """
+    Match log group names against the REGEX_PATTERN patterns.
+
+    All patterns are compiled once into a single alternation, which matches the same
+    names as calling re.match with each pattern in turn. Empty patterns are ignored.
+    The literal prefix of every pattern is extracted so that describe_log_groups can be
+    narrowed with logGroupNamePrefix instead of listing every log group in the region.
+    """
+
+    def __init__(self, regex_pattern_list: Iterable[str]):
+        self.patterns = [regex_pattern for regex_pattern in regex_pattern_list if regex_pattern]
+        self._compiled = []
+        if self.patterns and not any(BACKREFERENCE_PATTERN.search(pattern) for pattern in self.patterns):
+            try:
+                self._compiled = [re.compile('|'.join(f'(?:{pattern})' for pattern in self.patterns))]
+            except re.error:
+                # Patterns that cannot share one expression (e.g. duplicated group names)
+                # are matched one by one below
+                pass
+        if self.patterns and not self._compiled:
+            self._compiled = [re.compile(pattern) for pattern in self.patterns]
+        self.prefixes = [literal_prefix(pattern) for pattern in self.patterns]
+
+    def matches(self, log_group_name: str) -> bool:
+        for compiled in self._compiled:
+            if compiled.match(log_group_name):
+                return True
+        return False
+
+    def listing_requests(self) -> List[Dict[str, str]]:
+        """
+        Return the describe_log_groups arguments needed to list every log group that can match.
+
+        One request per distinct literal prefix is returned, or a single unfiltered request
+        when a pattern has no literal prefix or there are too many prefixes to list separately.
+        """
+        if not self.patterns:
+            return []
+        if not all(self.prefixes):
+            return [{}]
+        listing_prefixes = []
+        for prefix in sorted(set(self.prefixes)):
+            if not listing_prefixes or not prefix.startswith(listing_prefixes[-1]):
+                listing_prefixes.append(prefix)
+        if len(listing_prefixes) > MAX_LISTING_PREFIXES:
+            return [{}]
+        return [{'logGroupNamePrefix': prefix} for prefix in listing_prefixes]
+
+def literal_prefix(regex_pattern: str) -> str:
+    """
+    Return the literal text every name matched by the pattern (with re.match) starts with.
+
+    The extraction is conservative: it stops at the first metacharacter or escape
+    sequence that is not a plain escaped character, drops a character followed by an
+    optional quantifier and returns '' for patterns that contain an alternation.
+    """
+    if '|' in regex_pattern:
+        return ''
+    prefix = []
+    i = 1 if regex_pattern.startswith('^') else 0
+    while i < len(regex_pattern):
+        char = regex_pattern[i]
+        if char == '\\':
+            if i + 1 >= len(regex_pattern) or regex_pattern[i + 1].isalnum():
+                break
+            char = regex_pattern[i + 1]
+            i += 2
+        elif char in REGEX_METACHARACTERS:
+            break
+        else:
+            i += 1
+        next_char = regex_pattern[i] if i < len(regex_pattern) else ''
+        if next_char in ('*', '?', '{'):
+            break
+        prefix.append(char)
+        if next_char == '+':
+            break
+    return ''.join(prefix)
+
+@lru_cache(maxsize=8)
+def get_log_group_matcher(regex_pattern_list: tuple) -> LogGroupMatcher:
+    """
+    Build the matcher for the REGEX_PATTERN patterns once and reuse it across warm invocations.
+    """
+    return LogGroupMatcher(regex_pattern_list)
+
+def lambda_handler(event: Dict[str, Any], context) -> Optional[Dict[str, Any]]:
     """
     Main Lambda function handler that manages CloudWatch log group subscriptions.
     
-    This function handles both CloudFormation custom resource events and CloudWatch
-    log group creation events. It can:
+    This function handles CloudFormation custom resource events and CloudWatch log
+    group creation events, delivered directly by EventBridge or in batches through SQS.
+    It can:
     - Add permissions to Lambda functions for log group access
     - Scan existing log groups and add subscriptions based on regex patterns
     - Add subscription filters to new log groups that match specified patterns
     - Handle both Firehose and Lambda destinations
     
     Args:
-        event: Lambda event containing either CloudFormation request or CloudWatch log group details
+        event: Lambda event containing either CloudFormation request, CloudWatch log group details
+            or a batch of SQS messages with CloudWatch log group events
         context: Lambda context object containing function metadata
+
+    Invoking the function with {"DryRun": true} writes the plan of a scan of the existing
+    log groups as NDJSON to the function logs and returns its summary.
+
+    Returns:
+        dict: The partial batch response for SQS batches, the plan summary for dry runs,
+        None otherwise
     
     Environment Variables:
         REGEX_PATTERN: Comma-separated regex patterns to match log group names
@@ -52,10 +680,15 @@ def lambda_handler(event: Dict[str, Any], context) -> None:
         DISABLE_ADD_PERMISSION: Whether to skip adding Lambda permissions ('true'/'false')
         ADD_PERMISSIONS_TO_ALL_LOG_GROUPS: Whether to add permissions for all log groups ('true'/'false')
         LOG_GROUP_PERMISSION_PREFIX: Comma-separated prefixes for log groups that need permissions
+        SCAN_CHECKPOINT_TABLE: DynamoDB table used to resume the scan across invocations (optional)
+        SCAN_CHECKPOINT_FILE: Local file used to resume the scan across invocations (optional)
+        SUBSCRIPTION_CACHE_TTL: Seconds a cached list of log group subscriptions is reused (optional)
+        CONSOLIDATE_PERMISSIONS: Whether to cover log groups with one statement per regex literal prefix ('true'/'false')
     """
     status = cfnresponse.SUCCESS
     try:
         regex_pattern_list     = os.environ.get('REGEX_PATTERN').split(',')
+        log_group_matcher      = get_log_group_matcher(tuple(regex_pattern_list))
         destination_type       = os.environ.get('DESTINATION_TYPE')
         logs_filter            = os.environ.get('LOGS_FILTER', '')
         scan_old_log_groups    = os.environ.get('SCAN_OLD_LOGGROUPS', 'false')
@@ -75,71 +708,67 @@ def lambda_handler(event: Dict[str, Any], context) -> None:
 
             if scan_old_log_groups == 'true':
                 logger.info(f"Scanning all existing log groups: {scan_old_log_groups}")
-                list_log_groups_and_subscriptions(
-                    cloudwatch_logs, regex_pattern_list, logs_filter, destination_arn, 
-                    filter_name, context, log_group_permission_prefix, add_permissions_to_all_log_groups
+                checkpoint_store = get_scan_checkpoint_store()
+                if checkpoint_store:
+                    checkpoint_store.clear()
+                scan_old_log_groups_until_done(
+                    cloudwatch_logs, regex_pattern_list, logs_filter, destination_arn, filter_name,
+                    context, log_group_permission_prefix, add_permissions_to_all_log_groups, checkpoint_store
                 )
-                update_scan_old_log_groups_status(context, lambda_client)
             elif scan_old_log_groups == 'true':
                 scan_old_log_groups = 'false'
                 update_scan_old_log_groups_status(context, lambda_client)
 
-        # Handle CloudWatch log group creation events
-        if scan_old_log_groups != 'true' and "RequestType" not in event:
-            event_detail = event['detail']
+        # Report what a scan of the existing log groups would do, without changing anything
+        if event.get('DryRun'):
+            logger.info("Planning the scan of existing log groups without changing anything")
+            plan = plan_log_group_subscriptions(
+                cloudwatch_logs, regex_pattern_list, destination_arn, region, account_id,
+                log_group_permission_prefix, add_permissions_to_all_log_groups
+            )
+            summary = write_scan_plan(plan, sys.stdout)
+            logger.info(f"Scan plan summary: {json.dumps(summary)}")
+            return summary
 
-            if cloudtrail_event_failed(event_detail):
-                logger.info(
-                    "Skipping failed CloudTrail CreateLogGroup event for %s",
-                    event_detail.get('requestParameters', {}).get('logGroupName', 'unknown log group')
-                )
+        # Continue a scan of existing log groups that was handed off before the timeout
+        if event.get('ScanContinuation'):
+            checkpoint_store = get_scan_checkpoint_store()
+            # A duplicate delivery of a continuation must not start the scan over once it is done
+            if scan_old_log_groups != 'true' or not checkpoint_store or not checkpoint_store.load():
+                logger.info("Ignoring the scan continuation, no scan of existing log groups is in progress")
                 return
+            logger.info("Continuing the scan of existing log groups")
+            scan_old_log_groups_until_done(
+                cloudwatch_logs, regex_pattern_list, logs_filter, destination_arn, filter_name,
+                context, log_group_permission_prefix, add_permissions_to_all_log_groups, checkpoint_store
+            )
+            return
 
-            log_group_to_subscribe = event_detail['requestParameters']['logGroupName']
-
-            if not should_process_log_group_class(event_detail):
-                return
-            found_log_group_in_regex_pattern = False
-            
-            for regex_pattern in regex_pattern_list:
-                if re.match(regex_pattern, log_group_to_subscribe):
-                    if not should_create_subscription(cloudwatch_logs, log_group_to_subscribe, destination_arn):
-                        break
-                    if destination_type == 'firehose':
-                        logger.info(f"Adding subscription filter for {log_group_to_subscribe}")
-                        status = add_subscription(filter_name, logs_filter, log_group_to_subscribe, destination_arn)
-                        if status == cfnresponse.FAILED:
-                            logger.warning(f"Retrying to add subscription filter for {log_group_to_subscribe}")
-                            add_subscription(filter_name, logs_filter, log_group_to_subscribe, destination_arn)
-                        break
-                    elif destination_type == 'lambda':
-                        try:
-                            if not check_if_log_group_exist_in_log_group_permission_prefix(log_group_to_subscribe, log_group_permission_prefix):
-                                if disable_add_permission == 'true' or add_permissions_to_all_log_groups == 'true':
-                                    logger.info("Skipping adding permission to lambda")
-                                else:
-                                    logger.info(f"Adding permission to lambda for {log_group_to_subscribe}")
-                                    add_permission_to_lambda(destination_arn, log_group_to_subscribe, region, account_id)
-                            logger.info(f"Adding subscription filter for {log_group_to_subscribe}")
-                            found_log_group_in_regex_pattern = True
-                        except Exception as e:
-                            logger.error(f"Failed to put subscription filter for {log_group_to_subscribe}: {e}")
-                            status = cfnresponse.FAILED
-                        break
+        # Handle batches of CloudWatch log group creation events buffered in SQS
+        if is_sqs_batch_event(event):
+            if scan_old_log_groups == 'true':
+                # The scan may already be past these log groups, SQS delivers them again once it is done
+                logger.info("Returning the batch of new log groups to the queue while existing log groups are scanned")
+                return {'batchItemFailures': [{'itemIdentifier': record['messageId']} for record in event['Records']]}
+            return process_create_log_group_batch(
+                event['Records'], log_group_matcher, destination_type, logs_filter, destination_arn, filter_name,
+                region, account_id, disable_add_permission, add_permissions_to_all_log_groups, log_group_permission_prefix
+            )
 
-            if found_log_group_in_regex_pattern:
-                status = add_subscription(filter_name, logs_filter, log_group_to_subscribe, destination_arn)
-                if status == cfnresponse.FAILED:
-                    logger.info(f"Retrying to add subscription filter for {log_group_to_subscribe}")
-                    if disable_add_permission == 'true' or add_permissions_to_all_log_groups == 'true':
-                        logger.info("Skipping adding permission to lambda")
-                    else:
-                        add_permission_to_lambda(destination_arn, log_group_to_subscribe, region, account_id)
-                    add_subscription(filter_name, logs_filter, log_group_to_subscribe, destination_arn)
+        # Handle CloudWatch log group creation events
+        if scan_old_log_groups != 'true' and "RequestType" not in event:
+            status = subscribe_new_log_group(
+                event['detail'], log_group_matcher, destination_type, logs_filter, destination_arn, filter_name,
+                region, account_id, disable_add_permission, add_permissions_to_all_log_groups, log_group_permission_prefix
+            )
 
     except Exception as e:
         logger.error(f"Failed with exception: {e}")
         status = cfnresponse.FAILED
+        if event.get('ScanContinuation'):
+            # Let the asynchronous invocation retry the continuation and then send it to the
+            # OnFailure destination, instead of leaving SCAN_OLD_LOGGROUPS enabled for good
+            raise
     finally:
         # Send response for CloudFormation custom resource events
         if "RequestType" in event and "ResponseURL" in event:
@@ -154,6 +783,162 @@ def lambda_handler(event: Dict[str, Any], context) -> None:
         else:
             logger.info("Skipping cfnresponse.send — not a CloudFormation event")
 
+def subscribe_new_log_group(
+    event_detail: Dict[str, Any],
+    log_group_matcher: LogGroupMatcher,
+    destination_type: str,
+    logs_filter: str,
+    destination_arn: str,
+    filter_name: str,
+    region: str,
+    account_id: str,
+    disable_add_permission: str,
+    add_permissions_to_all_log_groups: str,
+    log_group_permission_prefix: List[str]
+) -> str:
+    """
+    Subscribe the log group of a CloudTrail CreateLogGroup event to the destination.
+
+    Failed events, non-standard log groups, log groups that do not match REGEX_PATTERN
+    and log groups that cannot accept the subscription are skipped.
+
+    Args:
+        event_detail: The 'detail' of the EventBridge CloudTrail event
+
+    Returns:
+        str: 'SUCCESS' when the log group was subscribed or skipped, 'FAILED' otherwise
+    """
+    status = cfnresponse.SUCCESS
+
+    if cloudtrail_event_failed(event_detail):
+        logger.info(
+            "Skipping failed CloudTrail CreateLogGroup event for %s",
+            event_detail.get('requestParameters', {}).get('logGroupName', 'unknown log group')
+        )
+        return status
+
+    log_group_to_subscribe = event_detail['requestParameters']['logGroupName']
+
+    if not should_process_log_group_class(event_detail):
+        return status
+    found_log_group_in_regex_pattern = False
+    
+    # Only trust cached subscriptions recorded after this log group was created
+    if log_group_matcher.matches(log_group_to_subscribe) and should_create_subscription(
+        cloudwatch_logs, log_group_to_subscribe, destination_arn, get_event_time(event_detail)
+    ):
+        if destination_type == 'firehose':
+            logger.info(f"Adding subscription filter for {log_group_to_subscribe}")
+            status = add_subscription(filter_name, logs_filter, log_group_to_subscribe, destination_arn)
+        elif destination_type == 'lambda':
+            try:
+                if not check_if_log_group_exist_in_log_group_permission_prefix(log_group_to_subscribe, log_group_permission_prefix):
+                    if disable_add_permission == 'true' or add_permissions_to_all_log_groups == 'true':
+                        logger.info("Skipping adding permission to lambda")
+                    else:
+                        permission_planner = get_permission_planner(destination_arn, region, account_id, log_group_matcher)
+                        if permission_planner.ensure_permission(log_group_to_subscribe):
+                            logger.info(f"Added permission to lambda for {log_group_to_subscribe}")
+                logger.info(f"Adding subscription filter for {log_group_to_subscribe}")
+                found_log_group_in_regex_pattern = True
+            except Exception as e:
+                logger.error(f"Failed to put subscription filter for {log_group_to_subscribe}: {e}")
+                status = cfnresponse.FAILED
+
+    if found_log_group_in_regex_pattern:
+        status = add_subscription(filter_name, logs_filter, log_group_to_subscribe, destination_arn)
+        if status == cfnresponse.FAILED:
+            # The destination permission may be missing or not propagated yet
+            logger.info(f"Retrying to add subscription filter for {log_group_to_subscribe}")
+            if disable_add_permission == 'true' or add_permissions_to_all_log_groups == 'true':
+                logger.info("Skipping adding permission to lambda")
+            else:
+                get_permission_planner(destination_arn, region, account_id, log_group_matcher).ensure_permission(
+                    log_group_to_subscribe, reload_policy=True
+                )
+            logs_api.wait_before_retry(1)
+            status = add_subscription(filter_name, logs_filter, log_group_to_subscribe, destination_arn)
+
+    return status
+
+def is_sqs_batch_event(event: Dict[str, Any]) -> bool:
+    """
+    Check whether the event is a batch of SQS messages.
+    """
+    records = event.get('Records')
+    return bool(records) and all(record.get('eventSource') == 'aws:sqs' for record in records)
+
+def process_create_log_group_batch(
+    records: List[Dict[str, Any]],
+    log_group_matcher: LogGroupMatcher,
+    destination_type: str,
+    logs_filter: str,
+    destination_arn: str,
+    filter_name: str,
+    region: str,
+    account_id: str,
+    disable_add_permission: str,
+    add_permissions_to_all_log_groups: str,
+    log_group_permission_prefix: List[str]
+) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Subscribe the log groups of a batch of CreateLogGroup events delivered through SQS.
+
+    Every message body is an EventBridge CloudTrail event. Events for the same log group
+    are coalesced and processed once with the most recent event, the unique log groups
+    are processed concurrently and share the subscription inventory and the permission
+    planner, so the destination policy is read once per batch at most.
+
+    Returns:
+        dict: The SQS partial batch response listing the messages that failed
+    """
+    message_ids_by_log_group: Dict[str, List[str]] = {}
+    event_detail_by_log_group: Dict[str, Dict[str, Any]] = {}
+    failed_message_ids = []
+
+    def event_priority(event_detail: Dict[str, Any]) -> tuple:
+        return (not cloudtrail_event_failed(event_detail), get_event_time(event_detail) or 0)
+
+    for record in records:
+        try:
+            event_detail = json.loads(record['body'])['detail']
+            log_group_name = event_detail['requestParameters']['logGroupName']
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Failed to parse message {record.get('messageId')}: {e}")
+            failed_message_ids.append(record.get('messageId'))
+            continue
+        message_ids_by_log_group.setdefault(log_group_name, []).append(record['messageId'])
+        # Prefer successful events over failed ones, then the most recent one
+        latest_detail = event_detail_by_log_group.get(log_group_name)
+        if latest_detail is None or event_priority(event_detail) >= event_priority(latest_detail):
+            event_detail_by_log_group[log_group_name] = event_detail
+
+    logger.info(
+        f"Processing {len(records)} CreateLogGroup events for {len(event_detail_by_log_group)} unique log groups"
+    )
+
+    def process(log_group_name: str) -> str:
+        try:
+            return subscribe_new_log_group(
+                event_detail_by_log_group[log_group_name], log_group_matcher, destination_type, logs_filter,
+                destination_arn, filter_name, region, account_id, disable_add_permission,
+                add_permissions_to_all_log_groups, log_group_permission_prefix
+            )
+        except Exception as e:
+            logger.error(f"Failed to process log group {log_group_name}: {e}")
+            return cfnresponse.FAILED
+
+    max_workers = max(1, min(int(os.environ.get('SCAN_CONCURRENCY', 5)), len(event_detail_by_log_group)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        statuses = dict(zip(event_detail_by_log_group, executor.map(process, event_detail_by_log_group)))
+
+    for log_group_name, status in statuses.items():
+        if status == cfnresponse.FAILED:
+            failed_message_ids.extend(message_ids_by_log_group[log_group_name])
+    logger.info(f"Processed the batch with {len(failed_message_ids)} failed events, API calls: {get_api_stats()}")
+
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
+
 def list_log_groups_and_subscriptions(
     cloudwatch_logs, 
     regex_pattern_list: List[str], 
@@ -162,17 +947,23 @@ def list_log_groups_and_subscriptions(
     filter_name: str, 
     context, 
     log_group_permission_prefix: List[str], 
-    add_permissions_to_all_log_groups: str
-) -> None:
+    add_permissions_to_all_log_groups: str,
+    checkpoint_store: Optional['ScanCheckpointStore'] = None
+) -> Dict[str, Any]:
     """
     Scan all log groups in the region and add subscriptions to those matching regex patterns.
     
     This function is designed to run only once during the initial setup. It:
-    - Retrieves all log groups in the region using pagination
-    - Filters log groups based on provided regex patterns
-    - Checks existing subscriptions to avoid duplicates
-    - Adds subscription filters for matching log groups
+    - Streams the log groups in the region page by page, narrowed on the server side
+      to the literal prefixes of the regex patterns when every pattern has one
+    - Filters log groups based on provided regex patterns as each page arrives
+    - Checks existing subscriptions and adds subscription filters for matching log groups
+      using a bounded pool of workers that shrinks when CloudWatch Logs throttles
     - Handles Lambda permissions when needed
+
+    When a checkpoint store is given, the scan resumes from the stored checkpoint, saves
+    its position after every page and stops before the Lambda timeout, returning
+    completed=False so the caller can continue it in a new invocation.
     
     Args:
         cloudwatch_logs: Boto3 CloudWatch Logs client
@@ -183,43 +974,352 @@ def list_log_groups_and_subscriptions(
         context: Lambda context object
         log_group_permission_prefix: List of prefixes for log groups that need permissions
         add_permissions_to_all_log_groups: Whether to add permissions for all log groups
+        checkpoint_store: Optional store used to resume the scan across invocations
+
+    Returns:
+        dict: Scan summary with log group counts, throttling events, elapsed time and
+        whether the scan completed
     """
-    log_groups = []
-    response = {'nextToken': None}  # Initialize with a dict containing nextToken as None
-    
-    # Paginate through all log groups
-    while response.get('nextToken') is not None or 'logGroups' not in response:
-        kwargs = {}
-        if 'nextToken' in response and response['nextToken'] is not None:
-            kwargs['nextToken'] = response['nextToken']
-        response = cloudwatch_logs.describe_log_groups(**kwargs, logGroupClass="STANDARD")
-        log_groups.extend(response['logGroups'])
-    
+    start_time = time.monotonic()
+    throttles_before = logs_api.throttles + lambda_api.throttles
     region = context.invoked_function_arn.split(":")[3]
     account_id = context.invoked_function_arn.split(":")[4]
-    
+
+    log_group_matcher = get_log_group_matcher(tuple(regex_pattern_list))
+    listing_requests = log_group_matcher.listing_requests()
+    checkpoint = (checkpoint_store.load() if checkpoint_store else None) or {}
+    summary = {'scanned': 0, 'matched': 0, 'subscribed': 0, 'skipped': 0, 'failed': 0}
+    summary.update(checkpoint.get('summary', {}))
+    summary_lock = threading.Lock()
+    limiter = AdaptiveConcurrencyLimiter(int(os.environ.get('SCAN_CONCURRENCY', 5)))
+    page_done = set()
+    permission_planner = None
+    if identify_arn_service(destination_arn) == "lambda":
+        permission_planner = get_permission_planner(destination_arn, region, account_id, log_group_matcher)
+
+    # Leave enough time for the in-flight log groups, the checkpoint and the hand-off,
+    # while making sure that short function timeouts still make progress
+    reserved_millis = None
+    if checkpoint_store:
+        reserved_millis = min(SCAN_HANDOFF_RESERVED_MILLIS, context.get_remaining_time_in_millis() // 3)
+        if checkpoint:
+            logger.info(f"Resuming the log group scan from checkpoint: {summary}")
+
+    def out_of_time() -> bool:
+        return reserved_millis is not None and context.get_remaining_time_in_millis() < reserved_millis
+
+    def scan_worker(log_group_name: str) -> None:
+        # Every throttled call of the log group lowers the concurrency, whether it is a read
+        # or a write and whether or not the API scheduler retried it successfully
+        worker_throttles = get_thread_api_throttles()
+        try:
+            result = subscribe_existing_log_group(
+                cloudwatch_logs, log_group_name, logs_filter, destination_arn, filter_name,
+                region, account_id, log_group_permission_prefix, add_permissions_to_all_log_groups,
+                permission_planner
+            )
+        except Exception as e:
+            logger.error(f"Failed to process log group {log_group_name}: {e}")
+            result = 'failed'
+        # The log group is counted before its slot is released, so that once wait_until_idle
+        # returns the checkpoint sees every processed log group
+        with summary_lock:
+            summary[result] += 1
+            page_done.add(log_group_name)
+        limiter.release(throttled=get_thread_api_throttles() > worker_throttles)
+
+    def save_checkpoint(request_index: int, next_token: Optional[str], done: Iterable[str] = ()) -> None:
+        if checkpoint_store:
+            with summary_lock:
+                counts = {key: summary[key] for key in ('scanned', 'matched', 'subscribed', 'skipped', 'failed')}
+                done = sorted(done)
+            checkpoint_store.save({
+                'requestIndex': request_index,
+                'nextToken': next_token,
+                'done': done,
+                'summary': counts,
+            })
+
+    # Log groups are listed, filtered and submitted page by page, so the first subscriptions
+    # start as soon as the first page arrives and memory does not grow with the account size.
+    # The next page is fetched while the current one is processed, and a page is finished
+    # before its checkpoint is saved, so a checkpoint never skips an unprocessed log group.
+    completed = True
+    with ThreadPoolExecutor(max_workers=limiter.max_concurrency) as executor:
+        for request_index in range(checkpoint.get('requestIndex', 0), len(listing_requests)):
+            resuming = request_index == checkpoint.get('requestIndex')
+            pages = iter_log_group_pages(
+                cloudwatch_logs,
+                checkpoint.get('nextToken') if resuming else None,
+                **listing_requests[request_index]
+            )
+            skip = set(checkpoint.get('done', [])) if resuming else set()
+            for page_token, log_groups, next_token in prefetch_next(pages):
+                page_done.clear()
+                page_done.update(skip)
+                for log_group_name in iter_matching_log_group_names(log_groups, log_group_matcher):
+                    if log_group_name in skip:
+                        continue
+                    if out_of_time():
+                        completed = False
+                        break
+                    summary['matched'] += 1
+                    limiter.acquire()
+                    executor.submit(scan_worker, log_group_name)
+                limiter.wait_until_idle()
+                skip = set()
+                if not completed:
+                    save_checkpoint(request_index, page_token, page_done)
+                    break
+                summary['scanned'] += len(log_groups)
+                if next_token is not None:
+                    save_checkpoint(request_index, next_token)
+                else:
+                    save_checkpoint(request_index + 1, None)
+                if out_of_time():
+                    completed = False
+                    break
+            if not completed:
+                break
+
+    summary['throttled'] = logs_api.throttles + lambda_api.throttles - throttles_before
+    summary['elapsed_seconds'] = round(time.monotonic() - start_time, 2)
+    summary['completed'] = completed
+    summary['api'] = get_api_stats()
+    logger.info(
+        f"{'Finished' if completed else 'Paused'} scanning {summary['scanned']} log groups in {summary['elapsed_seconds']}s: "
+        f"{summary['matched']} matched, {summary['subscribed']} subscribed, {summary['skipped']} skipped, "
+        f"{summary['failed']} failed, {summary['throttled']} throttling events, API calls: {summary['api']}"
+    )
+    return summary
+
+def scan_old_log_groups_until_done(
+    cloudwatch_logs,
+    regex_pattern_list: List[str],
+    logs_filter: str,
+    destination_arn: str,
+    filter_name: str,
+    context,
+    log_group_permission_prefix: List[str],
+    add_permissions_to_all_log_groups: str,
+    checkpoint_store: Optional[ScanCheckpointStore]
+) -> Dict[str, Any]:
+    """
+    Run the existing log group scan and finish it or hand it off to a new invocation.
+
+    When the scan completes, the checkpoint is removed and SCAN_OLD_LOGGROUPS is disabled.
+    When it stops before the Lambda timeout, the function invokes itself asynchronously
+    with a ScanContinuation event that resumes from the saved checkpoint.
+    """
+    summary = list_log_groups_and_subscriptions(
+        cloudwatch_logs, regex_pattern_list, logs_filter, destination_arn, filter_name,
+        context, log_group_permission_prefix, add_permissions_to_all_log_groups, checkpoint_store
+    )
+    if summary['completed']:
+        if checkpoint_store:
+            checkpoint_store.clear()
+        update_scan_old_log_groups_status(context, lambda_client)
+    else:
+        logger.info("Handing off the scan of existing log groups to a new invocation")
+        lambda_api.call(
+            lambda_client.invoke,
+            FunctionName=context.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'ScanContinuation': True})
+        )
+    return summary
+
+def plan_log_group_subscriptions(
+    cloudwatch_logs,
+    regex_pattern_list: List[str],
+    destination_arn: str,
+    region: str,
+    account_id: str,
+    log_group_permission_prefix: List[str],
+    add_permissions_to_all_log_groups: str
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield what a scan of the existing log groups would do, without changing anything.
+
+    Only read calls are made: the log groups are listed like in the scan, the subscription
+    filters of the matching log groups are described concurrently, and the destination
+    Lambda policy is read once to find the log groups that need a new permission. Each
+    matching log group yields one entry, in listing order, with an action of 'subscribe',
+    'already-subscribed', 'subscription-limit' or 'error'. The last entry is the summary.
+    """
+    start_time = time.monotonic()
+    log_group_matcher = get_log_group_matcher(tuple(regex_pattern_list))
+    permission_planner = None
+    if identify_arn_service(destination_arn) == "lambda" and add_permissions_to_all_log_groups == 'false':
+        permission_planner = get_permission_planner(destination_arn, region, account_id, log_group_matcher)
+    summary = {
+        'scanned': 0, 'matched': 0, 'subscribe': 0, 'already-subscribed': 0,
+        'subscription-limit': 0, 'error': 0,
+    }
+    permissions = []
+
+    def plan_log_group(log_group_name: str) -> Dict[str, Any]:
+        entry = {'logGroupName': log_group_name, 'action': 'subscribe', 'existingFilters': 0, 'permission': None}
+        try:
+            subscriptions = subscription_inventory.get(cloudwatch_logs, log_group_name)
+        except Exception as e:
+            entry.update(action='error', error=str(e))
+            return entry
+        entry['existingFilters'] = len(subscriptions)
+        if any(subscription.get('destinationArn') == destination_arn for subscription in subscriptions):
+            entry['action'] = 'already-subscribed'
+        elif len(subscriptions) >= MAX_SUBSCRIPTION_LIMIT:
+            entry['action'] = 'subscription-limit'
+        elif permission_planner and not check_if_log_group_exist_in_log_group_permission_prefix(
+            log_group_name, log_group_permission_prefix
+        ):
+            targets = permission_planner.plan([log_group_name])
+            entry['permission'] = permission_planner.source_arn(targets[0]) if targets else None
+        return entry
+
+    with ThreadPoolExecutor(max_workers=max(1, int(os.environ.get('SCAN_CONCURRENCY', 5)))) as executor:
+        for listing_request in log_group_matcher.listing_requests():
+            pages = iter_log_group_pages(cloudwatch_logs, **listing_request)
+            for _, log_groups, _ in prefetch_next(pages):
+                summary['scanned'] += len(log_groups)
+                names = list(iter_matching_log_group_names(log_groups, log_group_matcher))
+                summary['matched'] += len(names)
+                for entry in executor.map(plan_log_group, names):
+                    summary[entry['action']] += 1
+                    if entry['permission'] and entry['permission'] not in permissions:
+                        permissions.append(entry['permission'])
+                    yield entry
+
+    summary['permissions'] = permissions
+    summary['elapsed_seconds'] = round(time.monotonic() - start_time, 2)
+    summary['api'] = get_api_stats()
+    yield {'summary': summary}
+
+def write_scan_plan(plan: Iterable[Dict[str, Any]], output) -> Dict[str, Any]:
+    """
+    Write the entries of a scan plan to a text stream as NDJSON and return the summary.
+    """
+    summary = {}
+    for entry in plan:
+        output.write(json.dumps(entry) + '\n')
+        summary = entry.get('summary', summary)
+    output.flush()
+    return summary
+
+def iter_log_group_pages(cloudwatch_logs, next_token: Optional[str] = None, **kwargs) -> Iterator[tuple]:
+    """
+    Yield the standard log groups in the region one page at a time.
+
+    Each item is a (page_token, log_groups, next_token) tuple, where page_token is the
+    token that was used to request the page (None for the first page).
+
+    Args:
+        cloudwatch_logs: Boto3 CloudWatch Logs client
+        next_token: Token of the page to start from
+        **kwargs: Extra describe_log_groups arguments, for example logGroupNamePrefix
+    """
+    while True:
+        page_token = next_token
+        if page_token is not None:
+            kwargs['nextToken'] = page_token
+        response = logs_api.call(cloudwatch_logs.describe_log_groups, **kwargs, logGroupClass=SUPPORTED_LOG_GROUP_CLASS)
+        next_token = response.get('nextToken')
+        yield page_token, response.get('logGroups', []), next_token
+        if next_token is None:
+            break
+
+def prefetch_next(iterator: Iterator[Any]) -> Iterator[Any]:
+    """
+    Yield the items of an iterator while the next item is produced in a background thread.
+    """
+    iterator = iter(iterator)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(next, iterator, None)
+        while True:
+            item = future.result()
+            if item is None:
+                return
+            future = executor.submit(next, iterator, None)
+            yield item
+
+def iter_matching_log_group_names(log_groups: Iterable[Dict[str, Any]], log_group_matcher: 'LogGroupMatcher') -> Iterator[str]:
+    """
+    Yield the names of the log groups that match any of the REGEX_PATTERN patterns.
+    """
     for log_group in log_groups:
         log_group_name = log_group['logGroupName']
+        if log_group_matcher.matches(log_group_name):
+            yield log_group_name
 
-        for regex_pattern in regex_pattern_list:
-            if regex_pattern and re.match(regex_pattern, log_group_name):
-                if should_create_subscription(cloudwatch_logs, log_group_name, destination_arn):
-                    if identify_arn_service(destination_arn) == "lambda" and add_permissions_to_all_log_groups == 'false':
-                        if not check_if_log_group_exist_in_log_group_permission_prefix(log_group_name, log_group_permission_prefix):
-                            add_permission_to_lambda(destination_arn, log_group_name, region, account_id)
-                        logger.info(f"Adding subscription filter for {log_group_name}")
-                        status = add_subscription(filter_name, logs_filter, log_group_name, destination_arn)
-                        if status == cfnresponse.FAILED:
-                            logger.warning(f"Retrying to add subscription filter for {log_group_name}")
-                            add_permission_to_lambda(destination_arn, log_group_name, region, account_id)
-                            add_subscription(filter_name, logs_filter, log_group_name, destination_arn)
-                    else:
-                        logger.info(f"Adding subscription filter for {log_group_name}")
-                        status = add_subscription(filter_name, logs_filter, log_group_name, destination_arn)
-                        if status == cfnresponse.FAILED:
-                            logger.warning(f"Retrying to add subscription filter for {log_group_name}")
-                            add_subscription(filter_name, logs_filter, log_group_name, destination_arn)
-                break  # no need to continue the loop if we find a match for the log group
+def subscribe_existing_log_group(
+    cloudwatch_logs,
+    log_group_name: str,
+    logs_filter: str,
+    destination_arn: str,
+    filter_name: str,
+    region: str,
+    account_id: str,
+    log_group_permission_prefix: List[str],
+    add_permissions_to_all_log_groups: str,
+    permission_planner: Optional[LambdaPermissionPlanner] = None
+) -> str:
+    """
+    Subscribe a single existing log group to the destination as part of a scan.
+
+    When a permission planner is given, the destination permission is only added when
+    the current policy does not already cover the log group.
+
+    Throttling errors left after the API scheduler retries are propagated so the scan
+    can lower its concurrency.
+
+    Returns:
+        str: 'subscribed', 'skipped' or 'failed'
+    """
+    if not should_create_subscription(cloudwatch_logs, log_group_name, destination_arn):
+        return 'skipped'
+
+    if identify_arn_service(destination_arn) == "lambda" and add_permissions_to_all_log_groups == 'false':
+        if not check_if_log_group_exist_in_log_group_permission_prefix(log_group_name, log_group_permission_prefix):
+            if permission_planner:
+                permission_planner.ensure_permission(log_group_name)
+            else:
+                add_permission_to_lambda(destination_arn, log_group_name, region, account_id)
+        logger.info(f"Adding subscription filter for {log_group_name}")
+        status = add_subscription(filter_name, logs_filter, log_group_name, destination_arn)
+        if status == cfnresponse.FAILED:
+            # The destination permission may be missing or not propagated yet
+            logger.warning(f"Retrying to add subscription filter for {log_group_name}")
+            if permission_planner:
+                permission_planner.ensure_permission(log_group_name, reload_policy=True)
+            else:
+                add_permission_to_lambda(destination_arn, log_group_name, region, account_id)
+            logs_api.wait_before_retry(1)
+            status = add_subscription(filter_name, logs_filter, log_group_name, destination_arn)
+    else:
+        logger.info(f"Adding subscription filter for {log_group_name}")
+        status = add_subscription(filter_name, logs_filter, log_group_name, destination_arn)
+
+    return 'subscribed' if status == cfnresponse.SUCCESS else 'failed'
+
+def is_throttling_error(error: Exception) -> bool:
+    """
+    Check whether an exception raised by a boto3 client is a throttling error.
+    """
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Check whether an exception raised by a boto3 client is worth retrying.
+
+    Transient service errors, 5xx responses and botocore connection errors and
+    timeouts are retried.
+    """
+    response = getattr(error, 'response', None)
+    if not response:
+        return type(error).__name__ in CONNECTION_ERROR_NAMES
+    status_code = response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+    return response.get('Error', {}).get('Code') in TRANSIENT_ERROR_CODES or status_code >= 500
 
 def cloudtrail_event_failed(event_detail: Dict[str, Any]) -> bool:
     """
@@ -230,15 +1330,22 @@ def cloudtrail_event_failed(event_detail: Dict[str, Any]) -> bool:
     """
     return bool(event_detail.get('errorCode') or event_detail.get('errorMessage'))
 
-def should_create_subscription(cloudwatch_logs, log_group_name: str, destination_arn: str) -> bool:
+def should_create_subscription(
+    cloudwatch_logs,
+    log_group_name: str,
+    destination_arn: str,
+    not_before: Optional[float] = None
+) -> bool:
     """
     Determine whether a log group can accept a new subscription for the destination.
 
+    The subscription filters are read from the subscription inventory, which only calls
+    describe_subscription_filters when the log group is not cached.
+
     Returns False when the destination is already subscribed or the log group has already
     reached the CloudWatch subscription limit.
     """
-    subscriptions = cloudwatch_logs.describe_subscription_filters(logGroupName=log_group_name)
-    subscriptions = subscriptions.get('subscriptionFilters') or []
+    subscriptions = subscription_inventory.get(cloudwatch_logs, log_group_name, not_before)
 
     for subscription in subscriptions:
         if subscription.get('destinationArn') == destination_arn:
@@ -249,12 +1356,21 @@ def should_create_subscription(cloudwatch_logs, log_group_name: str, destination
             )
             return False
 
-    if len(subscriptions) >= 2:
-        logger.warning(f"Skipping {log_group_name} as it already has 2 subscriptions")
+    if len(subscriptions) >= MAX_SUBSCRIPTION_LIMIT:
+        logger.warning(f"Skipping {log_group_name} as it already has {MAX_SUBSCRIPTION_LIMIT} subscriptions")
         return False
 
     return True
 
+def get_event_time(event_detail: Dict[str, Any]) -> Optional[float]:
+    """
+    Return the CloudTrail eventTime of an event as an epoch timestamp, if present.
+    """
+    try:
+        return datetime.strptime(event_detail['eventTime'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
 def should_process_log_group_class(event_detail: Dict[str, Any]) -> bool:
     """
     Allow standard log groups, including events where CloudTrail omits logGroupClass.
@@ -308,7 +1424,8 @@ def add_subscription(
         if role_arn:
             subscription_params['roleArn'] = role_arn
             
-        cloudwatch_logs.put_subscription_filter(**subscription_params)
+        logs_api.call(cloudwatch_logs.put_subscription_filter, **subscription_params)
+        subscription_inventory.record_subscription(log_group_to_subscribe, filter_name, destination_arn)
         logger.info(f"Successfully put subscription filter for {log_group_to_subscribe}")
         return cfnresponse.SUCCESS
     except Exception as e:
@@ -343,7 +1460,7 @@ def add_permissions_first_time(
         for prefix in log_group_permission_prefix:
             add_permission_to_lambda(destination_arn, f"{prefix}*", region, account_id)
 
-def add_permission_to_lambda(destination_arn: str, log_group_name: str, region: str, account_id: str) -> None:
+def add_permission_to_lambda(destination_arn: str, log_group_name: str, region: str, account_id: str) -> bool:
     """
     Add resource-based permission to Lambda function for CloudWatch Logs invocation.
     
@@ -357,13 +1474,14 @@ def add_permission_to_lambda(destination_arn: str, log_group_name: str, region:
         region: AWS region
         account_id: AWS account ID
     
-    Raises:
-        Exception: When permission addition fails
+    Returns:
+        bool: True when the permission was added, False when adding it failed
     """
     try:
         # Sanitize log group name for statement ID (only alphanumeric, hyphen, underscore)
         log_group_statement_id = re.sub(r'[^a-zA-Z0-9\-_]', '-', log_group_name)
-        lambda_client.add_permission(
+        lambda_api.call(
+            lambda_client.add_permission,
             FunctionName=destination_arn,
             StatementId=f'allow-trigger-from-{log_group_statement_id}',
             Action='lambda:InvokeFunction',
@@ -371,8 +1489,10 @@ def add_permission_to_lambda(destination_arn: str, log_group_name: str, region:
             SourceArn=f'arn:aws:logs:{region}:{account_id}:log-group:{log_group_name}:*',
         )
         logger.info(f"Successfully added permission to lambda {destination_arn}, with log group name: {log_group_name}")
+        return True
     except Exception as e:
         logger.error(f"Failed to add permission to lambda {destination_arn}, with log group name: {log_group_name}: {e}")
+        return False
 
 def check_if_log_group_exist_in_log_group_permission_prefix(
     log_group_name: str, 
@@ -442,7 +1562,7 @@ def update_scan_old_log_groups_status(context, lambda_client) -> None:
     function_name = context.function_name
 
     # Fetch the current function configuration
-    current_config = lambda_client.get_function_configuration(FunctionName=function_name)
+    current_config = lambda_api.call(lambda_client.get_function_configuration, FunctionName=function_name)
     current_env_vars = current_config['Environment']['Variables']
 
     # Update the environment variables
@@ -450,7 +1570,8 @@ def update_scan_old_log_groups_status(context, lambda_client) -> None:
 
     # Update the Lambda function configuration
     try:
-        lambda_client.update_function_configuration(
+        lambda_api.call(
+            lambda_client.update_function_configuration,
             FunctionName=function_name,
             Environment={'Variables': current_env_vars}
         )
@@ -0,0 +1,70 @@
+"""
+Microbenchmark for matching log group names against REGEX_PATTERN.
+
+Compares the previous approach (re.match with every pattern in turn) with the
+precompiled LogGroupMatcher on 10k log group names and 200 patterns.
+
+Usage: python tests/benchmark_regex_matcher.py [names] [patterns]
+"""
+import random
+import re
+import sys
+import time
+
+from test_lambda_function import load_lambda_module
+
+
+SERVICES = ["lambda", "ecs", "rds", "apigateway", "codebuild", "eks"]
+
+
+def build_patterns(count):
+    return [f"/aws/{SERVICES[i % len(SERVICES)]}/team-{i}-.*" for i in range(count)]
+
+
+def build_names(count, pattern_count):
+    rng = random.Random(42)
+    return [
+        f"/aws/{rng.choice(SERVICES)}/team-{rng.randrange(pattern_count * 2)}-service-{i}"
+        for i in range(count)
+    ]
+
+
+def match_one_by_one(patterns, names):
+    matched = 0
+    for name in names:
+        for pattern in patterns:
+            if pattern and re.match(pattern, name):
+                matched += 1
+                break
+    return matched
+
+
+def main():
+    name_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    pattern_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    module, _ = load_lambda_module()
+    patterns = build_patterns(pattern_count)
+    names = build_names(name_count, pattern_count)
+
+    start = time.perf_counter()
+    expected = match_one_by_one(patterns, names)
+    one_by_one_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = module.LogGroupMatcher(patterns)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matched = sum(1 for name in names if matcher.matches(name))
+    matcher_seconds = time.perf_counter() - start
+
+    assert matched == expected, (matched, expected)
+    print(f"{name_count} names x {pattern_count} patterns, {matched} matches")
+    print(f"re.match per pattern: {one_by_one_seconds:.3f}s")
+    print(f"LogGroupMatcher:      {matcher_seconds:.3f}s (+{build_seconds:.3f}s to compile)")
+    print(f"speedup:              {one_by_one_seconds / max(matcher_seconds, 1e-9):.1f}x")
+    print(f"listing requests:     {len(matcher.listing_requests())}")
+
+
+if __name__ == "__main__":
+    main()
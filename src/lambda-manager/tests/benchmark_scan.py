@@ -0,0 +1,133 @@
+"""
+Benchmark the existing log group scan and the CreateLogGroup event path.
+
+Both paths run against FakeAwsService, an in-process stand-in for CloudWatch Logs and
+Lambda with a configurable latency, throttling rate and account size. For every account
+size the API calls per log group, the wall time and the peak memory (measured with
+tracemalloc, which slows the run down) are reported.
+
+Usage: python tests/benchmark_scan.py [--sizes 1000,10000,50000] [--latency 0.005]
+           [--throttle-rate 0.01] [--destination lambda] [--paths scan,events]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import tracemalloc
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from fake_aws import FakeAwsService
+from test_lambda_function import load_lambda_module
+
+
+DESTINATIONS = {
+    "firehose": "arn:aws:firehose:us-east-1:123456789012:deliverystream/destination",
+    "lambda": "arn:aws:lambda:us-east-1:123456789012:function:destination",
+}
+
+
+def build_context():
+    return SimpleNamespace(
+        invoked_function_arn="arn:aws:lambda:us-east-1:123456789012:function:lambda-manager",
+        function_name="lambda-manager",
+        aws_request_id="benchmark",
+        get_remaining_time_in_millis=lambda: 900000,
+    )
+
+
+def run_scan(module, service, args):
+    summary = module.list_log_groups_and_subscriptions(
+        service.logs, [args.pattern], "", DESTINATIONS[args.destination], "Coralogix_Filter_benchmark",
+        build_context(), [""], "false",
+    )
+    return summary["matched"]
+
+
+def run_events(module, service, args, size):
+    matcher = module.get_log_group_matcher((args.pattern,))
+    # The events create as many new log groups as the account already has
+    names = [f"/aws/lambda/new-service-{i:06d}" for i in range(size)]
+    for name in names:
+        service.create_log_group(name)
+    failed = 0
+    for start in range(0, len(names), args.batch_size):
+        records = [
+            {
+                "messageId": name,
+                "eventSource": "aws:sqs",
+                "body": json.dumps({"detail": {
+                    "eventTime": "2026-10-18T10:00:00Z",
+                    "requestParameters": {"logGroupName": name},
+                }}),
+            }
+            for name in names[start:start + args.batch_size]
+        ]
+        response = module.process_create_log_group_batch(
+            records, matcher, args.destination, "", DESTINATIONS[args.destination], "Coralogix_Filter_benchmark",
+            "us-east-1", "123456789012", "false", "false", [""],
+        )
+        failed += len(response["batchItemFailures"])
+    if failed:
+        print(f"  {failed} events failed")
+    return len(names)
+
+
+def measure(path, size, args):
+    module, _ = load_lambda_module()
+    module.logger.setLevel(logging.WARNING)
+    module.logs_api.base_delay = args.base_delay
+    module.lambda_api.base_delay = args.base_delay
+    service = FakeAwsService(
+        log_group_count=size, latency=args.latency, throttle_rate=args.throttle_rate,
+        subscribed_ratio=args.subscribed_ratio,
+    )
+
+    with patch.object(module, "cloudwatch_logs", service.logs), patch.object(
+        module, "lambda_client", service.lambda_client
+    ), patch.dict(os.environ, {"SCAN_CONCURRENCY": str(args.concurrency)}):
+        tracemalloc.start()
+        start = time.perf_counter()
+        if path == "scan":
+            processed = run_scan(module, service, args)
+        else:
+            processed = run_events(module, service, args, size)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    calls = service.total_calls()
+    print(
+        f"{path:<7}{size:>8}{processed:>10}{calls:>9}{calls / max(processed, 1):>12.2f}"
+        f"{service.throttles:>11}{elapsed:>10.2f}{peak / 2 ** 20:>12.1f}"
+    )
+    if args.verbose:
+        print(f"  {dict(service.calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,50000", help="comma-separated account sizes")
+    parser.add_argument("--paths", default="scan,events", help="comma-separated paths: scan, events")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of API calls throttled")
+    parser.add_argument("--subscribed-ratio", type=float, default=0.1,
+                        help="fraction of log groups that already have a subscription filter")
+    parser.add_argument("--destination", choices=sorted(DESTINATIONS), default="firehose")
+    parser.add_argument("--pattern", default="/aws/lambda/.*", help="REGEX_PATTERN")
+    parser.add_argument("--concurrency", type=int, default=5, help="SCAN_CONCURRENCY")
+    parser.add_argument("--batch-size", type=int, default=10, help="SQS batch size of the events path")
+    parser.add_argument("--base-delay", type=float, default=0.01, help="base delay of the retry backoff")
+    parser.add_argument("--verbose", action="store_true", help="print the calls per API operation")
+    args = parser.parse_args()
+
+    print(f"{'path':<7}{'groups':>8}{'processed':>10}{'calls':>9}{'calls/group':>12}"
+          f"{'throttles':>11}{'wall (s)':>10}{'peak (MiB)':>12}")
+    for path in args.paths.split(","):
+        for size in args.sizes.split(","):
+            measure(path, int(size), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+In-process stand-in for the CloudWatch Logs and Lambda APIs used by lambda-manager.
+
+FakeAwsService keeps an account of log groups, their subscription filters and the
+resource policy of the destination Lambda, and exposes boto3-like clients with a
+configurable latency and throttling rate. Every call is counted per operation.
+"""
+import bisect
+import json
+import random
+import threading
+import time
+from collections import Counter
+
+
+class FakeClientError(Exception):
+    def __init__(self, code, message, status_code=400):
+        super().__init__(f"An error occurred ({code}): {message}")
+        self.response = {"Error": {"Code": code, "Message": message}, "ResponseMetadata": {"HTTPStatusCode": status_code}}
+
+
+class FakeAwsService:
+    def __init__(self, log_group_count=1000, latency=0.0, throttle_rate=0.0, subscribed_ratio=0.0,
+                 page_size=50, prefixes=("/aws/lambda/", "/aws/ecs/", "/custom/"), seed=42):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.page_size = page_size
+        self.calls = Counter()
+        self.throttles = 0
+        self.policy_statements = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.log_group_names = sorted(
+            f"{prefixes[i % len(prefixes)]}service-{i:06d}" for i in range(log_group_count)
+        )
+        self.subscriptions = {
+            name: ([{"filterName": "existing", "destinationArn": "arn:aws:firehose:us-east-1:123456789012:deliverystream/other"}]
+                   if self._random.random() < subscribed_ratio else [])
+            for name in self.log_group_names
+        }
+        self.logs = FakeLogsClient(self)
+        self.lambda_client = FakeLambdaClient(self)
+
+    def create_log_group(self, name):
+        with self._lock:
+            if name not in self.subscriptions:
+                bisect.insort(self.log_group_names, name)
+                self.subscriptions[name] = []
+
+    def request(self, operation):
+        """
+        Count a call, wait for the configured latency and maybe throttle it.
+        """
+        with self._lock:
+            self.calls[operation] += 1
+            throttled = self._random.random() < self.throttle_rate
+            if throttled:
+                self.throttles += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            raise FakeClientError("ThrottlingException", "Rate exceeded")
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+
+class FakeLogsClient:
+    def __init__(self, service):
+        self.service = service
+
+    def describe_log_groups(self, logGroupNamePrefix="", nextToken=None, limit=None, logGroupClass=None):
+        self.service.request("DescribeLogGroups")
+        names = self.service.log_group_names
+        start = int(nextToken) if nextToken else bisect.bisect_left(names, logGroupNamePrefix)
+        page = []
+        index = start
+        while index < len(names) and len(page) < (limit or self.service.page_size):
+            if not names[index].startswith(logGroupNamePrefix):
+                break
+            page.append({"logGroupName": names[index], "logGroupClass": logGroupClass or "STANDARD"})
+            index += 1
+        response = {"logGroups": page}
+        if index < len(names) and names[index].startswith(logGroupNamePrefix):
+            response["nextToken"] = str(index)
+        return response
+
+    def describe_subscription_filters(self, logGroupName):
+        self.service.request("DescribeSubscriptionFilters")
+        if logGroupName not in self.service.subscriptions:
+            raise FakeClientError("ResourceNotFoundException", "The specified log group does not exist.")
+        return {"subscriptionFilters": [dict(subscription) for subscription in self.service.subscriptions[logGroupName]]}
+
+    def put_subscription_filter(self, logGroupName, filterName, filterPattern, destinationArn, roleArn=None):
+        self.service.request("PutSubscriptionFilter")
+        with self.service._lock:
+            subscriptions = self.service.subscriptions[logGroupName]
+            existing = [subscription for subscription in subscriptions if subscription["filterName"] != filterName]
+            if len(existing) >= 2:
+                raise FakeClientError("LimitExceededException", "Resource limit exceeded.")
+            existing.append({"filterName": filterName, "destinationArn": destinationArn})
+            self.service.subscriptions[logGroupName] = existing
+        return {}
+
+
+class FakeLambdaClient:
+    def __init__(self, service):
+        self.service = service
+
+    def get_policy(self, FunctionName):
+        self.service.request("GetPolicy")
+        if not self.service.policy_statements:
+            raise FakeClientError("ResourceNotFoundException", "The resource you requested does not exist.", 404)
+        return {"Policy": json.dumps({"Version": "2012-10-17", "Statement": list(self.service.policy_statements)})}
+
+    def add_permission(self, FunctionName, StatementId, Action, Principal, SourceArn):
+        self.service.request("AddPermission")
+        with self.service._lock:
+            if any(statement["Sid"] == StatementId for statement in self.service.policy_statements):
+                raise FakeClientError("ResourceConflictException", "The statement id provided already exists.", 409)
+            self.service.policy_statements.append({
+                "Sid": StatementId,
+                "Effect": "Allow",
+                "Principal": {"Service": Principal},
+                "Action": Action,
+                "Resource": FunctionName,
+                "Condition": {"ArnLike": {"AWS:SourceArn": SourceArn}},
+            })
+        return {}
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.service.request("Invoke")
+        return {"StatusCode": 202}
+
+    def get_function_configuration(self, FunctionName):
+        self.service.request("GetFunctionConfiguration")
+        return {"Environment": {"Variables": {"SCAN_OLD_LOGGROUPS": "true"}}}
+
+    def update_function_configuration(self, FunctionName, Environment):
+        self.service.request("UpdateFunctionConfiguration")
+        return {}
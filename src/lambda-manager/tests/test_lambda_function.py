@@ -1,12 +1,20 @@
 import importlib.util
+import io
+import json
 import os
+import re
 import sys
+import tempfile
+import threading
+import time
 import types
 import unittest
 from pathlib import Path
 from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
+from fake_aws import FakeAwsService
+
 
 MODULE_PATH = Path(__file__).resolve().parents[1] / "lambda_function.py"
 
@@ -34,6 +42,7 @@ def load_lambda_module():
     spec = importlib.util.spec_from_file_location(module_name, MODULE_PATH)
     module = importlib.util.module_from_spec(spec)
 
+    # The API rate limits are covered by AwsApiSchedulerTests, keep the rest of the tests fast
     with patch.dict(
         sys.modules,
         {
@@ -42,7 +51,7 @@ def load_lambda_module():
             "botocore.config": fake_botocore_config,
             "cfnresponse": fake_cfnresponse,
         },
-    ):
+    ), patch.dict(os.environ, {"LOGS_API_RATE": "0", "LAMBDA_API_RATE": "0"}):
         spec.loader.exec_module(module)
 
     return module, fake_cfnresponse
@@ -144,5 +153,669 @@ class LambdaManagerCreateLogGroupTests(unittest.TestCase):
                 add_permission.assert_not_called()
                 add_subscription.assert_not_called()
 
+    def test_sqs_batch_coalesces_log_groups_and_reports_failures(self):
+        def message(message_id, log_group_name, **detail):
+            body = {"detail": {"requestParameters": {"logGroupName": log_group_name}, **detail}}
+            return {"messageId": message_id, "eventSource": "aws:sqs", "body": json.dumps(body)}
+
+        event = {
+            "Records": [
+                message("1", "/aws/lambda/a", eventTime="2026-10-18T10:00:00Z"),
+                message("2", "/aws/lambda/a", eventTime="2026-10-18T10:00:01Z"),
+                message("3", "/aws/lambda/b"),
+                message("4", "/aws/lambda/b", errorCode="ResourceAlreadyExistsException"),
+                message("5", "/ecs/not-matching"),
+                {"messageId": "6", "eventSource": "aws:sqs", "body": "not json"},
+            ]
+        }
+        self.module.cloudwatch_logs.describe_subscription_filters.return_value = {"subscriptionFilters": []}
+
+        def add_subscription(filter_name, logs_filter, log_group_name, destination_arn):
+            return self.cfnresponse.FAILED if log_group_name == "/aws/lambda/b" else self.cfnresponse.SUCCESS
+
+        env = {
+            "REGEX_PATTERN": "/aws/lambda/.*",
+            "DESTINATION_TYPE": "lambda",
+            "DESTINATION_ARN": self.destination_arn,
+            "SCAN_OLD_LOGGROUPS": "false",
+            "DISABLE_ADD_PERMISSION": "true",
+            "ADD_PERMISSIONS_TO_ALL_LOG_GROUPS": "false",
+            "LOG_GROUP_PERMISSION_PREFIX": "",
+        }
+        with patch.dict(os.environ, env, clear=False), patch.object(
+            self.module, "add_subscription", side_effect=add_subscription
+        ) as add_subscription_mock:
+            response = self.module.lambda_handler(event, self.context)
+
+        self.assertEqual(
+            ["3", "4", "6"],
+            sorted(failure["itemIdentifier"] for failure in response["batchItemFailures"]),
+        )
+        subscribed = [call.args[2] for call in add_subscription_mock.call_args_list]
+        self.assertEqual(1, subscribed.count("/aws/lambda/a"))
+        self.assertEqual(2, subscribed.count("/aws/lambda/b"))
+        self.assertEqual(2, self.module.cloudwatch_logs.describe_subscription_filters.call_count)
+        self.cfnresponse.send.assert_not_called()
+
+    def test_sqs_batch_is_returned_to_the_queue_while_existing_log_groups_are_scanned(self):
+        body = json.dumps({"detail": {"requestParameters": {"logGroupName": "/aws/lambda/a"}}})
+        event = {"Records": [{"messageId": message_id, "eventSource": "aws:sqs", "body": body} for message_id in "12"]}
+
+        with patch.dict(os.environ, {"REGEX_PATTERN": "/aws/lambda/.*", "SCAN_OLD_LOGGROUPS": "true"}, clear=False), patch.object(
+            self.module, "add_subscription"
+        ) as add_subscription:
+            response = self.module.lambda_handler(event, self.context)
+
+        self.assertEqual({"batchItemFailures": [{"itemIdentifier": "1"}, {"itemIdentifier": "2"}]}, response)
+        add_subscription.assert_not_called()
+
+
+class LogGroupMatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.module, _ = load_lambda_module()
+
+    def test_combined_matcher_agrees_with_re_match(self):
+        patterns = ["/aws/lambda/.*", "/ecs/(api|worker)-\\d+$", "", "(?P<env>prod)-.*", "(?P<env>dev)-.*"]
+        names = ["/aws/lambda/a", "/ecs/api-12", "/ecs/api-x", "prod-db", "dev-db", "qa-db", "/aws/rds/x"]
+        matcher = self.module.LogGroupMatcher(patterns)
+
+        for name in names:
+            with self.subTest(name=name):
+                expected = any(pattern and re.match(pattern, name) for pattern in patterns)
+                self.assertEqual(bool(expected), matcher.matches(name))
+
+    def test_literal_prefix_extraction(self):
+        cases = {
+            "/aws/lambda/.*": "/aws/lambda/",
+            "^/aws/lambda/prod-\\d+": "/aws/lambda/prod-",
+            "/aws/ecs\\.svc/x": "/aws/ecs.svc/x",
+            "/aws/lambdas?/x": "/aws/lambda",
+            "/aws/lambda+x": "/aws/lambda",
+            "/aws/(lambda|ecs)/.*": "",
+            "/aws/lambda|/ecs": "",
+            "[a-z]+": "",
+        }
+        for pattern, prefix in cases.items():
+            with self.subTest(pattern=pattern):
+                self.assertEqual(prefix, self.module.literal_prefix(pattern))
+
+    def test_listing_requests_use_the_shortest_covering_prefixes(self):
+        matcher = self.module.LogGroupMatcher(["/aws/lambda/prod-.*", "/aws/lambda/.*", "/ecs/.*"])
+
+        self.assertEqual(
+            [{"logGroupNamePrefix": "/aws/lambda/"}, {"logGroupNamePrefix": "/ecs/"}],
+            matcher.listing_requests(),
+        )
+        self.assertEqual([{}], self.module.LogGroupMatcher(["/aws/lambda/.*", ".*-prod"]).listing_requests())
+        self.assertEqual([], self.module.LogGroupMatcher([""]).listing_requests())
+
+
+class SubscriptionInventoryTests(unittest.TestCase):
+    def setUp(self):
+        self.module, _ = load_lambda_module()
+        self.logs = MagicMock(name="inventory_logs_client")
+        self.logs.describe_subscription_filters.return_value = {
+            "subscriptionFilters": [{"filterName": "other", "destinationArn": "arn:other"}]
+        }
+        self.inventory = self.module.SubscriptionInventory(ttl_seconds=60)
+
+    def test_lookups_are_answered_from_the_cache_until_the_ttl_expires(self):
+        with patch.object(self.module.time, "time", return_value=1000):
+            self.inventory.get(self.logs, "/aws/lambda/a")
+            self.inventory.get(self.logs, "/aws/lambda/a")
+        self.logs.describe_subscription_filters.assert_called_once_with(logGroupName="/aws/lambda/a")
+
+        with patch.object(self.module.time, "time", return_value=1061):
+            self.inventory.get(self.logs, "/aws/lambda/a")
+        self.assertEqual(2, self.logs.describe_subscription_filters.call_count)
+        self.assertEqual((1, 2), (self.inventory.hits, self.inventory.misses))
+
+    def test_recorded_subscriptions_are_used_for_duplicate_and_limit_checks(self):
+        self.inventory.get(self.logs, "/aws/lambda/a")
+        self.inventory.record_subscription("/aws/lambda/a", "Coralogix_Filter_1", "arn:destination")
+
+        with patch.object(self.module, "subscription_inventory", self.inventory):
+            self.assertFalse(self.module.should_create_subscription(self.logs, "/aws/lambda/a", "arn:destination"))
+            self.assertFalse(self.module.should_create_subscription(self.logs, "/aws/lambda/a", "arn:third"))
+        self.logs.describe_subscription_filters.assert_called_once()
+
+    def test_subscriptions_of_uncached_log_groups_are_described_on_the_next_lookup(self):
+        self.inventory.record_subscription("/aws/lambda/a", "Coralogix_Filter_1", "arn:destination")
+
+        subscriptions = self.inventory.get(self.logs, "/aws/lambda/a")
+
+        self.assertEqual([{"filterName": "other", "destinationArn": "arn:other"}], subscriptions)
+        self.logs.describe_subscription_filters.assert_called_once_with(logGroupName="/aws/lambda/a")
+
+    def test_entries_recorded_before_the_event_are_refreshed(self):
+        with patch.object(self.module.time, "time", return_value=1000):
+            self.inventory.get(self.logs, "/aws/lambda/a")
+        with patch.object(self.module.time, "time", return_value=1010):
+            self.inventory.get(self.logs, "/aws/lambda/a", not_before=1005)
+            self.inventory.get(self.logs, "/aws/lambda/a", not_before=1005)
+
+        self.assertEqual(2, self.logs.describe_subscription_filters.call_count)
+
+    def test_event_time_is_parsed_from_cloudtrail_events(self):
+        self.assertEqual(0, self.module.get_event_time({"eventTime": "1970-01-01T00:00:00Z"}))
+        self.assertIsNone(self.module.get_event_time({}))
+
+
+class LambdaPermissionPlannerTests(unittest.TestCase):
+    def setUp(self):
+        self.module, _ = load_lambda_module()
+        self.destination_arn = "arn:aws:lambda:us-east-1:123456789012:function:destination"
+        policy = {
+            "Statement": [
+                {
+                    "Sid": "allow-trigger-from--aws-lambda-api-",
+                    "Effect": "Allow",
+                    "Principal": {"Service": "logs.amazonaws.com"},
+                    "Action": "lambda:InvokeFunction",
+                    "Condition": {
+                        "ArnLike": {
+                            "AWS:SourceArn": "arn:aws:logs:us-east-1:123456789012:log-group:/aws/lambda/api*:*"
+                        }
+                    },
+                },
+                {
+                    "Sid": "unrelated",
+                    "Effect": "Allow",
+                    "Principal": {"Service": "events.amazonaws.com"},
+                    "Action": "lambda:InvokeFunction",
+                },
+            ]
+        }
+        self.module.lambda_client.get_policy.return_value = {"Policy": json.dumps(policy)}
+
+    def planner(self, prefixes=()):
+        return self.module.LambdaPermissionPlanner(self.destination_arn, "us-east-1", "123456789012", prefixes)
+
+    def test_covered_log_groups_are_skipped_without_api_calls(self):
+        planner = self.planner()
+
+        with patch.object(self.module, "add_permission_to_lambda", return_value=True) as add_permission:
+            self.assertFalse(planner.ensure_permission("/aws/lambda/api-orders"))
+            self.assertTrue(planner.ensure_permission("/aws/lambda/worker"))
+            self.assertFalse(planner.ensure_permission("/aws/lambda/worker"))
+
+        add_permission.assert_called_once_with(self.destination_arn, "/aws/lambda/worker", "us-east-1", "123456789012")
+        self.module.lambda_client.get_policy.assert_called_once_with(FunctionName=self.destination_arn)
+
+    def test_covered_log_groups_do_not_wait_for_add_permission(self):
+        planner = self.planner()
+        covered = []
+
+        def add_permission(*args):
+            checker = threading.Thread(target=lambda: covered.append(planner.ensure_permission("/aws/lambda/api-orders")))
+            checker.start()
+            checker.join(timeout=5)
+            return True
+
+        with patch.object(self.module, "add_permission_to_lambda", side_effect=add_permission):
+            self.assertTrue(planner.ensure_permission("/aws/lambda/worker"))
+
+        self.assertEqual([False], covered)
+
+    def test_subscription_retry_goes_through_the_planner(self):
+        planner = self.planner()
+
+        with patch.object(self.module, "should_create_subscription", return_value=True), patch.object(
+            self.module, "add_subscription", side_effect=["FAILED", "SUCCESS"]
+        ), patch.object(self.module, "add_permission_to_lambda", return_value=True) as add_permission, patch.object(
+            self.module.logs_api, "base_delay", 0
+        ):
+            status = self.module.subscribe_existing_log_group(
+                self.module.cloudwatch_logs, "/aws/lambda/api-orders", "", self.destination_arn, "filter",
+                "us-east-1", "123456789012", [], "false", planner
+            )
+
+        self.assertEqual("subscribed", status)
+        add_permission.assert_not_called()
+        self.assertEqual(2, self.module.lambda_client.get_policy.call_count)
+
+    def test_subscription_retry_adds_back_a_statement_removed_since_the_policy_was_read(self):
+        planner = self.planner()
+        self.assertTrue(planner.is_covered("/aws/lambda/api-orders"))
+        self.module.lambda_client.get_policy.return_value = {"Policy": json.dumps({"Statement": []})}
+
+        with patch.object(self.module, "should_create_subscription", return_value=True), patch.object(
+            self.module, "add_subscription", side_effect=["FAILED", "SUCCESS"]
+        ), patch.object(self.module, "add_permission_to_lambda", return_value=True) as add_permission, patch.object(
+            self.module.logs_api, "base_delay", 0
+        ):
+            status = self.module.subscribe_existing_log_group(
+                self.module.cloudwatch_logs, "/aws/lambda/api-orders", "", self.destination_arn, "filter",
+                "us-east-1", "123456789012", [], "false", planner
+            )
+
+        self.assertEqual("subscribed", status)
+        add_permission.assert_called_once_with(self.destination_arn, "/aws/lambda/api-orders", "us-east-1", "123456789012")
+
+    def test_prefix_statements_cover_many_log_groups(self):
+        planner = self.planner(prefixes=["/aws/lambda/", "/aws/lambda/prod-"])
+        names = [f"/aws/lambda/prod-{i}" for i in range(100)] + ["/ecs/service"]
+
+        self.assertEqual(["/aws/lambda/*", "/ecs/service"], planner.plan(names))
+        with patch.object(self.module, "add_permission_to_lambda", return_value=True) as add_permission:
+            for name in names:
+                planner.ensure_permission(name)
+
+        self.assertEqual(
+            ["/aws/lambda/*", "/ecs/service"],
+            [call.args[1] for call in add_permission.call_args_list],
+        )
+
+    def test_missing_policy_covers_nothing(self):
+        self.module.lambda_client.get_policy.side_effect = Exception("ResourceNotFoundException")
+
+        self.assertEqual(["/aws/lambda/api-orders"], self.planner().plan(["/aws/lambda/api-orders"]))
+
+    def test_consolidation_uses_regex_prefixes_only_when_enabled(self):
+        matcher = self.module.LogGroupMatcher(["/aws/lambda/.*", "/.*"])
+
+        with patch.dict(os.environ, {"CONSOLIDATE_PERMISSIONS": "true"}, clear=False):
+            planner = self.module.get_permission_planner(self.destination_arn, "us-east-1", "123456789012", matcher)
+        self.assertEqual(["/aws/lambda/"], planner.consolidation_prefixes)
+
+        with patch.dict(os.environ, {"CONSOLIDATE_PERMISSIONS": "false"}, clear=False):
+            planner = self.module.get_permission_planner(self.destination_arn, "us-east-1", "123456789012", matcher)
+        self.assertEqual([], planner.consolidation_prefixes)
+
+
+class ThrottlingError(Exception):
+    def __init__(self):
+        super().__init__("Rate exceeded")
+        self.response = {"Error": {"Code": "ThrottlingException"}}
+
+
+class LambdaManagerScanTests(unittest.TestCase):
+    def setUp(self):
+        self.module, self.cfnresponse = load_lambda_module()
+        self.context = SimpleNamespace(
+            invoked_function_arn="arn:aws:lambda:us-east-1:123456789012:function:lambda-manager",
+            function_name="lambda-manager",
+            aws_request_id="request-id",
+        )
+        self.destination_arn = "arn:aws:firehose:us-east-1:123456789012:deliverystream/destination"
+        self.logs = MagicMock(name="scan_logs_client")
+        self.logs.describe_log_groups.side_effect = [
+            {
+                "logGroups": [{"logGroupName": f"/aws/lambda/function-{i}"} for i in range(20)],
+                "nextToken": "page-2",
+            },
+            {
+                "logGroups": [{"logGroupName": "/ecs/service"}, {"logGroupName": "/aws/lambda/last"}],
+            },
+        ]
+
+    def scan(self):
+        with patch.dict(os.environ, {"SCAN_CONCURRENCY": "4"}, clear=False):
+            return self.module.list_log_groups_and_subscriptions(
+                self.logs,
+                ["/aws/lambda/.*"],
+                "",
+                self.destination_arn,
+                "Coralogix_Filter_test",
+                self.context,
+                [""],
+                "false",
+            )
+
+    def test_scan_subscribes_matching_log_groups_and_reports_counts(self):
+        self.logs.describe_subscription_filters.side_effect = lambda logGroupName: {
+            "subscriptionFilters": [{"destinationArn": self.destination_arn}]
+            if logGroupName == "/aws/lambda/function-0"
+            else []
+        }
+
+        with patch.object(self.module, "add_subscription", return_value=self.cfnresponse.SUCCESS) as add_subscription:
+            summary = self.scan()
+
+        self.assertEqual(22, summary["scanned"])
+        self.assertEqual(21, summary["matched"])
+        self.assertEqual(20, summary["subscribed"])
+        self.assertEqual(1, summary["skipped"])
+        self.assertEqual(0, summary["failed"])
+        self.assertEqual(20, add_subscription.call_count)
+        self.assertNotIn(
+            "/ecs/service",
+            [call.args[2] for call in add_subscription.call_args_list],
+        )
+
+    def test_dry_run_plans_the_scan_without_changing_anything(self):
+        destination_arn = "arn:aws:lambda:us-east-1:123456789012:function:destination"
+        other_filter = {"destinationArn": "arn:aws:firehose:us-east-1:123456789012:deliverystream/other"}
+        self.logs.describe_subscription_filters.side_effect = lambda logGroupName: {
+            "subscriptionFilters": {
+                "/aws/lambda/function-0": [{"destinationArn": destination_arn}],
+                "/aws/lambda/function-2": [other_filter, other_filter],
+            }.get(logGroupName, [])
+        }
+        self.module.lambda_client.get_policy.return_value = {"Policy": json.dumps({"Statement": [{
+            "Effect": "Allow",
+            "Principal": {"Service": "logs.amazonaws.com"},
+            "Action": "lambda:InvokeFunction",
+            "Condition": {"ArnLike": {"AWS:SourceArn": "arn:aws:logs:us-east-1:123456789012:log-group:/aws/lambda/function-1:*"}},
+        }]})}
+        output = io.StringIO()
+
+        with patch.dict(os.environ, {"SCAN_CONCURRENCY": "4"}, clear=False):
+            summary = self.module.write_scan_plan(
+                self.module.plan_log_group_subscriptions(
+                    self.logs, ["/aws/lambda/.*"], destination_arn, "us-east-1", "123456789012", [""], "false"
+                ),
+                output,
+            )
+
+        entries = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual({"summary": summary}, entries[-1])
+        self.assertEqual(
+            ["/aws/lambda/function-0", "/aws/lambda/function-1", "/aws/lambda/function-2"],
+            [entry["logGroupName"] for entry in entries[:3]],
+        )
+        self.assertEqual(
+            ["already-subscribed", "subscribe", "subscription-limit", "subscribe"],
+            [entry["action"] for entry in entries[:4]],
+        )
+        self.assertIsNone(entries[1]["permission"])
+        self.assertEqual(
+            "arn:aws:logs:us-east-1:123456789012:log-group:/aws/lambda/function-3:*", entries[3]["permission"]
+        )
+        self.assertEqual((22, 21, 19, 1, 1), (
+            summary["scanned"], summary["matched"], summary["subscribe"],
+            summary["already-subscribed"], summary["subscription-limit"],
+        ))
+        self.assertEqual(18, len(summary["permissions"]))
+        self.logs.put_subscription_filter.assert_not_called()
+        self.module.lambda_client.add_permission.assert_not_called()
+
+    def test_log_groups_are_listed_one_page_at_a_time(self):
+        pages = self.module.iter_log_group_pages(self.logs)
+
+        page_token, log_groups, next_token = next(pages)
+        self.assertEqual((None, "/aws/lambda/function-0", "page-2"), (page_token, log_groups[0]["logGroupName"], next_token))
+        self.logs.describe_log_groups.assert_called_once_with(logGroupClass="STANDARD")
+
+        page_token, log_groups, next_token = next(pages)
+
+        self.assertEqual(("page-2", "/aws/lambda/last", None), (page_token, log_groups[-1]["logGroupName"], next_token))
+        self.logs.describe_log_groups.assert_called_with(nextToken="page-2", logGroupClass="STANDARD")
+
+    def test_scan_retries_throttled_log_groups_with_lower_concurrency(self):
+        throttled_once = set()
+
+        def describe_subscription_filters(logGroupName):
+            if logGroupName not in throttled_once and logGroupName.endswith("-3"):
+                throttled_once.add(logGroupName)
+                raise ThrottlingError()
+            return {"subscriptionFilters": []}
+
+        self.logs.describe_subscription_filters.side_effect = describe_subscription_filters
+
+        with patch.object(self.module.logs_api, "base_delay", 0), patch.object(
+            self.module, "add_subscription", return_value=self.cfnresponse.SUCCESS
+        ):
+            summary = self.scan()
+
+        self.assertEqual(21, summary["subscribed"])
+        self.assertEqual(1, summary["throttled"])
+        self.assertEqual(0, summary["failed"])
+        self.assertEqual(1, summary["api"]["logs"]["retries"])
+
+    def test_throttled_subscription_writes_lower_the_concurrency(self):
+        self.logs.describe_subscription_filters.return_value = {"subscriptionFilters": []}
+
+        def put_subscription_filter(**kwargs):
+            if kwargs["logGroupName"] == "/aws/lambda/function-3":
+                raise ThrottlingError()
+            return {}
+
+        self.module.cloudwatch_logs.put_subscription_filter.side_effect = put_subscription_filter
+        release = self.module.AdaptiveConcurrencyLimiter.release
+        throttled = []
+
+        def record_release(limiter, **kwargs):
+            throttled.append(kwargs.get("throttled", False))
+            release(limiter, **kwargs)
+
+        with patch.object(self.module.logs_api, "base_delay", 0), patch.object(
+            self.module.AdaptiveConcurrencyLimiter, "release", autospec=True, side_effect=record_release
+        ):
+            summary = self.scan()
+
+        self.assertEqual((20, 1), (summary["subscribed"], summary["failed"]))
+        self.assertEqual(1, throttled.count(True))
+
+class AwsApiSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.module, _ = load_lambda_module()
+        self.scheduler = self.module.AwsApiScheduler("logs", 0, 3, base_delay=0)
+
+    def test_throttled_calls_are_retried_and_counted(self):
+        operation = MagicMock(side_effect=[ThrottlingError(), ThrottlingError(), {"ok": True}])
+
+        self.assertEqual({"ok": True}, self.scheduler.call(operation, logGroupName="/aws/lambda/a"))
+
+        operation.assert_called_with(logGroupName="/aws/lambda/a")
+        self.assertEqual({"calls": 3, "throttles": 2, "retries": 2}, {
+            key: value for key, value in self.scheduler.stats().items() if key != "rate"
+        })
+
+    def test_calls_give_up_after_max_attempts(self):
+        operation = MagicMock(side_effect=ThrottlingError())
+
+        with self.assertRaises(ThrottlingError):
+            self.scheduler.call(operation)
+
+        self.assertEqual(3, operation.call_count)
+
+    def test_client_errors_are_not_retried(self):
+        error = Exception("ResourceNotFoundException")
+        error.response = {"Error": {"Code": "ResourceNotFoundException"}, "ResponseMetadata": {"HTTPStatusCode": 400}}
+        operation = MagicMock(side_effect=error)
+
+        with self.assertRaises(Exception):
+            self.scheduler.call(operation)
+
+        self.assertEqual(1, operation.call_count)
+
+    def test_each_operation_has_its_own_bucket(self):
+        scheduler = self.module.AwsApiScheduler("logs", 10, 1, base_delay=0)
+        describe = MagicMock(__name__="describe_subscription_filters", side_effect=ThrottlingError())
+        put = MagicMock(__name__="put_subscription_filter", return_value={})
+
+        with self.assertRaises(ThrottlingError):
+            scheduler.call(describe)
+        scheduler.call(put)
+
+        self.assertEqual(
+            {"describe_subscription_filters": 5, "put_subscription_filter": 10}, scheduler.stats()["rate"]
+        )
+
+    def test_token_bucket_rate_halves_on_throttle_and_recovers(self):
+        bucket = self.module.TokenBucket(10)
+
+        bucket.on_throttle()
+        bucket.on_throttle()
+        self.assertEqual(2.5, bucket.rate)
+
+        for _ in range(100):
+            bucket.on_success()
+        self.assertEqual(10, bucket.rate)
+
+    def test_token_bucket_waits_for_tokens(self):
+        bucket = self.module.TokenBucket(2)
+
+        with patch.object(self.module.time, "sleep", side_effect=lambda seconds: self.fail("unexpected wait")):
+            bucket.acquire()
+            bucket.acquire()
+        with patch.object(self.module.time, "sleep") as sleep:
+            sleep.side_effect = lambda seconds: setattr(bucket, "_tokens", 1)
+            bucket.acquire()
+
+        self.assertGreater(sleep.call_args[0][0], 0)
+
+class FakeAwsServiceScanTests(unittest.TestCase):
+    def test_scan_subscribes_every_matching_log_group_once_despite_throttling(self):
+        module, _ = load_lambda_module()
+        module.logs_api.base_delay = 0
+        module.lambda_api.base_delay = 0
+        service = FakeAwsService(log_group_count=600, throttle_rate=0.05, subscribed_ratio=0.1)
+        destination_arn = "arn:aws:lambda:us-east-1:123456789012:function:destination"
+        context = SimpleNamespace(
+            invoked_function_arn="arn:aws:lambda:us-east-1:123456789012:function:lambda-manager",
+            function_name="lambda-manager",
+        )
+
+        with patch.object(module, "cloudwatch_logs", service.logs), patch.object(
+            module, "lambda_client", service.lambda_client
+        ), patch.dict(os.environ, {"SCAN_CONCURRENCY": "4"}, clear=False):
+            summary = module.list_log_groups_and_subscriptions(
+                service.logs, ["/aws/lambda/.*"], "", destination_arn, "Coralogix_Filter_test", context, [""], "false"
+            )
+
+        matching = [name for name in service.log_group_names if name.startswith("/aws/lambda/")]
+        self.assertEqual((200, 200, 0), (summary["matched"], summary["subscribed"], summary["failed"]))
+        self.assertGreater(summary["throttled"], 0)
+        for name in matching:
+            destinations = [subscription["destinationArn"] for subscription in service.subscriptions[name]]
+            self.assertEqual(1, destinations.count(destination_arn), name)
+        self.assertEqual(200, len(service.policy_statements))
+
+class LambdaManagerResumableScanTests(unittest.TestCase):
+    def setUp(self):
+        self.module, self.cfnresponse = load_lambda_module()
+        self.destination_arn = "arn:aws:firehose:us-east-1:123456789012:deliverystream/destination"
+        self.log_group_names = [f"/aws/lambda/function-{i:02d}" for i in range(30)]
+        self.logs = MagicMock(name="resumable_logs_client")
+        self.logs.describe_log_groups.side_effect = self.describe_log_groups
+        self.logs.describe_subscription_filters.return_value = {"subscriptionFilters": []}
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.store = self.module.FileScanCheckpointStore(os.path.join(self.temp_dir.name, "checkpoint.json"))
+
+    def describe_log_groups(self, nextToken=None, **kwargs):
+        start = int(nextToken or 0)
+        response = {"logGroups": [{"logGroupName": name} for name in self.log_group_names[start:start + 10]]}
+        if start + 10 < len(self.log_group_names):
+            response["nextToken"] = str(start + 10)
+        return response
+
+    def context(self, remaining_millis):
+        return SimpleNamespace(
+            invoked_function_arn="arn:aws:lambda:us-east-1:123456789012:function:lambda-manager",
+            function_name="lambda-manager",
+            aws_request_id="request-id",
+            get_remaining_time_in_millis=MagicMock(side_effect=remaining_millis),
+        )
+
+    def scan(self, context, add_subscription):
+        with patch.dict(os.environ, {"SCAN_CONCURRENCY": "1"}, clear=False), patch.object(
+            self.module, "add_subscription", add_subscription
+        ):
+            return self.module.list_log_groups_and_subscriptions(
+                self.logs, ["/aws/lambda/.*"], "", self.destination_arn, "Coralogix_Filter_test",
+                context, [""], "false", checkpoint_store=self.store,
+            )
+
+    def test_scan_stops_before_timeout_and_resumes_without_repeating_work(self):
+        add_subscription = MagicMock(return_value=self.cfnresponse.SUCCESS)
+        # 90s at the start reserves 30s; the time runs out while the second page is processed
+        first = self.scan(self.context([90000] + [60000] * 14 + [10000] * 100), add_subscription)
+
+        self.assertFalse(first["completed"])
+        checkpoint = self.store.load()
+        self.assertEqual("10", checkpoint["nextToken"])
+        self.assertTrue(checkpoint["done"])
+        self.assertEqual(first["subscribed"], add_subscription.call_count)
+
+        second = self.scan(self.context([900000] * 1000), add_subscription)
+
+        self.assertTrue(second["completed"])
+        self.assertEqual(30, second["subscribed"])
+        self.assertEqual(30, second["scanned"])
+        subscribed = [call.args[2] for call in add_subscription.call_args_list]
+        self.assertEqual(sorted(self.log_group_names), sorted(subscribed))
+
+    def test_checkpoint_includes_the_log_groups_finished_last(self):
+        add_subscription = MagicMock(return_value=self.cfnresponse.SUCCESS)
+        release = self.module.AdaptiveConcurrencyLimiter.release
+
+        def slow_release(limiter, **kwargs):
+            # a worker that is descheduled right after releasing its slot
+            release(limiter, **kwargs)
+            time.sleep(0.05)
+
+        with patch.object(self.module.AdaptiveConcurrencyLimiter, "release", autospec=True, side_effect=slow_release):
+            self.scan(self.context([90000] + [60000] * 14 + [10000] * 100), add_subscription)
+
+        checkpoint = self.store.load()
+        self.assertEqual(add_subscription.call_count, checkpoint["summary"]["subscribed"])
+        self.assertEqual(
+            sorted(call.args[2] for call in add_subscription.call_args_list[10:]), checkpoint["done"]
+        )
+
+    def test_completed_scan_clears_the_checkpoint_and_disables_scanning(self):
+        context = self.context([900000] * 1000)
+
+        with patch.object(self.module, "update_scan_old_log_groups_status") as update_status, patch.object(
+            self.module, "add_subscription", return_value=self.cfnresponse.SUCCESS
+        ):
+            summary = self.module.scan_old_log_groups_until_done(
+                self.logs, ["/aws/lambda/.*"], "", self.destination_arn, "Coralogix_Filter_test",
+                context, [""], "false", self.store,
+            )
+
+        self.assertTrue(summary["completed"])
+        self.assertIsNone(self.store.load())
+        update_status.assert_called_once_with(context, self.module.lambda_client)
+        self.module.lambda_client.invoke.assert_not_called()
+
+    def test_paused_scan_invokes_a_continuation(self):
+        context = self.context([90000] + [10000] * 1000)
+
+        with patch.object(self.module, "update_scan_old_log_groups_status") as update_status, patch.object(
+            self.module, "add_subscription", return_value=self.cfnresponse.SUCCESS
+        ):
+            summary = self.module.scan_old_log_groups_until_done(
+                self.logs, ["/aws/lambda/.*"], "", self.destination_arn, "Coralogix_Filter_test",
+                context, [""], "false", self.store,
+            )
+
+        self.assertFalse(summary["completed"])
+        update_status.assert_not_called()
+        self.module.lambda_client.invoke.assert_called_once_with(
+            FunctionName="lambda-manager",
+            InvocationType="Event",
+            Payload='{"ScanContinuation": true}',
+        )
+
+    def invoke_continuation(self, scan_old_log_groups):
+        env = {
+            "REGEX_PATTERN": "/aws/lambda/.*",
+            "DESTINATION_TYPE": "firehose",
+            "DESTINATION_ARN": self.destination_arn,
+            "SCAN_OLD_LOGGROUPS": scan_old_log_groups,
+            "SCAN_CHECKPOINT_FILE": self.store.path,
+        }
+        with patch.dict(os.environ, env, clear=False):
+            return self.module.lambda_handler({"ScanContinuation": True}, self.context([900000] * 1000))
+
+    def test_continuation_is_ignored_without_a_scan_in_progress(self):
+        with patch.object(self.module, "scan_old_log_groups_until_done") as scan:
+            self.invoke_continuation("true")
+            self.store.save({"nextToken": "10"})
+            self.invoke_continuation("false")
+
+        scan.assert_not_called()
+
+    def test_failed_continuation_is_raised_for_the_asynchronous_retries(self):
+        self.store.save({"nextToken": "10"})
+
+        with patch.object(self.module, "scan_old_log_groups_until_done", side_effect=ThrottlingError()):
+            with self.assertRaises(ThrottlingError):
+                self.invoke_continuation("true")
+
 if __name__ == "__main__":
     unittest.main()
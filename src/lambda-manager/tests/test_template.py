@@ -23,6 +23,23 @@ class LambdaManagerTemplateTests(unittest.TestCase):
             log_group_class_pattern,
         )
 
+    def test_batches_above_ten_events_get_a_batching_window(self):
+        template = TEMPLATE_PATH.read_text()
+        small_batch = re.search(r"  IsSmallEventBatch:\n    Fn::Or:\n((?:      - .*\n)+)", template)
+
+        self.assertIsNotNone(small_batch)
+        self.assertEqual(
+            [f"- Fn::Equals: [Ref: EventBatchSize, {size}]" for size in range(1, 11)],
+            [line.strip() for line in small_batch.group(1).splitlines()],
+        )
+        self.assertIn(
+            "MaximumBatchingWindowInSeconds: !If\n"
+            "        - IsEventBatchingWindowTooShort\n"
+            "        - 1\n"
+            "        - !Ref EventBatchingWindow\n",
+            template,
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -5,11 +5,14 @@ import urllib.request as urlrequest
 import urllib.error as urlerror
 import urllib.parse as urlparse
 import json, csv
+import math
 import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timezone, timedelta
+import gzip
+import http.client
+import threading
 import ciso8601
-from coralogix.handlers import CoralogixLogger
-from coralogix import manager
 import boto3
 
 # Create internal logger and logs logger.
@@ -20,6 +23,7 @@ external_logger.setLevel(logging.INFO)
 external_logger.propagate = False
 
 # Define environment variables
+LOG_URL = os.getenv('CORALOGIX_LOG_URL', 'https://ingress.coralogix.com/api/v1/logs')
 PRIVATE_KEY = os.getenv('CORALOGIX_PRIVATE_KEY')
 APP_NAME = os.getenv('CORALOGIX_APPLICATION_NAME')
 SUB_SYSTEM = os.getenv('CORALOGIX_SUBSYSTEM_NAME')
@@ -27,15 +31,62 @@ SANDBOX_ENV = os.getenv('SF_SANDBOX_ENV', 'False')
 HOST = os.getenv('SF_HOST')
 LOGS_TO_STDOUT = os.getenv('LOGS_TO_STDOUT', 'True')
 EVENT_TYPE = os.getenv('SF_EVENT_TYPE', '')
+# comma-separated list of event types, each one is pulled with its own checkpoint.
+# an empty list pulls all the event types together as one stream
+EVENT_TYPES = [event_type.strip() for event_type in EVENT_TYPE.split(',') if event_type.strip()] or ['']
+# Daily or Hourly event log files. hourly log files of an hour are published again with a higher
+# Sequence when more events arrive, so their progress is tracked by CreatedDate instead of LogDate
+LOG_INTERVAL = os.getenv('SF_LOG_INTERVAL', 'Daily')
+CHECKPOINT_FIELD = 'CreatedDate' if LOG_INTERVAL == 'Hourly' else 'LogDate'
 CLIENT_ID = os.getenv('SF_CLIENT_ID')
 CLIENT_SECRET = os.getenv('SF_CLIENT_SECRET')
 USERNAME = os.getenv('SF_USERNAME')
 PASSWORD = os.getenv('SF_PASSWORD')
 DYNAMODB_TABLE = os.getenv('DYNAMODB_TABLE')
+DOWNLOAD_CONCURRENCY = int(os.getenv('SF_DOWNLOAD_CONCURRENCY', '4'))
+# comma-separated columns of the log file rows to send, empty to send all of them
+FIELDS = [field.strip() for field in os.getenv('SF_FIELDS', '').split(',') if field.strip()]
+# comma-separated FIELD=value and FIELD!=value predicates, the rows matching any of them are not sent
+ROW_FILTER = os.getenv('SF_ROW_FILTER', '')
+# send the NUMERIC_FIELDS columns as numbers and use TIMESTAMP_DERIVED as the log timestamp
+TYPED_FIELDS = os.getenv('SF_TYPED_FIELDS', 'False')
+# stop downloading new log files when less than this is left before the lambda timeout
+EARLY_END_MILLIS = 30000
+# stop reading the log files being downloaded when less than this is left before the lambda timeout,
+# the rest of each file is downloaded by the next invocation
+DOWNLOAD_END_MILLIS = 15000
+# uncompressed size of the log entries sent to coralogix in one request
+MAX_BATCH_BYTES = int(os.getenv('CORALOGIX_MAX_BATCH_BYTES', str(1024 * 1024)))
+SEND_RETRIES = 3
+INFO_SEVERITY = 3
+# used when the token response does not say how long the token is valid
+TOKEN_TTL_SECONDS = int(os.getenv('SF_TOKEN_TTL', '3600'))
+USER_AGENT = 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:33.0) Gecko/20100101 Firefox/33.0'
 TRUE_VALUES = ['True','true']
+NUMERIC_FIELDS = frozenset(['AVERAGE_ROW_SIZE', 'CALLOUT_TIME', 'CPU_TIME', 'DB_BLOCKS', 'DB_CPU_TIME', 'DB_TOTAL_TIME', 'DURATION', 'EFFECTIVE_PAGE_TIME', 'EXEC_TIME', 'MEDIA_TYPE_SIZE',
+ 'NUMBER_BUCKETS', 'NUMBER_COLUMNS', 'NUMBER_EXCEPTION_FILTERS', 'NUMBER_FIELDS', 'NUMBER_OF_ERRORS', 'NUMBER_OF_INTERVIEWS', 'NUMBER_SOQL_QUERIES', 'PAGE_START_TIME', 'REQUEST_SIZE',
+  'RESPONSE_SIZE', 'ROWS', 'ROWS_PROCESSED', 'RUN_TIME', 'SIZE_BYTES', 'STATUS_CODE', 'TIME', 'TOTAL_TIME'])
+ALLOWED_LOG_INTERVAL = ['Daily', 'Hourly']
 ALLOWED_EVENT_TYPE = ['API', 'ApexCallout', 'ApexExecution', 'AsyncReportRun', 'ApexRestApi', 'ApexTrigger', 'ApiTotalUsage', 'AuraRequest', 'ApexUnexpectedException', 'BulkApi', 'BulkApi2', 'ContentDistribution', 'ContentDocumentLink', 'ChangeSetOperation', 'ContentTransfer',
  'CorsViolation', 'Dashboard', 'DocumentAttachmentDownloads', 'ExternalCustomApexCallout', 'ExternalODataCallout', 'FlowExecution', 'KnowledgeArticleView', 'Login', 'LoginAs', 'Logout', 'LightningError', 'LightningInteraction', 'LightningPerformance', 'LightningPageView',
   'MetadataApiOperation', 'NamedCredential', 'OneCommerceUsage', 'PackageInstall', 'QueuedExecution', 'PlatformEncryption', 'Report', 'RestApi', 'Sites', 'SearchClick', 'Search', 'TimeBasedWorkflow', 'URI', 'VisualforceRequest', 'WaveChange', 'WaveInteraction', 'WavePerformance']
+
+def parse_row_filter(row_filter):
+    # returns the (field, operator, value) predicates of the row filter, None if one is not valid
+    predicates = []
+    for predicate in row_filter.split(','):
+        if predicate.strip() == '':
+            continue
+        operator = '!=' if '!=' in predicate else '='
+        field, _, value = predicate.partition(operator)
+        if field.strip() == '' or operator not in predicate:
+            return None
+        predicates.append((field.strip(), operator, value.strip()))
+    return predicates
+
+# the row filter is parsed once per container, lambda_handler rejects it when it is not valid
+row_predicates = parse_row_filter(ROW_FILTER)
+
 def lambda_handler(event, context):
     internal_logger.info('Event-log puller lambda - init')
     # Coralogix variables check
@@ -58,10 +109,7 @@ def lambda_handler(event, context):
     # print to stdout/cloudwatch external logger's logs
     if LOGS_TO_STDOUT in TRUE_VALUES:
         external_logger.propagate = True
-    # Coralogix Logger init
-    coralogix_external_handler = CoralogixLogger(PRIVATE_KEY, APP_NAME, SUB_SYSTEM)
-    # Add coralogix logger as a handler to the standard Python logger.
-    external_logger.addHandler(coralogix_external_handler)
+    shipper = get_shipper()
     # Environment variables check
     if HOST is None or HOST == '':
         internal_logger.error('Event-log puller lambda Failure - salesforce host not found')
@@ -87,7 +135,7 @@ def lambda_handler(event, context):
             'message': 'Event-log puller lambda Failure - Event-log username and password not found',
             }),
         }
-    if EVENT_TYPE is None or EVENT_TYPE != '' and EVENT_TYPE not in ALLOWED_EVENT_TYPE :
+    if any(event_type != '' and event_type not in ALLOWED_EVENT_TYPE for event_type in EVENT_TYPES):
         internal_logger.error('Event-log puller lambda Failure - event type not found')
         return {
             'statusCode': 400,
@@ -95,6 +143,22 @@ def lambda_handler(event, context):
             'message': 'Event-log puller lambda Failure - event tpye not found',
             }),
         } 
+    if LOG_INTERVAL not in ALLOWED_LOG_INTERVAL:
+        internal_logger.error('Event-log puller lambda Failure - log interval not found')
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+            'message': 'Event-log puller lambda Failure - log interval not found',
+            }),
+        }
+    if row_predicates is None:
+        internal_logger.error('Event-log puller lambda Failure - row filter is not valid, expected FIELD=value or FIELD!=value predicates')
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+            'message': 'Event-log puller lambda Failure - row filter is not valid, expected FIELD=value or FIELD!=value predicates',
+            }),
+        }
     if DYNAMODB_TABLE is None or DYNAMODB_TABLE == '':
         internal_logger.error('Event-log puller lambda Failure - dynamoDB not found')
         return {
@@ -111,79 +175,46 @@ def lambda_handler(event, context):
     # dynamodb init
     dynamodb = boto3.resource('dynamodb')
     db_table = dynamodb.Table(DYNAMODB_TABLE)
-    # get all records
-    db_response = db_table.scan()
-    # get last_update value
-    if 'Items' in db_response and len(db_response['Items']) > 0:
-        last_update = [x for x in db_response['Items'] if x['id'] == '0'][0]['lastUpdated']
-    else:
-        # now - 2 days because it can take 24H+ for event-log files to be generated on Salesforce side
-        last_update = (datetime.now(timezone.utc).date() - timedelta(days=2)).isoformat() + "T00:00:00.000000z"
-        db_table.put_item(Item={
-                    'id': '0',
-                    'lastUpdated': last_update
-        })
+    # get all records, the checkpoint ids hold the last_update of each event type and the
+    # other ids are the records already sent with the checkpoint date of their event type
+    state = load_state(db_table)
     # build SF domain
     if SANDBOX_ENV in TRUE_VALUES:
         domain = '%s.sandbox.my.salesforce.com' % HOST
     else:
         domain = '%s.my.salesforce.com' % HOST
-    records = get_records_list(access_token, domain, last_update)
-    if records == None:
+    records_by_type = {}
+    for event_type in EVENT_TYPES:
+        last_update = get_last_update(db_table, state, event_type)
+        records = get_records_list(access_token, domain, last_update, event_type)
+        if records is None:
+            internal_logger.error('Event-log puller lambda Failure could not retrieve records - Endpoint: %s , event type: %s' % (HOST, event_type or 'all'))
+            continue
+        records_by_type[event_type] = records
+    if LOG_INTERVAL == 'Daily' and '' not in EVENT_TYPES and '0' in state:
+        # every event type has its own checkpoint now, the single checkpoint is not needed anymore
+        db_table.delete_item(Key={'id': '0'})
+        del state['0']
+    if len(records_by_type) == 0:
         return {
         'statusCode': 400,
         'body': json.dumps({
         'message': 'Event-log puller lambda Failure could not retrieve records - Endpoint: %s' % HOST,
         }),
         }
-    # setup lambda timout flag
-    early_end = False
-    if len(records) > 0:
-        # setup early_end record index
-        early_last_record = len(records) - 1
-        items_to_add = []
-        # iterate sf_records list
-        for i, record in enumerate(records):
-            db_record = [x for x in db_response['Items'] if x['id'] == record['Id']]
-            if len(db_record) == 0 :
-                # record not found in db, send logs to coralogix and save it if no errors
-                if record_logic(access_token, domain, record) is not None:
-                    items_to_add.append(record)
-            if context.get_remaining_time_in_millis() < 30000:
-                early_last_record = i
-                early_end = True
-                break
-        last_record = records[early_last_record]
-        new_last_update = ciso8601.parse_datetime(last_record['LogDate'])
-        # generate an item to update the 'lastUpdate' of id 0
-        items_to_add.append({'Id': '0','LogDate': new_last_update.isoformat().replace('+00:00','z')})
-        with db_table.batch_writer() as batch:
-            for item in items_to_add:
-                # save to db only records that LogDate is equal to lastUpdate
-                if ciso8601.parse_datetime(item['LogDate']) == new_last_update:
-                    batch.put_item(Item={
-                        'id': item['Id'],
-                        'lastUpdated': item['LogDate'].replace('+0000','z')
-                    })
-        # check if any records needs to be deleted
-        items_to_delete = []
-        for record in db_response['Items']:
-            if record['id'] != '0':
-                if ciso8601.parse_datetime(record['lastUpdated']) < new_last_update:
-                    items_to_delete.append(record['id'])
-        with db_table.batch_writer() as batch:
-            for item in items_to_delete:
-                batch.delete_item(Key={
-                    "id": item
-                })
-    CoralogixLogger.flush_messages()
-    # exit only when the coralogix logger buffer is empty
-    # code implementation until it is implemented 
-    # in the coralogixLogger class
-    while True:   
-        if manager.LoggerManager._buffer_size == 0:
-            break
-        time.sleep(1)
+    # download and send the log files of the records that are not in the db yet, taking the
+    # event types in turns. early_end is set if the lambda had to stop before processing all of them
+    results = process_records(access_token, domain, records_by_type, state, context, shipper)
+    early_end = len(records_by_type) < len(EVENT_TYPES)
+    for event_type, (items_to_add, last_record, type_early_end, in_progress) in results.items():
+        early_end = early_end or type_early_end
+        # update the checkpoint only if at least one record was processed
+        if last_record is not None:
+            update_checkpoint(db_table, state, event_type, items_to_add, last_record, in_progress)
+            if LOG_INTERVAL == 'Hourly':
+                internal_logger.info('Event-log puller lambda - event type: %s, processed the hourly log files up to hour %s sequence %s' % (event_type or 'all', last_record['LogDate'], last_record.get('Sequence')))
+    # every batch of a record is acknowledged by coralogix before the record is saved,
+    # so there is nothing left to flush here
     if early_end: # if the lambda had to stop before finishing due to time-out
         internal_logger.info("Event-log puller lambda - Not enough time to send all logs, waiting for next invocation")
         return {
@@ -201,63 +232,513 @@ def lambda_handler(event, context):
         }),
         }
 
-def get_records_list(access_token, domain, last_update):
-    endpoint = 'https://' + domain + "/services/data/v55.0/query?q=SELECT+Id+,+EventType+,+LogFile+,+LogDate+,+LogFileLength+FROM+EventLogFile+WHERE+LogDate+>=+%s" % last_update
-    if EVENT_TYPE != '':
-        endpoint += "+AND+EventType+=+'%s'" % EVENT_TYPE
-    endpoint += "+ORDER+BY+LogDate+ASC"
-    request = urlrequest.Request(endpoint)
-    request.add_header('Authorization','Bearer %s' % access_token)
-    request.add_header('User-Agent', 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:33.0) Gecko/20100101 Firefox/33.0')
-    request.add_header('host', domain)
+def load_state(db_table):
+    # load every item of the table into a dict of id -> item,
+    # following the scan pages since a single scan call returns up to 1MB of items
+    state = {}
+    scan_kwargs = {}
+    while True:
+        db_response = db_table.scan(**scan_kwargs)
+        for item in db_response.get('Items', []):
+            state[item['id']] = item
+        if 'LastEvaluatedKey' not in db_response:
+            return state
+        scan_kwargs['ExclusiveStartKey'] = db_response['LastEvaluatedKey']
+
+def checkpoint_id(event_type):
+    # id 0 is the checkpoint of the all event types stream, as before event types could be listed.
+    # hourly log files have their own checkpoints since they are tracked by another field
+    checkpoint = '0'
+    if LOG_INTERVAL == 'Hourly':
+        checkpoint += '-Hourly'
+    if event_type != '':
+        checkpoint += '-%s' % event_type
+    return checkpoint
+
+def get_last_update(db_table, state, event_type):
+    if checkpoint_id(event_type) in state:
+        return state[checkpoint_id(event_type)]['lastUpdated']
+    if LOG_INTERVAL == 'Daily' and '0' in state:
+        # a deployment that pulled one event type (or all of them) with the single id 0 checkpoint
+        last_update = state['0']['lastUpdated']
+    elif LOG_INTERVAL == 'Hourly':
+        # the hourly log files created from the start of the previous hour
+        last_hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+        last_update = last_hour.strftime('%Y-%m-%dT%H:%M:%S.000000z')
+    else:
+        # now - 2 days because it can take 24H+ for event-log files to be generated on Salesforce side
+        last_update = (datetime.now(timezone.utc).date() - timedelta(days=2)).isoformat() + "T00:00:00.000000z"
+    item = {'id': checkpoint_id(event_type), 'lastUpdated': last_update}
+    db_table.put_item(Item=item)
+    state[item['id']] = item
+    return last_update
+
+def update_checkpoint(db_table, state, event_type, items_to_add, last_record, in_progress=()):
+    # in_progress are the records whose log file was partly sent, with the progress to resume from
+    new_last_update = ciso8601.parse_datetime(last_record[CHECKPOINT_FIELD])
+    checkpoint = {
+        'id': checkpoint_id(event_type),
+        'lastUpdated': new_last_update.isoformat().replace('+00:00','z')
+    }
+    state[checkpoint['id']] = checkpoint
+    with db_table.batch_writer() as batch:
+        # update the 'lastUpdate' of the event type checkpoint
+        batch.put_item(Item=checkpoint)
+        for item in items_to_add:
+            # save to db only records that LogDate (CreatedDate for hourly log files) is not before lastUpdate,
+            # the records after a partly sent log file are listed again by the next invocation
+            if ciso8601.parse_datetime(item[CHECKPOINT_FIELD]) >= new_last_update:
+                batch.put_item(Item={
+                    'id': item['Id'],
+                    'lastUpdated': item[CHECKPOINT_FIELD].replace('+0000','z'),
+                    'eventType': event_type
+                })
+        for item, progress in in_progress:
+            batch.put_item(Item={
+                'id': item['Id'],
+                'lastUpdated': item[CHECKPOINT_FIELD].replace('+0000','z'),
+                'eventType': event_type,
+                'offset': progress['offset'],
+                'rows': progress['rows'],
+                'fieldnames': progress['fieldnames']
+            })
+    # check if any records of the event type needs to be deleted. records saved before the
+    # event type was stored with them belong to every event type, they are only deleted once
+    # the checkpoint of every event type is past them
+    checkpoints = [state.get(checkpoint_id(configured_type)) for configured_type in EVENT_TYPES]
+    oldest_checkpoint = None
+    if all(checkpoints):
+        oldest_checkpoint = min(ciso8601.parse_datetime(item['lastUpdated']) for item in checkpoints)
+    items_to_delete = []
+    for record_id, item in state.items():
+        if record_id == '0' or record_id.startswith('0-'):
+            continue
+        last_updated = ciso8601.parse_datetime(item['lastUpdated'])
+        if 'eventType' in item:
+            if item['eventType'] == event_type and last_updated < new_last_update:
+                items_to_delete.append(record_id)
+        elif oldest_checkpoint is not None and last_updated < oldest_checkpoint:
+            items_to_delete.append(record_id)
+    with db_table.batch_writer() as batch:
+        for item in items_to_delete:
+            batch.delete_item(Key={
+                "id": item
+            })
+
+def process_records(access_token, domain, records_by_type, state, context, shipper):
+    # download up to DOWNLOAD_CONCURRENCY log files at once. the event types take turns, one
+    # record each, so a busy event type does not starve the others, and the records of each
+    # event type are submitted in checkpoint date order. no new record is submitted once the remaining
+    # time is below EARLY_END_MILLIS, and every submitted record is finished before returning,
+    # so the submitted records of an event type are always a prefix of its records and its
+    # checkpoint never skips an unprocessed record.
+    # a failure to list the next page of records ends the event type like a timeout, and
+    # the next invocation lists its records again from the checkpoint.
+    # a log file that is not fully read before the lambda has to stop is saved with its progress,
+    # and the checkpoint stays at its record so the next invocation resumes it.
+    # returns, for each event type, the records to save, the last processed record
+    # (None if there is none), the early end flag and the partly sent records with their progress
+    streams = {event_type: iter(records) for event_type, records in records_by_type.items()}
+    submitted = {event_type: [] for event_type in streams}
+    early_end = {event_type: False for event_type in streams}
+    active = list(streams)
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor:
+        pending = set()
+        while active:
+            for event_type in list(active):
+                if context.get_remaining_time_in_millis() < EARLY_END_MILLIS:
+                    for unfinished_type in active:
+                        early_end[unfinished_type] = True
+                    active = []
+                    break
+                try:
+                    record = next(streams[event_type])
+                except StopIteration:
+                    active.remove(event_type)
+                    continue
+                except SalesforceError as e:
+                    internal_logger.error('Event-log puller lambda Failure could not retrieve records - Endpoint: %s , event type: %s , error: %s' % (HOST, event_type or 'all', e))
+                    early_end[event_type] = True
+                    active.remove(event_type)
+                    continue
+                item = state.get(record['Id'])
+                if item is not None and 'offset' not in item:
+                    # record already sent in a previous invocation
+                    submitted[event_type].append((record, None))
+                    continue
+                future = executor.submit(record_logic, access_token, domain, record, shipper, context, item)
+                submitted[event_type].append((record, future))
+                pending.add(future)
+                if len(pending) >= DOWNLOAD_CONCURRENCY:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+    results = {}
+    for event_type, type_submitted in submitted.items():
+        items_to_add = []
+        in_progress = []
+        for record, future in type_submitted:
+            if future is None:
+                continue
+            try:
+                result = future.result()
+            except Exception as e:
+                internal_logger.error('Event-log puller lambda Failure could not process logfile - recordId: %s, error: %s' % (record['Id'], e))
+                result = None
+            if isinstance(result, dict):
+                # the log file was partly sent, the rest is sent by the next invocation
+                in_progress.append((record, result))
+            elif result is not None:
+                # record sent to coralogix, save it if no errors
+                items_to_add.append(record)
+        if in_progress:
+            last_record = in_progress[0][0]
+            early_end[event_type] = True
+        else:
+            last_record = type_submitted[-1][0] if type_submitted else None
+        results[event_type] = (items_to_add, last_record, early_end[event_type], in_progress)
+    return results
+
+def get_records_list(access_token, domain, last_update, event_type):
+    # returns a generator of the records, or None if the query failed. the generator follows
+    # nextRecordsUrl and fetches the next page of records while the current one is processed
+    if LOG_INTERVAL == 'Hourly':
+        path = "/services/data/v55.0/query?q=SELECT+Id+,+EventType+,+LogFile+,+LogDate+,+LogFileLength+,+Interval+,+Sequence+,+CreatedDate+FROM+EventLogFile+WHERE+Interval+=+'Hourly'+AND+CreatedDate+>=+%s" % last_update
+    else:
+        # orgs with hourly event log files enabled also have hourly files with a LogDate, they are not sent twice
+        path = "/services/data/v55.0/query?q=SELECT+Id+,+EventType+,+LogFile+,+LogDate+,+LogFileLength+FROM+EventLogFile+WHERE+Interval+=+'Daily'+AND+LogDate+>=+%s" % last_update
+    if event_type != '':
+        path += "+AND+EventType+=+'%s'" % event_type
+    path += "+ORDER+BY+%s+ASC" % CHECKPOINT_FIELD
+    page = get_records_page(access_token, domain, path)
+    if page is None:
+        return None
+    return iter_records(access_token, domain, page)
+
+def iter_records(access_token, domain, page):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            next_page = None
+            if not page['done'] and page['nextRecordsUrl']:
+                next_page = executor.submit(get_records_page, access_token, domain, page['nextRecordsUrl'])
+            yield from page['records']
+            if next_page is None:
+                return
+            page = next_page.result()
+            if page is None:
+                raise SalesforceError('could not retrieve the next page of records')
+
+def get_records_page(access_token, domain, path):
     try:
-        response = urlrequest.urlopen(request, timeout=30)
-    except urlerror.HTTPError as e:
+        connection, response = salesforce_get(domain, path, access_token)
+        res_body = response.read()
+    except SalesforceError as e:
         internal_logger.error('Event-log puller lambda Failure could not retrieve records - Endpoint: %s , error: %s' % (HOST, e))
         return None
-    except urlerror.URLError as e:
+    except (OSError, http.client.HTTPException) as e:
         internal_logger.error('Event-log puller lambda Failure URL could not retrieve records - Endpoint: %s , error: %s' % (HOST, e))
         return None
-    except TimeoutError as e:
-        internal_logger.error('Event-log puller lambda Failure could not retrieve records - Timeout error - Endpoint: %s , error: %s' % (HOST, e))
-        return None
-    res_body = response.read()
-    
+    get_connection_pool(domain).release(connection)
+
     try:
         JSON_object = json.loads(res_body.decode('utf-8'))
-        records = JSON_object['records']
-        return records
+        return {
+            'records': JSON_object['records'],
+            'done': JSON_object.get('done', True),
+            'nextRecordsUrl': JSON_object.get('nextRecordsUrl'),
+        }
     except (ValueError,KeyError) as e:
         internal_logger.error('Event-log puller lambda Failure - could not retrieve records, failed to get records from response - %s ' % e)
         return None
 
-def record_logic(access_token, domain, record):
-    endpoint = 'https://' + domain + record['LogFile']
-    request = urlrequest.Request(endpoint)
-    request.add_header('Authorization','Bearer %s' % access_token)
-    request.add_header('User-Agent', 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:33.0) Gecko/20100101 Firefox/33.0')
-    request.add_header('host', domain)
+def record_logic(access_token, domain, record, shipper, context=None, progress=None):
+    # returns 1 if the log file was sent, None if it failed, or the progress of a log file that was
+    # not fully read when the lambda had to stop: the byte offset of the next row, the number of
+    # rows sent and the csv header. progress is the one saved by a previous invocation, the
+    # download resumes from its offset with a Range request
+    offset = int(progress['offset']) if progress else 0
     try:
-        response = urlrequest.urlopen(request, timeout=30)
-    except urlerror.HTTPError as e:
+        connection, response = salesforce_get(domain, record['LogFile'], access_token,
+                                              headers={'Range': 'bytes=%d-' % offset} if offset else None)
+    except (SalesforceError, OSError, http.client.HTTPException) as e:
         internal_logger.error('Event-log puller lambda Failure could not retrieve logfile - recordId: %s,  Endpoint: %s , error: %s' % (record['Id'], domain, e))
         return None
-    except urlerror.URLError as e:
-        internal_logger.error('Event-log puller lambda Failure could not retrieve logfile - recordId: %s,  Endpoint: %s , error: %s' % (record['Id'], domain, e))
-        return None
-    except TimeoutError as e:
-        internal_logger.error('Event-log puller lambda Failure could not retrieve logfile - Timeout error - recordId: %s,  Endpoint: %s , error: %s' % (record['Id'], domain, e))
-    res_body = response.read()
+    pool = get_connection_pool(domain)
+    deadline = float('inf')
+    if context is not None:
+        deadline = time.monotonic() + (context.get_remaining_time_in_millis() - DOWNLOAD_END_MILLIS) / 1000
+    # decode and parse the csv rows while they are read from the socket, so only a few
+    # buffered chunks of the log file are held in memory whatever the file size is
     try:
-        csvReader = csv.DictReader(io.StringIO(res_body.decode('utf-8')))
-        for row in csvReader:
-            external_logger.info(json.dumps(row))
-        return 1
-    except:
+        lines = LineReader(io.BufferedReader(response))
+        if response.status == 206:
+            # the response starts at the offset, after the csv header
+            lines.offset = offset
+            csvReader = csv.DictReader(lines, fieldnames=list(progress['fieldnames']))
+            sent = {'offset': offset, 'rows': int(progress['rows']), 'done': False}
+        else:
+            # the whole file, skip the rows that were already sent if the range was ignored
+            csvReader = csv.DictReader(lines)
+            sent = {'offset': 0, 'rows': 0, 'done': False}
+            for _ in range(int(progress['rows']) if progress else 0):
+                if next(csvReader, None) is None:
+                    break
+                sent['rows'] += 1
+                sent['offset'] = lines.offset
+        shipper.send(row_texts(read_rows(csvReader, lines, deadline, sent)))
+    except (csv.Error, UnicodeDecodeError) as e:
+        pool.discard(connection)
         internal_logger.error('Event-log puller lambda Failure could not convert csv file to json - recordId: %s,  Endpoint: %s , error: %s' % (record['Id'], domain, e))
         return None
+    except (ShipperError, OSError, http.client.HTTPException) as e:
+        pool.discard(connection)
+        internal_logger.error('Event-log puller lambda Failure could not send logfile to coralogix - recordId: %s, error: %s' % (record['Id'], e))
+        return None
+    if not sent['done']:
+        pool.discard(connection)
+        internal_logger.info('Event-log puller lambda - not enough time to read the whole logfile, sent %d rows - recordId: %s' % (sent['rows'], record['Id']))
+        return {'offset': sent['offset'], 'rows': sent['rows'], 'fieldnames': csvReader.fieldnames}
+    # the whole log file was read, the connection can be used for the next request
+    pool.release(connection)
+    return 1
+
+class LineReader:
+    # iterates over the utf-8 lines of a log file and counts their bytes. a csv reader takes
+    # only the lines of the row it returns, so after each row offset is the position of the next one
+    def __init__(self, stream):
+        self.stream = stream
+        self.offset = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.stream.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode('utf-8')
+
+    def at_end(self):
+        return not self.stream.peek(1)
+
+def read_rows(csvReader, lines, deadline, sent):
+    # yields the rows of the log file until the deadline, keeping in sent the offset of the next row
+    # and the number of rows read. sent['done'] is set once the whole file was read
+    for row in csvReader:
+        sent['offset'] = lines.offset
+        sent['rows'] += 1
+        yield row
+        if time.monotonic() >= deadline and not lines.at_end():
+            return
+    sent['done'] = True
+
+class SalesforceError(Exception):
+    pass
+
+def salesforce_get(domain, path, access_token, headers=None):
+    # GET a salesforce api path over a pooled keep-alive connection. when the token was revoked
+    # or expired (401) the cached token is refreshed once and the request is sent again.
+    # the cached token is preferred to access_token, so once one request refreshed the token the
+    # other requests stop sending the rejected one.
+    # returns the connection and its 200 (206 for a Range request) response, the caller reads the
+    # response and then releases the connection to the pool, or discards it if it was not fully read
+    pool = get_connection_pool(domain)
+    for attempt in range(2):
+        access_token = token_cache['access_token'] or access_token
+        connection, response = pool.request('GET', path, headers={
+            'Authorization': 'Bearer %s' % access_token,
+            'User-Agent': USER_AGENT,
+            **(headers or {}),
+        })
+        if response.status in (200, 206):
+            return connection, response
+        response.read()
+        pool.release(connection)
+        if response.status == 401 and attempt == 0:
+            internal_logger.info('Event-log puller lambda - access token expired, getting a new one')
+            access_token = get_token(expired_token=access_token)
+            if isinstance(access_token, dict):
+                raise SalesforceError('could not refresh the access token')
+            continue
+        raise SalesforceError('HTTP Error %d: %s' % (response.status, response.reason))
+
+def to_number(value):
+    # the numeric columns are empty when they have no value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None if value == '' else value
+    return number if math.isfinite(number) else value
+
+def row_timestamp(row):
+    # the time of the event in milliseconds, None if the row has none
+    try:
+        return ciso8601.parse_datetime(row['TIMESTAMP_DERIVED']).timestamp() * 1000
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def row_texts(csvReader):
+    # drop the rows matching a predicate of the row filter, keep the FIELDS of the others and with
+    # TYPED_FIELDS convert their numeric columns. yields the json text of every row sent, or its
+    # timestamp and text when the log timestamp is taken from the row
+    typed = TYPED_FIELDS in TRUE_VALUES
+    for row in csvReader:
+        if row_predicates and any((row.get(field) == value) == (operator == '=') for field, operator, value in row_predicates):
+            continue
+        timestamp = row_timestamp(row) if typed else None
+        if FIELDS:
+            row = {field: row[field] for field in FIELDS if field in row}
+        if typed:
+            for field in row.keys() & NUMERIC_FIELDS:
+                row[field] = to_number(row[field])
+        text = json.dumps(row)
+        if LOGS_TO_STDOUT in TRUE_VALUES:
+            external_logger.info(text)
+        yield text if timestamp is None else (timestamp, text)
+
+class ShipperError(Exception):
+    pass
+
+class CoralogixShipper:
+    # sends log lines to the coralogix logs endpoint in gzip compressed batches of up to
+    # max_batch_bytes, over https connections that are kept alive and reused between batches,
+    # invocations and the download threads. each batch is sent once the previous one is acknowledged.
+    def __init__(self, url, private_key, app_name, subsystem, max_batch_bytes=MAX_BATCH_BYTES, retries=SEND_RETRIES):
+        parsed_url = urlparse.urlsplit(url)
+        self.path = parsed_url.path or '/'
+        self.pool = ConnectionPool(parsed_url.netloc)
+        self.max_batch_bytes = max_batch_bytes
+        self.retries = retries
+        # the start of every request body, the log entries are added to it already encoded
+        self.body_prefix = json.dumps({
+            'privateKey': private_key,
+            'applicationName': app_name,
+            'subsystemName': subsystem,
+        })[:-1] + ', "logEntries": ['
+
+    def send(self, texts):
+        # send the texts as log entries, returns the number of entries sent. a text can be a pair of
+        # its log timestamp in milliseconds and the text, the other texts are logged at the send time
+        entries = []
+        size = 0
+        sent = 0
+        for text in texts:
+            if isinstance(text, tuple):
+                timestamp, text = text
+            else:
+                timestamp = time.time() * 1000
+            entry = '{"timestamp": %d, "severity": %d, "text": %s}' % (timestamp, INFO_SEVERITY, json.dumps(text))
+            if entries and size + len(entry) > self.max_batch_bytes:
+                sent += self.post(entries)
+                entries = []
+                size = 0
+            entries.append(entry)
+            size += len(entry) + 1
+        if entries:
+            sent += self.post(entries)
+        return sent
+
+    def post(self, entries):
+        body = gzip.compress((self.body_prefix + ','.join(entries) + ']}').encode('utf-8'), compresslevel=6)
+        for attempt in range(self.retries + 1):
+            try:
+                connection, response = self.pool.request('POST', self.path, body=body, headers={
+                    'Content-Type': 'application/json',
+                    'Content-Encoding': 'gzip',
+                })
+                response.read()
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == self.retries:
+                    raise
+                internal_logger.warning('Event-log puller lambda - failed to send logs to coralogix, retrying, error: %s' % e)
+            else:
+                self.pool.release(connection)
+                if response.status < 300:
+                    return len(entries)
+                if response.status != 429 and response.status < 500:
+                    raise ShipperError('coralogix rejected %d log entries with status %d' % (len(entries), response.status))
+                if attempt == self.retries:
+                    raise ShipperError('coralogix failed %d log entries with status %d' % (len(entries), response.status))
+                internal_logger.warning('Event-log puller lambda - coralogix returned status %d, retrying' % response.status)
+            time.sleep(0.5 * 2 ** attempt)
+
+class ConnectionPool:
+    # keep-alive https connections to one host. the connections are shared by the download
+    # threads and kept between warm invocations, so the TLS handshake is done once per connection
+    def __init__(self, host, timeout=30):
+        self.host = host
+        self.timeout = timeout
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def request(self, method, path, body=None, headers=None):
+        # returns the connection and its response, a kept-alive connection that the server
+        # closed in the meantime is replaced by a new one
+        while True:
+            with self.lock:
+                connection = self.connections.pop() if self.connections else None
+            reused = connection is not None
+            if not reused:
+                connection = http.client.HTTPSConnection(self.host, timeout=self.timeout)
+            try:
+                connection.request(method, path, body=body, headers=headers or {})
+                return connection, connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if not reused:
+                    raise
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                raise
+
+    def release(self, connection):
+        with self.lock:
+            self.connections.append(connection)
 
-def get_token():
+    def discard(self, connection):
+        connection.close()
+
+connection_pools = {}
+connection_pools_lock = threading.Lock()
+
+def get_connection_pool(host):
+    with connection_pools_lock:
+        if host not in connection_pools:
+            connection_pools[host] = ConnectionPool(host)
+        return connection_pools[host]
+
+coralogix_shipper = None
+
+def get_shipper():
+    # the shipper is kept between invocations to reuse its connections
+    global coralogix_shipper
+    if coralogix_shipper is None:
+        coralogix_shipper = CoralogixShipper(LOG_URL, PRIVATE_KEY, APP_NAME, SUB_SYSTEM)
+    return coralogix_shipper
+
+token_cache = {'access_token': None, 'expires_at': 0}
+token_lock = threading.Lock()
+
+def get_token(expired_token=None):
+    # return the cached access token while it is valid, warm invocations skip the oauth request.
+    # expired_token is a token that salesforce rejected, it is replaced even if it looks valid
+    with token_lock:
+        access_token = token_cache['access_token']
+        if access_token is not None and access_token != expired_token and time.time() < token_cache['expires_at']:
+            return access_token
+        token_response = request_token()
+        if 'statusCode' in token_response:
+            return token_response
+        token_cache['access_token'] = token_response['access_token']
+        # salesforce reports issued_at in milliseconds and does not always return expires_in
+        issued_at = int(token_response['issued_at'] or time.time() * 1000) / 1000
+        token_cache['expires_at'] = issued_at + int(token_response['expires_in'] or TOKEN_TTL_SECONDS) - 60
+        return token_cache['access_token']
+
+def request_token():
     form_data = {
         'username': USERNAME,
         'password': PASSWORD,
@@ -274,7 +755,7 @@ def get_token():
     request = urlrequest.Request(auth_host,req_data)
     # adding charset parameter to the Content-Type header.
     request.add_header('Content-Type', 'application/x-www-form-urlencoded;charset=utf-8')
-    request.add_header('User-Agent', 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:33.0) Gecko/20100101 Firefox/33.0')
+    request.add_header('User-Agent', USER_AGENT)
     try:
         response = urlrequest.urlopen(request, timeout=15)
     except urlerror.HTTPError as e:
@@ -304,8 +785,11 @@ def get_token():
     res_body = response.read()
     try:
         JSON_object = json.loads(res_body.decode('utf-8'))
-        access_token = JSON_object['access_token']
-        return access_token
+        return {
+            'access_token': JSON_object['access_token'],
+            'issued_at': JSON_object.get('issued_at'),
+            'expires_in': JSON_object.get('expires_in'),
+        }
     except (ValueError,KeyError) as e:
         internal_logger.error('Event-log puller lambda Failure - Error while getting token, failed to get access_token from response - %s . most likely credentials are incorrect' % e)
         return {
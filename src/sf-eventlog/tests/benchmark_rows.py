@@ -0,0 +1,74 @@
+"""
+Benchmark of the row stage of the event-log puller, from the csv bytes to the json texts sent.
+
+A synthetic API log file is parsed with csv.DictReader and every row goes through row_texts
+with all the columns, with a projection of a few columns, and with a row filter, the projection
+and the typed conversion together. The rows per second and the json bytes sent per row are reported.
+
+Usage: python tests/benchmark_rows.py [rows]
+"""
+import csv
+import io
+import sys
+import time
+from unittest.mock import patch
+
+from test_app import load_app_module
+
+
+COLUMNS = [
+    "EVENT_TYPE", "TIMESTAMP", "REQUEST_ID", "ORGANIZATION_ID", "USER_ID", "RUN_TIME", "CPU_TIME", "URI",
+    "SESSION_KEY", "LOGIN_KEY", "USER_TYPE", "REQUEST_STATUS", "DB_TOTAL_TIME", "API_TYPE", "API_VERSION",
+    "CLIENT_NAME", "METHOD_NAME", "ENTITY_NAME", "ROWS_PROCESSED", "REQUEST_SIZE", "RESPONSE_SIZE",
+    "DB_BLOCKS", "DB_CPU_TIME", "CLIENT_IP", "URI_ID_DERIVED", "USER_ID_DERIVED", "TIMESTAMP_DERIVED",
+]
+FIELDS = ["EVENT_TYPE", "USER_ID", "URI", "CPU_TIME", "RUN_TIME", "DB_TOTAL_TIME", "ROWS_PROCESSED", "TIMESTAMP_DERIVED"]
+ROW_FILTER = "USER_TYPE=Automated"
+
+
+def build_log_file(count):
+    output = io.StringIO()
+    writer = csv.writer(output, quoting=csv.QUOTE_ALL, lineterminator="\n")
+    writer.writerow(COLUMNS)
+    for i in range(count):
+        writer.writerow([
+            "API", f"20261016{i % 24:02d}0000.{i % 1000:03d}", f"4-request-{i:08d}", "00D000000000001",
+            f"005000000000{i % 100:03d}", str(i % 500), str(i % 200), f"/services/data/v55.0/query/{i}",
+            f"session-{i % 50}", f"login-{i % 50}", "Automated" if i % 4 == 0 else "Standard", "S",
+            str(i % 300), "R", "55.0", "client", "query", "Account", str(i % 1000), str(100 + i % 900),
+            str(1000 + i % 9000), str(i % 50), str(i % 100), "10.0.0.1", f"001000000000{i % 100:03d}",
+            f"005000000000{i % 100:03d}AAA", f"2026-10-16T{i % 24:02d}:00:00.{i % 1000:03d}Z",
+        ])
+    return output.getvalue()
+
+
+def measure(module, name, log_file, count, **config):
+    with patch.multiple(module, LOGS_TO_STDOUT="False", **config):
+        start = time.perf_counter()
+        sent = 0
+        size = 0
+        for text in module.row_texts(csv.DictReader(io.StringIO(log_file, newline=""))):
+            sent += 1
+            size += len(text if isinstance(text, str) else text[1])
+        elapsed = time.perf_counter() - start
+    print(f"{name:<28}{count / elapsed:>12,.0f}{sent:>10}{size / max(sent, 1):>14.1f}{size / 2 ** 20:>12.1f}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    module = load_app_module()
+    log_file = build_log_file(count)
+
+    print(f"{count} rows, {len(COLUMNS)} columns, {len(log_file) / 2 ** 20:.1f} MiB of csv")
+    print(f"{'stage':<28}{'rows/s':>12}{'sent':>10}{'bytes/row':>14}{'sent (MiB)':>12}")
+    measure(module, "all columns", log_file, count)
+    measure(module, "projection", log_file, count, FIELDS=FIELDS)
+    measure(module, "typed", log_file, count, TYPED_FIELDS="True")
+    measure(
+        module, "filter + projection + typed", log_file, count,
+        FIELDS=FIELDS, row_predicates=module.parse_row_filter(ROW_FILTER), TYPED_FIELDS="True",
+    )
+
+
+if __name__ == "__main__":
+    main()
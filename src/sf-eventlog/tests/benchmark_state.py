@@ -0,0 +1,70 @@
+"""
+Microbenchmark for the dedup state lookups of the event-log puller.
+
+Compares the previous approach (one scan call, then a linear search of the scanned items
+for every Salesforce record) with load_state, which follows every scan page into a dict,
+on 10k tracked records. The fake table returns 1000 items per scan page.
+
+Usage: python tests/benchmark_state.py [tracked records] [salesforce records]
+"""
+import sys
+import time
+from types import SimpleNamespace
+
+from test_app import build_records, load_app_module
+
+
+PAGE_SIZE = 1000
+
+
+class FakeTable:
+    def __init__(self, items):
+        self.items = items
+        self.scans = 0
+
+    def scan(self, ExclusiveStartKey=None):
+        self.scans += 1
+        start = int(ExclusiveStartKey["id"].split("-")[-1]) + 1 if ExclusiveStartKey else 0
+        response = {"Items": self.items[start:start + PAGE_SIZE]}
+        if start + PAGE_SIZE < len(self.items):
+            response["LastEvaluatedKey"] = {"id": self.items[start + PAGE_SIZE - 1]["id"]}
+        return response
+
+
+def linear_search(table, records):
+    db_response = table.scan()
+    return sum(
+        1 for record in records
+        if len([x for x in db_response["Items"] if x["id"] == record["Id"]]) > 0
+    )
+
+
+def main():
+    tracked_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    record_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    module = load_app_module()
+    records = build_records(record_count)
+    # every tracked record is one of the Salesforce records, ids are record-000000 and up
+    for i, record in enumerate(records):
+        record["Id"] = f"record-{i:06d}"
+    items = [{"id": f"record-{i:06d}", "lastUpdated": "2026-10-16T00:00:00.000z"} for i in range(tracked_count)]
+
+    table = FakeTable(items)
+    start = time.perf_counter()
+    found_linear = linear_search(table, records)
+    linear_seconds = time.perf_counter() - start
+
+    table = FakeTable(items)
+    start = time.perf_counter()
+    state = module.load_state(table)
+    found_indexed = sum(1 for record in records if record["Id"] in state)
+    indexed_seconds = time.perf_counter() - start
+
+    print(f"{tracked_count} tracked records, {record_count} salesforce records")
+    print(f"scan + linear search: {linear_seconds:.3f}s, {found_linear} found (first scan page only)")
+    print(f"load_state + dict:    {indexed_seconds:.3f}s, {found_indexed} found in {table.scans} scan pages")
+    print(f"speedup:              {linear_seconds / max(indexed_seconds, 1e-9):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
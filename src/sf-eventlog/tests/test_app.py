@@ -0,0 +1,610 @@
+import gzip
+import importlib.util
+import io
+import json
+import sys
+import threading
+import time
+import types
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+
+MODULE_PATH = Path(__file__).resolve().parents[1] / "app.py"
+
+
+def parse_datetime(value):
+    value = value.replace("z", "+00:00").replace("Z", "+00:00").replace("+0000", "+00:00")
+    return datetime.fromisoformat(value)
+
+
+def load_app_module():
+    fake_boto3 = types.ModuleType("boto3")
+    fake_boto3.resource = MagicMock(name="dynamodb_resource")
+
+    fake_ciso8601 = types.ModuleType("ciso8601")
+    fake_ciso8601.parse_datetime = parse_datetime
+
+
+    module_name = "sf_eventlog_app_test"
+    spec = importlib.util.spec_from_file_location(module_name, MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+
+    with patch.dict(
+        sys.modules,
+        {
+            "boto3": fake_boto3,
+            "ciso8601": fake_ciso8601,
+        },
+    ):
+        spec.loader.exec_module(module)
+
+    return module
+
+
+def build_records(count, day="2026-10-16"):
+    return [
+        {
+            "Id": f"record-{i:03d}",
+            "EventType": "API",
+            "LogFile": f"/services/data/v55.0/sobjects/EventLogFile/record-{i:03d}/LogFile",
+            "LogDate": f"{day}T{i % 24:02d}:00:00.000+0000",
+        }
+        for i in range(count)
+    ]
+
+
+class RemainingTime:
+    def __init__(self, millis, step=0):
+        self.millis = millis
+        self.step = step
+
+    def __call__(self):
+        remaining = self.millis
+        self.millis -= self.step
+        return remaining
+
+
+class ProcessRecordsTests(unittest.TestCase):
+    def setUp(self):
+        self.module = load_app_module()
+        self.context = SimpleNamespace(get_remaining_time_in_millis=RemainingTime(300000))
+        self.shipper = MagicMock(name="shipper")
+
+    def process(self, records, state):
+        results = self.module.process_records(
+            "token", "example.my.salesforce.com", {"": records}, state, self.context, self.shipper
+        )
+        return results[""]
+
+    def test_log_files_are_downloaded_concurrently_and_returned_in_order(self):
+        records = build_records(12)
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def record_logic(access_token, domain, record, shipper, context, progress):
+            with lock:
+                running.append(record["Id"])
+                peak.append(len(running))
+            time.sleep(0.01 * (int(record["Id"][-3:]) % 3))
+            with lock:
+                running.remove(record["Id"])
+            return None if record["Id"] == "record-004" else 1
+
+        with patch.object(self.module, "DOWNLOAD_CONCURRENCY", 4), patch.object(
+            self.module, "record_logic", side_effect=record_logic
+        ):
+            items_to_add, last_record, early_end, _ = self.process(records, {})
+
+        self.assertEqual(records[11], last_record)
+        self.assertFalse(early_end)
+        self.assertEqual([record for record in records if record["Id"] != "record-004"], items_to_add)
+        self.assertLessEqual(max(peak), 4)
+        self.assertGreater(max(peak), 1)
+
+    def test_records_already_in_the_db_are_not_downloaded_again(self):
+        records = build_records(3)
+
+        with patch.object(self.module, "record_logic", return_value=1) as record_logic:
+            items_to_add, last_record, _, _ = self.process(records, {"record-001": {"id": "record-001", "lastUpdated": "2026-10-16T01:00:00.000z"}})
+
+        self.assertEqual(2, record_logic.call_count)
+        self.assertEqual([records[0], records[2]], items_to_add)
+        self.assertEqual(records[2], last_record)
+
+    def test_submission_stops_when_the_time_budget_runs_out(self):
+        records = build_records(10)
+        self.context.get_remaining_time_in_millis = RemainingTime(45000, step=5000)
+
+        with patch.object(self.module, "record_logic", return_value=1) as record_logic:
+            items_to_add, last_record, early_end, _ = self.process(records, {})
+
+        self.assertTrue(early_end)
+        self.assertEqual(4, record_logic.call_count)
+        self.assertEqual(records[3], last_record)
+        self.assertEqual(records[:4], items_to_add)
+
+    def test_event_types_take_turns_so_a_busy_type_does_not_starve_the_others(self):
+        busy = build_records(50)
+        quiet = [dict(record, Id="login-%d" % i, EventType="Login") for i, record in enumerate(build_records(3))]
+        self.context.get_remaining_time_in_millis = RemainingTime(100000, step=5000)
+
+        with patch.object(self.module, "record_logic", return_value=1):
+            results = self.module.process_records(
+                "token", "example.my.salesforce.com", {"API": iter(busy), "Login": iter(quiet)}, {}, self.context, self.shipper
+            )
+
+        self.assertEqual((quiet, quiet[-1], False, []), results["Login"])
+        items_to_add, last_record, early_end, _ = results["API"]
+        self.assertTrue(early_end)
+        self.assertEqual(busy[:len(items_to_add)], items_to_add)
+        self.assertEqual(items_to_add[-1], last_record)
+        self.assertLess(len(items_to_add), len(busy))
+
+    def test_failed_downloads_are_not_saved(self):
+        records = build_records(2)
+
+        with patch.object(self.module, "record_logic", side_effect=[1, TimeoutError("timed out")]):
+            items_to_add, last_record, _, _ = self.process(records, {})
+
+        self.assertEqual([records[0]], items_to_add)
+        self.assertEqual(records[1], last_record)
+
+    def test_partly_sent_log_files_hold_the_checkpoint_and_are_resumed(self):
+        records = build_records(4)
+        progress = {"offset": 2048, "rows": 10, "fieldnames": ["EVENT_TYPE"]}
+        state = {"record-000": {"id": "record-000", "lastUpdated": "2026-10-16T00:00:00.000z", "offset": 1024, "rows": 5}}
+
+        def record_logic(access_token, domain, record, shipper, context, saved_progress):
+            self.assertEqual(state["record-000"] if record["Id"] == "record-000" else None, saved_progress)
+            return progress if record["Id"] == "record-001" else 1
+
+        with patch.object(self.module, "record_logic", side_effect=record_logic) as patched:
+            items_to_add, last_record, early_end, in_progress = self.process(records, state)
+
+        self.assertEqual(4, patched.call_count)
+        self.assertTrue(early_end)
+        self.assertEqual(records[1], last_record)
+        self.assertEqual([records[0], records[2], records[3]], items_to_add)
+        self.assertEqual([(records[1], progress)], in_progress)
+
+
+class RecordsListTests(unittest.TestCase):
+    def setUp(self):
+        self.module = load_app_module()
+        self.records = build_records(5)
+
+    def page(self, start, end, next_url=None):
+        return {"records": self.records[start:end], "done": next_url is None, "nextRecordsUrl": next_url}
+
+    def test_pages_are_followed_lazily(self):
+        pages = {
+            "/services/data/v55.0/query/next-1": self.page(2, 4, "/services/data/v55.0/query/next-2"),
+            "/services/data/v55.0/query/next-2": self.page(4, 5),
+        }
+        requested = []
+
+        def get_records_page(access_token, domain, path):
+            requested.append(path)
+            return pages.get(path, self.page(0, 2, "/services/data/v55.0/query/next-1"))
+
+        with patch.object(self.module, "get_records_page", side_effect=get_records_page):
+            records = self.module.get_records_list("token", "example.my.salesforce.com", "2026-10-16T00:00:00.000z", "")
+            first = next(records)
+            self.assertLessEqual(len(requested), 2)
+            remaining = list(records)
+
+        self.assertEqual(self.records, [first] + remaining)
+        self.assertIn("WHERE+Interval+=+'Daily'+AND+LogDate+>=+2026-10-16T00:00:00.000z", requested[0])
+        self.assertEqual(3, len(requested))
+
+    def test_hourly_log_files_are_listed_by_creation_date(self):
+        with patch.object(self.module, "LOG_INTERVAL", "Hourly"), patch.object(
+            self.module, "CHECKPOINT_FIELD", "CreatedDate"
+        ), patch.object(self.module, "get_records_page", return_value=self.page(0, 0)) as get_records_page:
+            list(self.module.get_records_list("token", "example.my.salesforce.com", "2026-10-16T09:00:00.000000z", "Login"))
+
+        path = get_records_page.call_args.args[2]
+        self.assertIn("+Sequence+", path)
+        self.assertIn("WHERE+Interval+=+'Hourly'+AND+CreatedDate+>=+2026-10-16T09:00:00.000000z+AND+EventType+=+'Login'", path)
+        self.assertTrue(path.endswith("+ORDER+BY+CreatedDate+ASC"))
+
+    def test_failed_next_page_ends_the_processing_early(self):
+        pages = [self.page(0, 2, "/services/data/v55.0/query/next-1"), None]
+        context = SimpleNamespace(get_remaining_time_in_millis=RemainingTime(300000))
+
+        with patch.object(self.module, "get_records_page", side_effect=lambda *args: pages.pop(0)), patch.object(
+            self.module, "record_logic", return_value=1
+        ):
+            records = self.module.get_records_list("token", "example.my.salesforce.com", "2026-10-16T00:00:00.000z", "")
+            items_to_add, last_record, early_end = self.module.process_records(
+                "token", "example.my.salesforce.com", {"": records}, {}, context, MagicMock()
+            )[""][:3]
+
+        self.assertTrue(early_end)
+        self.assertEqual(self.records[:2], items_to_add)
+        self.assertEqual(self.records[1], last_record)
+
+
+class CheckpointTests(unittest.TestCase):
+    def setUp(self):
+        self.module = load_app_module()
+        self.table = MagicMock(name="table")
+        self.batch = self.table.batch_writer.return_value.__enter__.return_value
+
+    def test_event_types_start_from_the_single_checkpoint_of_earlier_deployments(self):
+        state = {"0": {"id": "0", "lastUpdated": "2026-10-15T00:00:00.000z"}}
+
+        self.assertEqual("2026-10-15T00:00:00.000z", self.module.get_last_update(self.table, state, "Login"))
+        self.table.put_item.assert_called_once_with(Item={"id": "0-Login", "lastUpdated": "2026-10-15T00:00:00.000z"})
+        self.assertEqual("2026-10-15T00:00:00.000z", self.module.get_last_update(self.table, state, "Login"))
+        self.assertEqual(1, self.table.put_item.call_count)
+
+    def test_hourly_log_files_have_their_own_checkpoint_by_creation_date(self):
+        state = {"0": {"id": "0", "lastUpdated": "2026-10-15T00:00:00.000z"}}
+        records = [
+            dict(record, Interval="Hourly", Sequence=1, CreatedDate="2026-10-16T0%d:30:00.000+0000" % i)
+            for i, record in enumerate(build_records(2))
+        ]
+
+        with patch.object(self.module, "LOG_INTERVAL", "Hourly"), patch.object(self.module, "CHECKPOINT_FIELD", "CreatedDate"):
+            last_update = self.module.get_last_update(self.table, state, "Login")
+            self.module.update_checkpoint(self.table, state, "Login", records, records[-1])
+
+        self.assertTrue(last_update.endswith(":00:00.000000z"))
+        self.assertNotEqual("2026-10-15T00:00:00.000z", last_update)
+        self.batch.put_item.assert_any_call(Item={"id": "0-Hourly-Login", "lastUpdated": "2026-10-16T01:30:00z"})
+        self.batch.put_item.assert_any_call(
+            Item={"id": "record-001", "lastUpdated": "2026-10-16T01:30:00.000z", "eventType": "Login"}
+        )
+
+    def test_checkpoint_update_only_deletes_records_of_the_same_event_type(self):
+        state = {
+            "0-API": {"id": "0-API", "lastUpdated": "2026-10-15T00:00:00.000z"},
+            "0-Login": {"id": "0-Login", "lastUpdated": "2026-10-15T00:00:00.000z"},
+            "api-old": {"id": "api-old", "lastUpdated": "2026-10-15T00:00:00.000z", "eventType": "API"},
+            "login-old": {"id": "login-old", "lastUpdated": "2026-10-15T00:00:00.000z", "eventType": "Login"},
+            "legacy-old": {"id": "legacy-old", "lastUpdated": "2026-10-15T00:00:00.000z"},
+        }
+        records = build_records(3)
+
+        with patch.object(self.module, "EVENT_TYPES", ["API", "Login"]):
+            self.module.update_checkpoint(self.table, state, "API", records, records[-1])
+
+        self.batch.put_item.assert_any_call(Item={"id": "0-API", "lastUpdated": "2026-10-16T02:00:00z"})
+        self.batch.put_item.assert_any_call(
+            Item={"id": "record-002", "lastUpdated": "2026-10-16T02:00:00.000z", "eventType": "API"}
+        )
+        self.assertEqual(2, self.batch.put_item.call_count)
+        self.assertEqual(["api-old"], [call.kwargs["Key"]["id"] for call in self.batch.delete_item.call_args_list])
+
+    def test_records_of_earlier_deployments_are_kept_until_every_event_type_is_past_them(self):
+        state = {
+            "0-API": {"id": "0-API", "lastUpdated": "2026-10-15T00:00:00.000z"},
+            "0-Login": {"id": "0-Login", "lastUpdated": "2026-10-15T00:00:00.000z"},
+            "legacy-old": {"id": "legacy-old", "lastUpdated": "2026-10-15T00:00:00.000z"},
+        }
+        records = build_records(3)
+
+        with patch.object(self.module, "EVENT_TYPES", ["API", "Login"]):
+            self.module.update_checkpoint(self.table, state, "API", records, records[-1])
+            self.batch.delete_item.assert_not_called()
+            self.module.update_checkpoint(self.table, state, "Login", records, records[0])
+
+        self.assertEqual(["legacy-old"], [call.kwargs["Key"]["id"] for call in self.batch.delete_item.call_args_list])
+
+    def test_partly_sent_records_are_saved_with_their_progress(self):
+        records = build_records(3)
+        progress = {"offset": 2048, "rows": 10, "fieldnames": ["EVENT_TYPE"]}
+
+        self.module.update_checkpoint(self.table, {}, "API", [records[0], records[2]], records[1], [(records[1], progress)])
+
+        self.batch.put_item.assert_any_call(Item={"id": "0-API", "lastUpdated": "2026-10-16T01:00:00z"})
+        self.batch.put_item.assert_any_call(Item={
+            "id": "record-001", "lastUpdated": "2026-10-16T01:00:00.000z", "eventType": "API",
+            "offset": 2048, "rows": 10, "fieldnames": ["EVENT_TYPE"],
+        })
+        # the records after the partly sent one are listed again, they must not be sent twice
+        self.batch.put_item.assert_any_call(
+            Item={"id": "record-002", "lastUpdated": "2026-10-16T02:00:00.000z", "eventType": "API"}
+        )
+        self.assertEqual(3, self.batch.put_item.call_count)
+
+
+class LoadStateTests(unittest.TestCase):
+    def test_every_scan_page_is_loaded(self):
+        module = load_app_module()
+        table = MagicMock(name="table")
+        table.scan.side_effect = [
+            {"Items": [{"id": "0", "lastUpdated": "2026-10-16T00:00:00.000z"}], "LastEvaluatedKey": {"id": "0"}},
+            {"Items": [{"id": "record-001", "lastUpdated": "2026-10-16T00:00:00.000z"}]},
+        ]
+
+        state = module.load_state(table)
+
+        self.assertEqual({"0", "record-001"}, set(state))
+        table.scan.assert_called_with(ExclusiveStartKey={"id": "0"})
+
+
+class StreamingResponse(io.BytesIO):
+    """
+    A Salesforce response that fails when the whole body is read at once.
+    """
+
+    def __init__(self, body, chunk_size=8192, status=200):
+        super().__init__(body)
+        self.chunk_size = chunk_size
+        self.status = status
+        self.largest_read = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.chunk_size:
+            size = self.chunk_size
+        self.largest_read = max(self.largest_read, size)
+        return super().read(size)
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class RecordLogicTests(unittest.TestCase):
+    def setUp(self):
+        self.module = load_app_module()
+        self.record = build_records(1)[0]
+
+    def test_rows_are_parsed_and_sent_while_the_file_is_read(self):
+        rows = [f'"API","2026101600000{i % 10}.000","user-{i}","multi\nline {i}"' for i in range(5000)]
+        body = ('"EVENT_TYPE","TIMESTAMP","USER_ID","MESSAGE"\n' + "\n".join(rows) + "\n").encode("utf-8")
+        response = StreamingResponse(body)
+
+        sent = []
+        read_positions = []
+
+        def send(texts):
+            for text in texts:
+                sent.append(text)
+                if len(sent) == 10:
+                    read_positions.append(response.tell())
+
+        shipper = MagicMock(name="shipper")
+        shipper.send.side_effect = send
+
+        connection = MagicMock(name="connection")
+
+        with patch.object(self.module, "salesforce_get", return_value=(connection, response)):
+            result = self.module.record_logic("token", "example.my.salesforce.com", self.record, shipper)
+
+        self.assertEqual(1, result)
+        self.assertEqual(5000, len(sent))
+        self.assertEqual(
+            {"EVENT_TYPE": "API", "TIMESTAMP": "20261016000009.000", "USER_ID": "user-4999", "MESSAGE": "multi\nline 4999"},
+            json.loads(sent[-1]),
+        )
+        # the first rows are sent before the rest of the file is read
+        self.assertLess(read_positions[0], len(body))
+        self.assertLessEqual(response.largest_read, response.chunk_size)
+        self.assertLess(response.chunk_size, len(body))
+        self.assertEqual([connection], self.module.get_connection_pool("example.my.salesforce.com").connections)
+
+    def test_invalid_utf8_is_reported_as_a_failure(self):
+        response = StreamingResponse(b'"EVENT_TYPE"\n"\xff\xfe"\n')
+
+        connection = MagicMock(name="connection")
+
+        with patch.object(self.module, "salesforce_get", return_value=(connection, response)):
+            result = self.module.record_logic(
+                "token", "example.my.salesforce.com", self.record, MagicMock(send=lambda texts: len(list(texts)))
+            )
+
+        self.assertIsNone(result)
+        connection.close.assert_called_once_with()
+
+    def resume(self, body, status, progress, remaining):
+        sent = []
+        context = SimpleNamespace(get_remaining_time_in_millis=lambda: remaining)
+        with patch.object(
+            self.module, "salesforce_get", return_value=(MagicMock(name="connection"), StreamingResponse(body, status=status))
+        ) as salesforce_get:
+            result = self.module.record_logic(
+                "token", "example.my.salesforce.com", self.record, MagicMock(send=lambda texts: sent.extend(texts)),
+                context, progress,
+            )
+        return result, [json.loads(text)["ROW"] for text in sent], salesforce_get.call_args.kwargs["headers"]
+
+    def test_log_files_cut_by_the_timeout_are_resumed_from_their_byte_offset(self):
+        body = ('"ROW","MESSAGE"\n' + "".join(f'"{i}","multi\nline {i}"\n' for i in range(100))).encode("utf-8")
+
+        # less time than DOWNLOAD_END_MILLIS is left, so the download stops after the first row
+        progress, first, headers = self.resume(body, 200, None, 1000)
+        self.assertIsNone(headers)
+        self.assertEqual(["0"], first)
+        self.assertEqual({"offset": body.index(b'"1"'), "rows": 1, "fieldnames": ["ROW", "MESSAGE"]}, progress)
+
+        result, rest, headers = self.resume(body[progress["offset"]:], 206, progress, 300000)
+        self.assertEqual(1, result)
+        self.assertEqual({"Range": "bytes=%d-" % progress["offset"]}, headers)
+        self.assertEqual([str(i) for i in range(100)], first + rest)
+
+        # a server that ignores the range sends the whole file again, the rows already sent are skipped
+        result, rest, _ = self.resume(body, 200, progress, 300000)
+        self.assertEqual(1, result)
+        self.assertEqual([str(i) for i in range(1, 100)], rest)
+
+
+class RowTextsTests(unittest.TestCase):
+    def setUp(self):
+        self.module = load_app_module()
+        self.rows = [
+            {"EVENT_TYPE": "API", "USER_TYPE": "Standard", "CPU_TIME": "12", "RUN_TIME": "3.5", "DB_BLOCKS": "",
+             "TIMESTAMP_DERIVED": "2026-10-16T00:00:01.250Z", "URI": "/services/data"},
+            {"EVENT_TYPE": "API", "USER_TYPE": "Automated", "CPU_TIME": "7", "RUN_TIME": "1",
+             "TIMESTAMP_DERIVED": "2026-10-16T00:00:02.000Z", "URI": "/services/data"},
+        ]
+
+    def texts(self, **config):
+        with patch.multiple(self.module, LOGS_TO_STDOUT="False", **config):
+            return list(self.module.row_texts(iter(self.rows)))
+
+    def test_rows_are_sent_unchanged_by_default(self):
+        self.assertEqual([json.dumps(row) for row in self.rows], self.texts())
+
+    def test_rows_are_filtered_projected_and_typed(self):
+        texts = self.texts(
+            FIELDS=["EVENT_TYPE", "CPU_TIME", "RUN_TIME", "DB_BLOCKS", "MISSING"],
+            row_predicates=self.module.parse_row_filter("USER_TYPE=Automated, URI!=/services/data"),
+            TYPED_FIELDS="True",
+        )
+
+        self.assertEqual(1, len(texts))
+        timestamp, text = texts[0]
+        self.assertEqual(datetime(2026, 10, 16, 0, 0, 1, 250000, tzinfo=timezone.utc).timestamp() * 1000, timestamp)
+        self.assertEqual({"EVENT_TYPE": "API", "CPU_TIME": 12, "RUN_TIME": 3.5, "DB_BLOCKS": None}, json.loads(text))
+
+    def test_invalid_row_filters_are_rejected(self):
+        self.assertEqual([("USER_TYPE", "!=", "Standard")], self.module.parse_row_filter("USER_TYPE!=Standard,"))
+        self.assertEqual([], self.module.parse_row_filter(""))
+        self.assertIsNone(self.module.parse_row_filter("USER_TYPE"))
+        self.assertIsNone(self.module.parse_row_filter("=Standard"))
+
+
+class SalesforceSessionTests(unittest.TestCase):
+    def setUp(self):
+        self.module = load_app_module()
+
+    def test_token_is_cached_until_it_expires(self):
+        token = {"access_token": "token-1", "issued_at": None, "expires_in": None}
+
+        with patch.object(self.module, "request_token", return_value=token) as request_token:
+            self.assertEqual("token-1", self.module.get_token())
+            self.assertEqual("token-1", self.module.get_token())
+            self.module.token_cache["expires_at"] = 0
+            self.assertEqual("token-1", self.module.get_token())
+
+        self.assertEqual(2, request_token.call_count)
+
+    def test_rejected_token_is_refreshed_once_and_the_request_is_sent_again(self):
+        responses = [
+            SimpleNamespace(status=401, reason="Unauthorized", read=lambda: b""),
+            SimpleNamespace(status=200, reason="OK", read=lambda: b"{}"),
+        ]
+        pool = MagicMock(name="pool")
+        pool.request.side_effect = lambda method, path, headers: (MagicMock(), responses.pop(0))
+        self.module.token_cache.update({"access_token": "old", "expires_at": time.time() + 3600})
+        new_token = {"access_token": "new", "issued_at": None, "expires_in": None}
+
+        with patch.object(self.module, "get_connection_pool", return_value=pool), patch.object(
+            self.module, "request_token", return_value=new_token
+        ):
+            _, response = self.module.salesforce_get("example.my.salesforce.com", "/services/data", "old")
+
+        self.assertEqual(200, response.status)
+        self.assertEqual(
+            ["Bearer old", "Bearer new"],
+            [call.kwargs["headers"]["Authorization"] for call in pool.request.call_args_list],
+        )
+
+    def test_requests_use_the_token_refreshed_by_another_request(self):
+        pool = MagicMock(name="pool")
+        pool.request.return_value = (MagicMock(), SimpleNamespace(status=200, reason="OK", read=lambda: b"{}"))
+        self.module.token_cache.update({"access_token": "new", "expires_at": time.time() + 3600})
+
+        with patch.object(self.module, "get_connection_pool", return_value=pool), patch.object(
+            self.module, "request_token"
+        ) as request_token:
+            self.module.salesforce_get("example.my.salesforce.com", "/services/data", "old")
+
+        self.assertEqual("Bearer new", pool.request.call_args.kwargs["headers"]["Authorization"])
+        request_token.assert_not_called()
+
+    def test_pool_reuses_connections_and_replaces_the_ones_closed_by_the_server(self):
+        stale = MagicMock(name="stale")
+        stale.request.side_effect = self.module.http.client.RemoteDisconnected("closed")
+        fresh = MagicMock(name="fresh")
+        pool = self.module.ConnectionPool("example.my.salesforce.com")
+        pool.release(stale)
+
+        with patch.object(self.module.http.client, "HTTPSConnection", return_value=fresh) as connect:
+            connection, _ = pool.request("GET", "/services/data")
+            pool.release(connection)
+            reused, _ = pool.request("GET", "/services/data")
+
+        self.assertIs(fresh, connection)
+        self.assertIs(fresh, reused)
+        stale.close.assert_called_once_with()
+        connect.assert_called_once_with("example.my.salesforce.com", timeout=30)
+
+
+class FakeConnection:
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.bodies = []
+        self.closed = False
+
+    def request(self, method, path, body, headers):
+        self.bodies.append(json.loads(gzip.decompress(body)))
+        self.headers = headers
+
+    def getresponse(self):
+        return SimpleNamespace(status=self.statuses.pop(0), read=lambda: b"")
+
+    def close(self):
+        self.closed = True
+
+
+class CoralogixShipperTests(unittest.TestCase):
+    def setUp(self):
+        self.module = load_app_module()
+        self.shipper = self.module.CoralogixShipper(
+            "https://ingress.coralogix.com/api/v1/logs", "key", "app", "subsystem", max_batch_bytes=1000
+        )
+
+    def test_lines_are_sent_in_size_capped_gzip_batches_over_one_connection(self):
+        connection = FakeConnection([200] * 10)
+        texts = [json.dumps({"ROW": i, "PADDING": "x" * 50}) for i in range(40)]
+
+        with patch.object(self.module.http.client, "HTTPSConnection", return_value=connection) as connect:
+            sent = self.shipper.send(iter(texts))
+
+        self.assertEqual(40, sent)
+        connect.assert_called_once_with("ingress.coralogix.com", timeout=30)
+        self.assertEqual("gzip", connection.headers["Content-Encoding"])
+        self.assertGreater(len(connection.bodies), 1)
+        for body in connection.bodies:
+            self.assertEqual(("key", "app", "subsystem"), (body["privateKey"], body["applicationName"], body["subsystemName"]))
+            self.assertLessEqual(len(json.dumps(body["logEntries"])), 1100)
+        self.assertEqual(texts, [entry["text"] for body in connection.bodies for entry in body["logEntries"]])
+
+    def test_failed_batches_are_retried_and_rejected_batches_raise(self):
+        connection = FakeConnection([503, 200, 400])
+
+        with patch.object(self.module.http.client, "HTTPSConnection", return_value=connection), patch.object(
+            self.module.time, "sleep"
+        ):
+            self.assertEqual(1, self.shipper.send(["first"]))
+            with self.assertRaises(self.module.ShipperError):
+                self.shipper.send(["second"])
+
+        self.assertEqual(["first", "first", "second"], [body["logEntries"][0]["text"] for body in connection.bodies])
+
+    def test_texts_can_carry_their_log_timestamp(self):
+        connection = FakeConnection([200])
+
+        with patch.object(self.module.http.client, "HTTPSConnection", return_value=connection):
+            self.shipper.send([(1760572801250.0, "first"), "second"])
+
+        entries = connection.bodies[0]["logEntries"]
+        self.assertEqual((1760572801250, "first"), (entries[0]["timestamp"], entries[0]["text"]))
+        self.assertGreater(entries[1]["timestamp"], entries[0]["timestamp"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import re
+import unittest
+from pathlib import Path
+
+
+TEMPLATE_PATH = Path(__file__).resolve().parents[1] / "template.yaml"
+
+
+class SfEventlogTemplateTests(unittest.TestCase):
+    def test_one_hour_schedule_uses_the_singular_rate_unit(self):
+        template = TEMPLATE_PATH.read_text()
+
+        self.assertIsNotNone(re.search(r"IsHourlySchedule: !Equals\n\s+- !Ref FunctionSchedule\n\s+- 1\n", template))
+        match = re.search(r"Schedule: !If\n((?:\s+- .*\n){3})", template)
+
+        self.assertIsNotNone(match)
+        self.assertEqual(
+            [
+                "- IsHourlySchedule",
+                "- 'rate(1 hour)'",
+                "- !Sub 'rate(${FunctionSchedule} hours)'",
+            ],
+            [line.strip() for line in match.group(1).splitlines()],
+        )
+        self.assertNotIn("rate(1 hours)", template)
+
+
+if __name__ == "__main__":
+    unittest.main()